@@ -0,0 +1,199 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:32:14
+
+import re
+import json
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, Any, List, Tuple, Union
+
+from . import constants as cs
+from .model import Campaign, Segment
+from .utils import logs, render_table
+
+
+fields = ["JobID", "State", "ExitCode", "Submit", "Start", "End", "Elapsed", "TotalCPU", "MaxRSS", "NodeList", "NNodes", "AllocCPUS"]
+
+
+def duration(text: str) -> float:
+    """Seconds from sacct durations: [D-][HH:]MM:SS[.mmm]"""
+    if text in ("", "INVALID", "UNLIMITED"): return 0.
+    days = 0
+    if '-' in text:
+        d, text = text.split('-')
+        days = int(d)
+    parts = [float(p) for p in text.split(':')]
+    while len(parts) < 3: parts.insert(0, 0.)
+    h, m, s = parts
+    return ((days * 24 + h) * 60 + m) * 60 + s
+
+
+def memory(text: str) -> Union[int, None]:
+    """Bytes from sacct memory: 1234K, 5.5M, 2G"""
+    m = re.match(r"^([\d.]+)([KMGTP]?)$", text)
+    if m is None: return None
+    return int(float(m.group(1)) * 1024 ** "BKMGTP".index(m.group(2) or "B"))
+
+
+def timestamp(text: str) -> Union[float, None]:
+    try: return datetime.fromisoformat(text).timestamp()
+    except ValueError: return None  # Unknown, None
+
+
+def parse_sacct(text: str) -> Dict[str, Dict[str, Any]]:
+    """Records of jobs from 'sacct -P -n' output with the columns of fields, job steps are folded into their job
+
+    Allocation line has times, state and TotalCPU of the whole job, MaxRSS is reported by steps only.
+    """
+    jobs: Dict[str, Dict[str, Any]] = {}
+    for line in text.splitlines():
+        if line.strip() == "": continue
+        row = dict(zip(fields, line.split('|')))
+        if len(row) != len(fields): raise ValueError(f"Unexpected sacct line: '{line}'")
+        jobid, _, step = row["JobID"].partition('.')
+        rss = memory(row["MaxRSS"])
+        if step:
+            if jobid in jobs and rss is not None: jobs[jobid]["max_rss"] = max(jobs[jobid]["max_rss"] or 0, rss)
+            continue
+        submit, start = timestamp(row["Submit"]), timestamp(row["Start"])
+        jobs[jobid] = {
+            "state": row["State"].split()[0],
+            "exit_code": row["ExitCode"],
+            "submit": row["Submit"],
+            "start": row["Start"],
+            "end": row["End"],
+            "queue_wait": start - submit if start is not None and submit is not None else None,
+            "elapsed": duration(row["Elapsed"]),
+            "total_cpu": duration(row["TotalCPU"]),
+            "max_rss": jobs.get(jobid, {}).get("max_rss") or rss,
+            "nodes": row["NodeList"],
+            "nnodes": int(row["NNodes"] or 0),
+            "cpus": int(row["AllocCPUS"] or 0),
+        }
+    return jobs
+
+
+def sacct(jobids: List[str]) -> str:
+    """All jobs in one call"""
+    cmd = ["sacct", "-P", "-n", "-j", ",".join(jobids), "--format=" + ",".join(fields)]
+    res = subprocess.run(cmd, capture_output=True, text=True)
+    if res.returncode != 0: raise RuntimeError(f"sacct failed: {res.stderr.strip()}")
+    return res.stdout
+
+
+def ordered(campaign: Campaign) -> List[Tuple[str, Segment]]:
+    segments = [(label.name, seg) for label in campaign.labels for seg in label.segments if seg.jobid is not None and seg.run_no is not None]
+    return sorted(segments, key=lambda p: p[1].run_no)  # type: ignore
+
+
+def efficiency(campaign: Campaign) -> Dict[str, Any]:
+    """Useful steps per allocated core-hour, queue share and node-hours lost to failed or duplicated segments
+
+    A segment starts where it was decided to (from_step) or where the previous one ended, it ends where
+    the next restart found its checkpoint. Segments packed into one allocation share it evenly. Segment
+    that did not advance is failed, one started from the same label and step as an earlier segment that
+    advanced is duplicated. The last segment is not judged until the next restart records its end.
+    """
+    segments = ordered(campaign)
+    sharing: Dict[int, int] = {}
+    for _, seg in segments: sharing[seg.jobid] = sharing.get(seg.jobid, 0) + 1  # type: ignore
+    steps, core_hours, waited, ran, lost = 0, 0., 0., 0., 0.
+    failed, duplicated = 0, 0
+    advanced_from = set()
+    previous = 0
+    for i, (name, seg) in enumerate(segments):
+        acc = seg.extra.get(cs.sf.accounting)
+        start = seg.extra.get(cs.sf.from_step, previous)
+        if seg.last_step is not None: previous = seg.last_step
+        if acc is None or acc["state"] == "PENDING": continue
+        waited += acc["queue_wait"] or 0.
+        ran += acc["elapsed"]
+        if seg.last_step is None and i == len(segments) - 1: continue
+        share = sharing[seg.jobid]  # type: ignore
+        core_hours += acc["elapsed"] * acc["cpus"] / 3600 / share
+        node_hours = acc["elapsed"] * acc["nnodes"] / 3600 / share
+        advanced = seg.last_step - start if seg.last_step is not None else 0
+        if (name, start) in advanced_from:
+            duplicated += 1
+            lost += node_hours
+        elif advanced <= 0:
+            failed += 1
+            lost += node_hours
+        else:
+            steps += advanced
+            advanced_from.add((name, start))
+    return {
+        "segments": len(segments),
+        "useful_steps": steps,
+        "core_hours": core_hours,
+        "steps_per_core_hour": steps / core_hours if core_hours > 0 else None,
+        "queue_hours": waited / 3600,
+        "run_hours": ran / 3600,
+        "queue_share": waited / (waited + ran) if waited + ran > 0 else None,
+        "failed": failed,
+        "duplicated": duplicated,
+        "lost_node_hours": lost,
+    }
+
+
+def report(campaign: Campaign, res: Dict[str, Any]) -> str:
+    rows = [["segment", "job", "state", "wait h", "elapsed h", "cpu h", "max rss MB", "nodes"]]
+    for name, seg in ordered(campaign):
+        acc = seg.extra.get(cs.sf.accounting)
+        if acc is None:
+            rows.append([f"{name}{seg.num}", str(seg.jobid), "-", "-", "-", "-", "-", "-"])
+            continue
+        rows.append([
+            f"{name}{seg.num}", str(seg.jobid), acc["state"],
+            "-" if acc["queue_wait"] is None else f"{acc['queue_wait'] / 3600:.2f}",
+            f"{acc['elapsed'] / 3600:.2f}", f"{acc['total_cpu'] / 3600:.1f}",
+            "-" if acc["max_rss"] is None else f"{acc['max_rss'] / 1024 ** 2:.0f}", acc["nodes"]
+        ])
+    lines = render_table(rows).split("\n")
+    spch = "-" if res["steps_per_core_hour"] is None else f"{res['steps_per_core_hour']:.1f}"
+    share = "-" if res["queue_share"] is None else f"{res['queue_share'] * 100:.1f}%"
+    lines += [
+        "",
+        f"Useful steps:        {res['useful_steps']}",
+        f"Core-hours:          {res['core_hours']:.1f}",
+        f"Steps per core-hour: {spch}",
+        f"Queue/run time:      {res['queue_hours']:.1f} h / {res['run_hours']:.1f} h (queue share {share})",
+        f"Lost node-hours:     {res['lost_node_hours']:.1f} ({res['failed']} failed, {res['duplicated']} duplicated segments)",
+    ]
+    return "\n".join(lines)
+
+
+@logs
+def accounting() -> int:
+    args = cs.sp.args
+    campaign = Campaign.from_state(cs.sp.state)
+    jobids = sorted({str(seg.jobid) for _, seg in ordered(campaign)})
+    if len(jobids) == 0:
+        cs.sp.logger.warning("No segments were submitted yet")
+        return 0
+    if args.sacct is not None:
+        with Path(args.sacct).open('r') as fp: text = fp.read()
+    else: text = sacct(jobids)
+    jobs = parse_sacct(text)
+    cs.sp.logger.info(f"Accounting found for {len(jobs)} of {len(jobids)} jobs")
+
+    for _, seg in ordered(campaign):
+        if (acc := jobs.get(str(seg.jobid))) is not None: seg.extra[cs.sf.accounting] = acc
+    campaign.to_state(cs.sp.state)
+
+    res = efficiency(campaign)
+    if args.json: print(json.dumps(res, indent=4))
+    else: print(report(campaign, res))
+    return 0
+
+
+if __name__ == "__main__":
+    pass
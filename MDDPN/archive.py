@@ -0,0 +1,173 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:32:37
+
+import io
+import os
+import re
+import sys
+import json
+import shutil
+import fnmatch
+import zipfile
+from pathlib import Path
+from typing import Dict, Any, List, Tuple, Union, TextIO
+
+from . import constants as cs
+from .model import Campaign, Label
+from .utils import logs, atomic_write
+
+
+# campaign folder -> (mtime of the index, index), index is relative path -> [archive, size, mtime]
+indexes: Dict[str, Tuple[int, Dict[str, List[Any]]]] = {}
+
+
+def index_file(folder: Path) -> Path:
+    return folder / cs.folders.archive / cs.files.archive_index
+
+
+def index(folder: Path) -> Dict[str, List[Any]]:
+    file = index_file(folder)
+    try: mtime = file.stat().st_mtime_ns
+    except FileNotFoundError: return {}
+    cached = indexes.get(folder.as_posix())
+    if cached is not None and cached[0] == mtime: return cached[1]
+    with file.open('r') as fp: idx = json.load(fp)
+    indexes[folder.as_posix()] = (mtime, idx)
+    return idx
+
+
+def campaign_of(path: Path) -> Union[Path, None]:
+    for parent in path.parents:
+        if (parent / cs.files.state).exists(): return parent
+    return None
+
+
+def files(folder: Path, sub: str, pattern: str) -> List[Tuple[Path, float]]:
+    """Files under folder/sub with names matching the pattern, on disk and archived, with modification times"""
+    res: List[Tuple[Path, float]] = []
+    for file in (folder / sub).rglob(pattern):
+        try: res.append((file, file.stat().st_mtime))
+        except FileNotFoundError: continue
+    for rel, (_, _, mtime) in index(folder).items():
+        if rel.startswith(sub + "/") and fnmatch.fnmatch(rel.rsplit("/", 1)[-1], pattern): res.append((folder / rel, mtime))
+    return res
+
+
+def open_text(path: Path) -> TextIO:
+    """Opens the file on disk or, if it was compacted, its copy inside the archive without extracting it"""
+    if path.exists() or (folder := campaign_of(path)) is None: return path.open('r', errors='replace')
+    rel = path.relative_to(folder).as_posix()
+    if (entry := index(folder).get(rel)) is None: raise FileNotFoundError(f"File {path.as_posix()} not found, neither on disk nor in archives")
+    with zipfile.ZipFile(folder / cs.folders.archive / entry[0]) as zf:
+        # the member keeps the archive open until it is closed itself
+        return io.TextIOWrapper(zf.open(rel), errors='replace')
+
+
+def label_complete(campaign: Campaign, label: Label) -> bool:
+    """Label ended and a restart went past its end, so nothing of it is running or will be regenerated"""
+    if label.end_step is None or len(campaign.events) == 0: return False
+    return max(e.step for e in campaign.events) >= label.end_step and campaign.events[-1].label != label.name
+
+
+def cutoff(campaign: Campaign, label: Label) -> float:
+    """Time of the first restart past the label, invocations logged before it belong to the label"""
+    return min(e.time for e in campaign.events if e.step >= label.end_step)
+
+
+def artifacts(folder: Path, campaign: Campaign, label: Label, state: Dict[str, Any]) -> List[Path]:
+    res: List[Path] = []
+    for seg in label.segments:
+        if seg.in_file is not None and (f := folder / cs.folders.in_file / seg.in_file).is_file(): res.append(f)
+    tokens = {f"{label.name}{seg.num}" for seg in label.segments}
+    jobids = {str(seg.jobid) for seg in label.segments if seg.jobid is not None}
+    if (slurm := folder / cs.folders.slurm).is_dir():
+        for entry in slurm.iterdir():
+            if entry.name in tokens or set(re.findall(r"\d+", entry.name)) & jobids:
+                res += [entry] if entry.is_file() else [f for f in entry.rglob('*') if f.is_file()]
+    if cs.sf.restart_files in state:
+        regex = re.compile(r"^" + re.escape(state[cs.sf.restart_files]) + r"\.(\d+)\..*dat$")
+        for f in (folder / cs.folders.restarts).rglob("*.dat"):
+            if (m := regex.match(f.name)) and label.begin_step <= int(m.group(1)) <= label.end_step: res.append(f)
+    # the log of this invocation is newer, pass log numbering continues after the archived ones
+    limit = cutoff(campaign, label)
+    if (logs_folder := folder / cs.folders.log / cs.folders.pass_log).is_dir():
+        res += [f for f in logs_folder.iterdir() if f.is_file() and f.stat().st_mtime < limit]
+    return res
+
+
+def write_index(folder: Path, idx: Dict[str, List[Any]]) -> None:
+    with atomic_write(index_file(folder)) as fp:
+        json.dump(idx, fp)
+
+
+def compact_label(folder: Path, name: str, paths: List[Path]) -> int:
+    """Adds files to the label archive, originals are removed only after the archive was verified and indexed
+
+    A file is indexed and removed only if it was written to the archive here: a file of the same name
+    archived before (in this archive or another one) is a different file and both are kept.
+    """
+    archive = folder / cs.folders.archive / f"{name}.zip"
+    tmp = archive.parent / f".{archive.name}.{os.getpid()}.tmp"
+    if archive.exists(): shutil.copy2(archive, tmp)
+    idx = dict(index(folder))
+    written: List[Path] = []
+    with zipfile.ZipFile(tmp, 'a', zipfile.ZIP_DEFLATED) as zf:
+        names = set(zf.namelist())
+        for path in paths:
+            rel = path.relative_to(folder).as_posix()
+            if rel in names or rel in idx:
+                cs.sp.logger.warning(f"{rel} is already archived as another file, keeping it on disk")
+                continue
+            st = path.stat()
+            zf.write(path, rel)
+            idx[rel] = [archive.name, st.st_size, st.st_mtime]
+            written.append(path)
+    if len(written) == 0:
+        tmp.unlink()
+        return 0
+    with zipfile.ZipFile(tmp) as zf:
+        if (bad := zf.testzip()) is not None: raise RuntimeError(f"Archive {tmp.as_posix()} is corrupted at {bad}")
+    os.replace(tmp, archive)
+    write_index(folder, idx)
+    for path in written:
+        path.unlink()
+        if folder / cs.folders.slurm not in path.parents: continue
+        for parent in path.parents:
+            if parent == folder / cs.folders.slurm or any(parent.iterdir()): break
+            parent.rmdir()
+    return len(written)
+
+
+@logs
+def compact() -> int:
+    """Packs artifacts of completed labels into one archive per label, or prints an archived file"""
+    folder = cs.sp.cwd
+    if cs.sp.args.cat is not None:
+        with open_text((folder / cs.sp.args.cat).absolute()) as fp: sys.stdout.write(fp.read())
+        return 0
+    if cs.sp.args.list:
+        for rel, (name, size, _) in sorted(index(folder).items()): print(f"{name}  {size:>10}  {rel}")
+        return 0
+    campaign = Campaign.from_state(cs.sp.state)
+    (folder / cs.folders.archive).mkdir(exist_ok=True)
+    total = 0
+    for label in campaign.labels:
+        if not label_complete(campaign, label): continue
+        paths = artifacts(folder, campaign, label, cs.sp.state)
+        if len(paths) == 0: continue
+        done = compact_label(folder, label.name, paths)
+        total += done
+        cs.sp.logger.info(f"Label '{label.name}': {done} files archived")
+    cs.sp.logger.info(f"{total} files archived")
+    return 0
+
+
+if __name__ == "__main__":
+    pass
@@ -6,18 +6,22 @@
 # This software is released under the MIT License.
 # https://opensource.org/licenses/MIT
 
-# Last modified: 03-05-2024 03:30:36
+# Last modified: 19-10-2026 14:32:14
 
 import json
+import shutil
+import hashlib
 from pathlib import Path
-from typing import Dict, Any, Union
+from typing import Dict, Any, Union, List
+from importlib import metadata
 
 import toml
 from MPMU import is_exe
 import pysbatch_ng as sbatch
 
 from . import constants as cs
-from .utils import logs
+from .utils import logs, atomic_write
+from .monitor import Condition
 
 
 @logs
@@ -86,6 +90,35 @@ def basic(conf: Dict[str, Any]) -> bool:
     if cs.cf.do_test_run in conf:
         cs.sp.run_tests = bool(conf[cs.cf.do_test_run])
 
+    if cs.cf.sect_monitor in conf:
+        cs.sp.monitor = conf[cs.cf.sect_monitor]
+        try:
+            for label, conds in cs.sp.monitor.get(cs.cf.conditions, {}).items():
+                for cond in conds: Condition.from_conf(cond)
+        except (KeyError, ValueError, TypeError) as e:
+            cs.sp.logger.error(f"Invalid stopping condition in '{cs.cf.sect_monitor}' section: {e}")
+            fl = False
+        if not isinstance(cs.sp.monitor.get(cs.cf.checkpoint_lead, 0), int) or cs.sp.monitor.get(cs.cf.checkpoint_lead, 0) < 0:
+            cs.sp.logger.error(f"'{cs.cf.sect_monitor}.{cs.cf.checkpoint_lead}' must be non-negative number of seconds")
+            fl = False
+        if not isinstance(cs.sp.monitor.get(cs.cf.staging, {}), dict):
+            cs.sp.logger.error(f"'{cs.cf.sect_monitor}.{cs.cf.staging}' must be a section")
+            fl = False
+        if len(streams := cs.sp.monitor.get(cs.cf.insitu, {})) > 0:
+            if not isinstance(streams.get(cs.cf.dumps), list) or not isinstance(streams.get(cs.cf.analyzer), str):
+                cs.sp.logger.error(f"'{cs.cf.sect_monitor}.{cs.cf.insitu}' must list '{cs.cf.dumps}' to stream and give '{cs.cf.analyzer}' command")
+                fl = False
+
+    cs.sp.history = conf.get(cs.cf.sect_history, {})
+    if len(cs.sp.history) > 0:
+        for key in (cs.cf.keep_raw, cs.cf.every):
+            if not isinstance(cs.sp.history.get(key, 0), int) or cs.sp.history.get(key, 0) < 0:
+                cs.sp.logger.error(f"'{cs.cf.sect_history}.{key}' must be non-negative integer")
+                fl = False
+        if cs.sp.history.get(cs.cf.compression, "zst") not in ("zst", "gz"):
+            cs.sp.logger.error(f"'{cs.cf.sect_history}.{cs.cf.compression}' must be 'zst' or 'gz'")
+            fl = False
+
     return fl
 
 
@@ -101,15 +134,20 @@ def gensconf(_conf: Dict[str, Any], section: str) -> Dict[str, Any]:
     return conf
 
 
+def conffile_lookup() -> Path:
+    if cs.sp.args.conf:
+        conffile = Path(cs.sp.args.conf).resolve()
+        cs.sp.logger.debug(f"Searching for specified conffile: '{conffile.as_posix()}'")
+    else:
+        conffile = cs.sp.cwd / (cs.files.config_toml if cs.sp.args.toml else cs.files.config_json)
+        cs.sp.logger.debug(f"Searching for conffile: '{conffile.as_posix()}'")
+    return conffile
+
+
 @logs
 def loadconf(conffile: Union[Path, None] = None, conf_format: Union[str, None] = None) -> Dict[str, Any]:
     if not conffile:
-        if cs.sp.args.conf:
-            conffile = Path(cs.sp.args.conf).resolve()
-            cs.sp.logger.debug(f"Searching for specified conffile: '{conffile.as_posix()}'")
-        else:
-            conffile = cs.sp.cwd / (cs.files.config_toml if cs.sp.args.toml else cs.files.config_json)
-            cs.sp.logger.debug(f"Searching for conffile: '{conffile.as_posix()}'")
+        conffile = conffile_lookup()
 
     if conffile.exists():
         cs.sp.conffile_path = conffile
@@ -173,6 +211,119 @@ def configure(conf: Dict[str, Any]) -> bool:
     return fl
 
 
+def version(distribution: str) -> str:
+    try: return metadata.version(distribution)
+    except metadata.PackageNotFoundError: return "unknown"
+
+
+def executables() -> List[str]:
+    return [cs.execs.lammps, cs.execs.lammps_nonmpi, cs.execs.MDDPN, cs.execs.spoll]
+
+
+def fingerprint(conffile: Path) -> Dict[str, Any]:
+    execs: Dict[str, Any] = {}
+    for exe in executables():
+        path = shutil.which(exe)
+        # optional executables (e.g. spoll) may be missing, that is recorded and checked like a path
+        execs[exe] = "absent" if path is None else [path, Path(path).stat().st_mtime_ns]
+    return {
+        'conffile': hashlib.sha256(conffile.read_bytes()).hexdigest(),
+        'execs': execs,
+        'MDDPN': version("MDDPN"),
+        'pysbatch_ng': version("pysbatch-ng")
+    }
+
+
+def fingerprint_matches(fp: Dict[str, Any], conffile: Path) -> bool:
+    if fp['conffile'] != hashlib.sha256(conffile.read_bytes()).hexdigest(): return False
+    if fp['MDDPN'] != version("MDDPN") or fp['pysbatch_ng'] != version("pysbatch-ng"): return False
+    for exe, rec in fp['execs'].items():
+        if rec == "absent":
+            if shutil.which(exe) is not None: return False
+            continue
+        if rec is None: return False  # cache written before missing executables were recorded
+        path, mtime = rec
+        try:
+            if Path(path).stat().st_mtime_ns != mtime: return False
+        except FileNotFoundError: return False
+    return True
+
+
+def resolved() -> Dict[str, Any]:
+    return {
+        'execs': {
+            cs.cf.lammps: cs.execs.lammps,
+            cs.cf.lammps_nonmpi: cs.execs.lammps_nonmpi,
+            cs.cf.MDDPN: cs.execs.MDDPN,
+            cs.cf.spoll: cs.execs.spoll
+        },
+        cs.cf.template: cs.files.template,
+        cs.cf.in_templates: cs.folders.in_templates,
+        cs.cf.sect_params: cs.sp.params,
+        cs.cf.post_processor: cs.sp.post_processor,
+        cs.cf.do_post: cs.sp.allow_post_process,
+        cs.cf.do_test_run: cs.sp.run_tests,
+        cs.cf.sect_sbatch_main: cs.sp.sconf_main,
+        cs.cf.sect_sbatch_post: cs.sp.sconf_post,
+        cs.cf.sect_sbatch_test: cs.sp.sconf_test,
+        cs.cf.sect_monitor: cs.sp.monitor,
+        cs.cf.sect_history: cs.sp.history
+    }
+
+
+def restore(conf: Dict[str, Any]) -> None:
+    execs = conf['execs']
+    cs.execs.lammps = execs[cs.cf.lammps]
+    cs.execs.lammps_nonmpi = execs[cs.cf.lammps_nonmpi]
+    cs.execs.MDDPN = execs[cs.cf.MDDPN]
+    cs.execs.spoll = execs[cs.cf.spoll]
+    cs.files.template = conf[cs.cf.template]
+    cs.folders.in_templates = conf[cs.cf.in_templates]
+    cs.sp.params = conf[cs.cf.sect_params]
+    cs.sp.post_processor = conf[cs.cf.post_processor]
+    cs.sp.allow_post_process = conf[cs.cf.do_post]
+    cs.sp.run_tests = conf[cs.cf.do_test_run]
+    cs.sp.sconf_main = conf[cs.cf.sect_sbatch_main]
+    cs.sp.sconf_post = conf[cs.cf.sect_sbatch_post]
+    cs.sp.sconf_test = conf[cs.cf.sect_sbatch_test]
+    cs.sp.monitor = conf[cs.cf.sect_monitor]
+    cs.sp.history = conf.get(cs.cf.sect_history, {})
+
+
+@logs
+def store(conffile: Path) -> None:
+    cache = {'fingerprint': fingerprint(conffile), 'resolved': resolved()}
+    cache_file = cs.sp.cwd / cs.files.conf_cache
+    with atomic_write(cache_file) as fp:
+        json.dump(cache, fp, indent=4, default=str)
+    cs.sp.logger.debug(f"Resolved configuration stored to {cache_file.as_posix()}")
+
+
+@logs
+def cached_configure(conffile: Union[Path, None] = None, conf_format: Union[str, None] = None) -> bool:
+    if not conffile:
+        conffile = conffile_lookup()
+    if not conffile.exists(): raise FileNotFoundError(f"Config file {conffile.as_posix()} was not found")
+    cache_file = cs.sp.cwd / cs.files.conf_cache
+    if cache_file.exists() and not cs.sp.args.no_conf_cache:
+        try:
+            with cache_file.open('r') as fp:
+                cache = json.load(fp)
+            if fingerprint_matches(cache['fingerprint'], conffile):
+                restore(cache['resolved'])
+                cs.sp.conffile_path = conffile
+                cs.sp.conffile_format = conf_format if conf_format else ('toml' if cs.sp.args.toml else 'json')
+                cs.sp.logger.info("Configuration OK (fingerprint matches, using cached configuration)")
+                return True
+            cs.sp.logger.info("Configuration fingerprint changed, revalidating")
+        except (KeyError, TypeError, ValueError) as e:
+            cs.sp.logger.warning(f"Cached configuration is unreadable, revalidating: {e}")
+
+    if not configure(loadconf(conffile, conf_format)): return False
+    store(conffile)
+    return True
+
+
 @logs
 def genconf(conffile: Path):
     if conffile.exists(): raise RuntimeError("Default config file exists in present directory")
@@ -198,6 +349,9 @@ def genconf(conffile: Path):
     folders['in_templates'] = cs.folders.in_templates
     conf['folders'] = folders
 
+    conf[cs.cf.sect_monitor] = {cs.cf.launcher: "srun", cs.cf.every: 30, cs.cf.halt_every: 100, cs.cf.checkpoint_lead: 0, cs.cf.conditions: {}, cs.cf.staging: {}, cs.cf.insitu: {}}
+    conf[cs.cf.sect_history] = {cs.cf.keep_raw: 2, cs.cf.every: 10, cs.cf.compression: "zst"}
+
     conf['slurm'] = {}
     conf['slurm']['main'] = sbatch.config.genconf()
     del conf['slurm']['main'][sbatch.cs.fields.execs]
@@ -6,7 +6,7 @@
 # This software is released under the MIT License.
 # https://opensource.org/licenses/MIT
 
-# Last modified: 01-05-2024 01:17:00
+# Last modified: 19-10-2026 14:15:02
 
 sect_sbatch: str = 'sbatch'
 sect_sbatch_main: str = 'main'
@@ -14,6 +14,8 @@ sect_sbatch_post: str = 'post'
 sect_sbatch_test: str = 'test'
 sect_spoll: str = 'spoll'
 sect_MDDPN: str = 'MDDPN'
+sect_monitor: str = 'monitor'
+sect_history: str = 'history'
 
 MDDPN: str = 'MDDPN'
 lammps: str = 'lammps'
@@ -32,5 +34,25 @@ in_templates: str = 'in_templates'
 do_post: str = 'do_post_processing'
 post_processor: str = 'post_processor'
 
+launcher: str = 'launcher'
+every: str = 'every'
+halt_every: str = 'halt_every'
+checkpoint_lead: str = 'checkpoint_lead'
+staging: str = 'staging'
+scratch: str = 'scratch'
+bandwidth: str = 'bandwidth'
+conditions: str = 'conditions'
+column: str = 'column'
+op: str = 'op'
+value: str = 'value'
+samples: str = 'samples'
+insitu: str = 'insitu'
+dumps: str = 'dumps'
+analyzer: str = 'analyzer'
+buffer: str = 'buffer'
+timeout: str = 'timeout'
+keep_raw: str = 'keep_raw'
+compression: str = 'compression'
+
 if __name__ == "__main__":
     pass
@@ -6,7 +6,7 @@
 # This software is released under the MIT License.
 # https://opensource.org/licenses/MIT
 
-# Last modified: 08-09-2023 20:30:54
+# Last modified: 19-10-2026 14:12:28
 
 state: str = 'state.json'
 
@@ -15,6 +15,16 @@ pass_log_prefix: str = ""
 pass_log_suffix: str = ".log"
 config_json: str = "conf.json"
 config_toml: str = "conf.toml"
+conf_cache: str = "conf.cache.json"
+status_cache: str = "status.json"
+lineage: str = "lineage.json"
+tune_cache: str = "tune.json"
+checkpoint: str = "checkpoint.json"
+archive_index: str = "index.json"
+thermo_index: str = "segments.json"
+dispatch_lock: str = "dispatch.lock"
+history_index: str = "index.json"
+history_lock: str = "history.lock"
 # restart_lock: str = "restart.lock"
 
 template: str = "in.template"  # this can be overriden at runtime
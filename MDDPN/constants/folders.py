@@ -6,7 +6,7 @@
 # This software is released under the MIT License.
 # https://opensource.org/licenses/MIT
 
-# Last modified: 06-11-2023 16:28:21
+# Last modified: 19-10-2026 14:22:42
 
 in_templates: str = "../in.templates/nonisotermal/"  # this can be overriden at runtime
 special_restarts: str = "special_restarts"
@@ -18,9 +18,18 @@ log: str = "logs"
 pass_log: str = "pass"
 signals: str = "signals"
 post_process: str = "post"
+pack: str = "pack"
+archive: str = "archive"  # compacted artifacts of completed labels
+thermo: str = "thermo"  # stitched thermo series, one file per label
+history: str = "history"  # content-addressed restart history
+insitu: str = "insitu"  # reduced results of in-situ analyzers, one file per streamed dump
+scratch: str = "scratch"  # stands for node-local scratch in the test run folder
 
 # def_lin_tmp: str = "/tmp"
 tmp_dir_basename: str = "MDDPN"
+cache: str = "MDDPN"  # inside $XDG_CACHE_HOME or ~/.cache
+includes: str = "includes"  # parsed template fragments inside cache folder
+queue: str = "queue"  # submission intents inside cache folder, one per campaign
 
 if __name__ == "__main__":
     pass
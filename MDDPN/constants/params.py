@@ -6,10 +6,19 @@
 # This software is released under the MIT License.
 # https://opensource.org/licenses/MIT
 
-# Last modified: 13-09-2023 23:13:38
+# Last modified: 19-10-2026 14:15:02
 
 
 time_criteria: int = 24 * 60 * 60 * 60
+replica_var: str = "mddpn_replica"  # world-style LAMMPS variable holding replica (partition) number
+scratch_var: str = "mddpn_scratch"  # node-local folder dumps and restarts are written to when staging
+fifo_var: str = "mddpn_fifo"  # node-local folder of FIFOs streamed dumps are written to
+dump_extensions: tuple = ("bin", "gz", "zst", "mpiio", "nc", "h5")  # dump file extensions LAMMPS selects the format by
+lock_timeout: float = 3 * 60 * 60  # seconds to wait for the campaign lock, restart cycle includes test run of up to an hour
+profile_env: str = "MDDPN_PROFILE"  # '1' records span tree of every invocation next to its pass log, 'cprofile' adds cProfile stats
+lock_stale: float = 6 * 60 * 60  # lock record older than this is left by a holder that can not be alive anymore
+submit_backoff: float = 60  # seconds before the first retry of a rejected submission, doubled on every next rejection
+submit_backoff_max: float = 60 * 60
 
 if __name__ == "__main__":
     pass
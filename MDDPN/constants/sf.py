@@ -6,7 +6,7 @@
 # This software is released under the MIT License.
 # https://opensource.org/licenses/MIT
 
-# Last modified: 03-09-2023 12:02:32
+# Last modified: 19-10-2026 14:10:19
 
 from .union import time_step, restart_every
 
@@ -27,10 +27,30 @@ runs: str = "runs"
 dump_file: str = "dump_f"
 jobid: str = "sb_jobid"
 restart_files: str = 'restart_files'
+restart_suffix: str = 'restart_suffix'
+restart_options: str = 'restart_options'
 restarts: str = "restarts"
 begin_step: str = "begin_step"
 end_step: str = "end_step"
 last_step: str = "last_step"
+event_label: str = "label"
+event_time: str = "time"
+model_version: str = "model_version"
+
+replicas: str = "replicas"
+seeds: str = "seeds"
+replica_steps: str = "replica_steps"
+
+packed: str = "packed"
+exit_code: str = "exit_code"
+from_step: str = "from_step"
+accounting: str = "sacct"
+incidents: str = "incidents"
+queued: str = "queued"  # segment waits in the submission queue, time it was enqueued
+submit_queue: str = "submit_queue"  # segments are enqueued for the dispatcher instead of submitted
+priority: str = "priority"
+
+parent: str = "parent"
 
 post_process_id: str = "post_process"
 conffile_path: str = "conffile"
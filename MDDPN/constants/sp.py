@@ -6,12 +6,12 @@
 # This software is released under the MIT License.
 # https://opensource.org/licenses/MIT
 
-# Last modified: 13-09-2023 22:45:49
+# Last modified: 19-10-2026 14:12:28
 
 import logging
 import argparse
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Union
 
 
 logger: logging.Logger = logging.Logger("null")
@@ -25,11 +25,15 @@ sconf_main: Dict[str, Any] = {}
 sconf_post: Dict[str, Any] = {}
 sconf_test: Dict[str, Any] = {}
 
+monitor: Dict[str, Any] = {}
+history: Dict[str, Any] = {}  # restart history retention, disabled if empty
+
 run_tests: bool = True
 allow_post_process: bool = True
 
 state: Dict[str, Any] = {}
 cwd: Path = Path()
+pass_log: Union[Path, None] = None
 args: argparse.Namespace = argparse.Namespace()
 
 conffile_path: Path = Path()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:32:14
+
+import json
+import time
+import random
+import getpass
+import subprocess
+from pathlib import Path
+from typing import Dict, Any, List, Tuple, Union
+
+from . import config
+from . import constants as cs
+from .pack import campaign
+from .model import Campaign
+from .run import submit_run, run_polling, rejected
+from .restart import last_segment
+from .utils import logs, locked, renew, Busy, cache_dir, intent_file, atomic_write, render_table
+
+
+def intents() -> List[Dict[str, Any]]:
+    res: List[Dict[str, Any]] = []
+    for file in sorted((cache_dir() / cs.folders.queue).glob("*.json")):
+        try:
+            with file.open('r') as fp: res.append(json.load(fp))
+        except (OSError, ValueError):
+            continue  # being replaced
+    return res
+
+
+def order(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Higher priority first, then campaigns lagging behind, then the longest waiting"""
+    return sorted(items, key=lambda it: (-it['priority'], it['progress'] if it['progress'] is not None else 1., it['enqueued']))
+
+
+def occupied() -> Tuple[int, Dict[str, int]]:
+    """Queued and running jobs of the user, in total and by partition, one squeue call"""
+    res = subprocess.run(["squeue", "-h", "-u", getpass.getuser(), "-o", "%i|%P"], capture_output=True, text=True)
+    if res.returncode != 0: raise RuntimeError(f"squeue failed: {res.stderr.strip()}")
+    by_partition: Dict[str, int] = {}
+    total = 0
+    for line in res.stdout.splitlines():
+        if len(parts := line.strip().split('|')) != 2: continue
+        total += 1
+        by_partition[parts[1]] = by_partition.get(parts[1], 0) + 1
+    return total, by_partition
+
+
+def caps(specs: List[str]) -> Dict[str, int]:
+    """PARTITION=N pairs"""
+    res: Dict[str, int] = {}
+    for spec in specs:
+        name, _, n = spec.partition('=')
+        if not n.isdigit(): raise ValueError(f"Bad partition cap '{spec}', expected PARTITION=N")
+        res[name] = int(n)
+    return res
+
+
+def write(intent: Dict[str, Any]) -> None:
+    with atomic_write(intent_file(intent['tag'])) as fp:
+        json.dump(intent, fp, indent=4)
+
+
+def backoff(intent: Dict[str, Any], error: str) -> None:
+    """Exponential with jitter, so campaigns rejected together do not come back together"""
+    intent['attempts'] += 1
+    delay = min(cs.params.submit_backoff * 2 ** (intent['attempts'] - 1), cs.params.submit_backoff_max)
+    intent['next_try'] = time.time() + delay * random.uniform(0.75, 1.25)
+    intent['error'] = error
+    write(intent)
+
+
+@logs
+def submit(intent: Dict[str, Any]) -> Union[int, None]:
+    """Submits the queued segment of the campaign and starts its polling, None if the intent is outdated"""
+    folder = Path(intent['folder'])
+    with campaign(folder, 0) as state:
+        camp = Campaign.from_state(state)
+        last = last_segment(state)
+        try: seg = camp.label(intent['label']).segments[intent['num']]
+        except (KeyError, IndexError): return None
+        if last is None or seg.run_no != last.run_no or seg.jobid is not None or cs.sf.queued not in seg.extra: return None
+        if not config.cached_configure(Path(state[cs.sf.conffile_path]).resolve(), state[cs.sf.conffile_format]):
+            raise RuntimeError("Bad configuration")
+        if (jobid := intent.get('jobid')) is None:
+            jobid = submit_run(folder / cs.folders.in_file / seg.in_file, seg.run_no, intent['label'])  # type: ignore
+            # the job is recorded in the intent before the state, after a crash in between it is recorded, not submitted again
+            intent['jobid'] = jobid
+            write(intent)
+        else: cs.sp.logger.info(f"{folder.as_posix()}: segment {seg.dump_file} was submitted as job {jobid} before, recording it")
+        seg.jobid = jobid
+        del seg.extra[cs.sf.queued]
+        camp.to_state(state)
+        cs.sp.logger.info(f"{folder.as_posix()}: segment {seg.dump_file} submitted as job {jobid}")
+        if intent['polling']: run_polling(jobid, state[cs.sf.tag])
+    # the intent goes only after the state with the job is written, a crash in between leaves an outdated intent
+    intent_file(intent['tag']).unlink()
+    return jobid
+
+
+def dispatch_once(max_jobs: Union[int, None], partition_caps: Dict[str, int]) -> Tuple[int, int]:
+    """Fills free slots with due intents, stops at the first rejection: the limit hit applies to the rest too"""
+    items = intents()
+    if len(items) == 0: return 0, 0
+    total, by_partition = occupied()
+    done = 0
+    now = time.time()
+    for intent in order(items):
+        if intent['next_try'] > now: continue
+        if max_jobs is not None and total >= max_jobs: break
+        part = intent['partition']
+        if part in partition_caps and by_partition.get(part, 0) >= partition_caps[part]: continue
+        if cs.sp.args.dry:
+            print(f"Would submit {intent['label']}{intent['num']} of {intent['folder']}")
+            total += 1
+            by_partition[part] = by_partition.get(part, 0) + 1
+            continue
+        try:
+            jobid = submit(intent)
+        except Busy:
+            continue  # campaign is being restarted right now, next round
+        except Exception as e:
+            backoff(intent, str(e))
+            if rejected(e):
+                cs.sp.logger.warning(f"Submission of {intent['folder']} rejected (attempt {intent['attempts']}): {e}")
+                break
+            cs.sp.logger.error(f"Failed to submit {intent['folder']} (attempt {intent['attempts']})")
+            cs.sp.logger.exception(e)
+            continue
+        if jobid is None:
+            cs.sp.logger.info(f"Dropping outdated intent of {intent['folder']}")
+            intent_file(intent['tag']).unlink()
+            continue
+        done += 1
+        total += 1
+        by_partition[part] = by_partition.get(part, 0) + 1
+    return done, len(items) - done
+
+
+def listing() -> str:
+    rows = [["campaign", "segment", "priority", "progress", "partition", "attempts", "next try", "error"]]
+    for it in order(intents()):
+        rows.append([
+            it['folder'], f"{it['label']}{it['num']}", str(it['priority']),
+            "-" if it['progress'] is None else f"{it['progress'] * 100:.1f}%", it['partition'] or "-", str(it['attempts']),
+            "now" if it['next_try'] <= time.time() else time.ctime(it['next_try']), " ".join((it['error'] or "").split())[:60]
+        ])
+    return render_table(rows)
+
+
+@logs
+def dispatch() -> int:
+    args = cs.sp.args
+    if args.list:
+        print(listing())
+        return 0
+    partition_caps = caps(args.partition_cap)
+    lockfile = cache_dir() / cs.folders.queue / cs.files.dispatch_lock
+    lockfile.parent.mkdir(exist_ok=True)
+    try:
+        with locked(lockfile, 0):
+            while True:
+                done, waiting = dispatch_once(args.max_jobs, partition_caps)
+                cs.sp.logger.info(f"Submitted {done} segments, {waiting} waiting")
+                if args.every <= 0: return 0
+                time.sleep(args.every)
+                renew(lockfile)
+    except Busy as e:
+        cs.sp.logger.info(f"Another dispatcher is running: {e}")
+        return 0
+
+
+if __name__ == "__main__":
+    pass
@@ -6,8 +6,9 @@
 # This software is released under the MIT License.
 # https://opensource.org/licenses/MIT
 
-# Last modified: 02-05-2024 20:29:38
+# Last modified: 19-10-2026 13:52:41
 
+import glob
 import json
 from pathlib import Path
 from typing import Dict
@@ -16,22 +17,20 @@ from MPMU import confdict
 import pysbatch_ng as sbatch
 
 from .run import run_polling
+from .model import Campaign
 from . import constants as cs
-from .utils import states, logs, AP
+from .utils import states, logs, replicas, AP
 
 
 @logs
 def state_runs_check() -> bool:
     fl = True
-    rlabels: Dict = cs.sp.state[cs.sf.run_labels]
-    for label in rlabels:
-        rc = 0
-        while str(rc) in rlabels[label]:
-            rc += 1
-        prc: int = rlabels[label][cs.sf.runs]
+    for label in Campaign.from_state(cs.sp.state).labels:
+        rc = len(label.segments)
+        prc: int = label.runs
         if prc != rc:
             fl = False
-            cs.sp.logger.warning(f"Label {label} runs: present={prc}, real={rc}")
+            cs.sp.logger.warning(f"Label {label.name} runs: present={prc}, real={rc}")
     return fl
 
 
@@ -47,9 +46,12 @@ def state_validate() -> bool:
             except KeyError:
                 cs.sp.logger.exception(json.dumps(rlabels, indent=4))
                 raise
-            if not dump_file.exists():
-                fl = False
-                cs.sp.logger.warning(f"Dump file {dump_file.as_posix()} not exists")
+            nrep = replicas()
+            for dfile in ([dump_file] if nrep < 2 else [dump_file.parent / f"{dump_file.name}.r{k}" for k in range(nrep)]):
+                # dump file keeps format extensions, multi-file dumps are written as a file per snapshot (processor)
+                if not dfile.exists() and next(dfile.parent.glob(glob.escape(dfile.name) + ".*"), None) is None:
+                    fl = False
+                    cs.sp.logger.warning(f"Dump file {dfile.as_posix()} not exists")
     return fl
 
 
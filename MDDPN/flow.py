@@ -0,0 +1,310 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:25:45
+
+import re
+import ast
+import math
+import shlex
+import operator
+from typing import Dict, Any, List, Tuple, Union, Callable
+
+from . import constants as cs
+
+
+class Dynamic(Exception):
+    """Value is known only while the simulation runs: thermo output, computes, fixes, random numbers..."""
+
+
+class Formula(str):
+    """Equal-style variable, evaluated when referenced"""
+
+
+thermo_keywords = {
+    "elapsed", "elaplong", "time", "cpu", "tpcpu", "spcpu", "cpuremain", "part", "timeremain", "atoms",
+    "temp", "press", "pe", "ke", "etotal", "enthalpy", "evdwl", "ecoul", "epair", "ebond", "eangle", "edihed",
+    "eimp", "emol", "elong", "etail", "vol", "density", "lx", "ly", "lz", "xlo", "xhi", "ylo", "yhi", "zlo", "zhi",
+    "xy", "xz", "yz", "xlat", "ylat", "zlat", "bonds", "angles", "dihedrals", "impropers",
+    "pxx", "pyy", "pzz", "pxy", "pxz", "pyz", "fmax", "fnorm", "nbuild", "ndanger",
+    "cella", "cellb", "cellc", "cellalpha", "cellbeta", "cellgamma",
+}
+
+functions = {
+    "sqrt": math.sqrt, "exp": math.exp, "ln": math.log, "log": math.log10, "abs": abs,
+    "sin": math.sin, "cos": math.cos, "tan": math.tan, "asin": math.asin, "acos": math.acos, "atan": math.atan,
+    "atan2": math.atan2, "ceil": math.ceil, "floor": math.floor, "round": round, "min": min, "max": max,
+    "ternary": lambda x, y, z: y if x else z, "PI": math.pi,
+}
+
+Jump = str
+
+
+class Quit:
+    pass
+
+
+binary: Dict[type, Callable[[Any, Any], Any]] = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.Pow: operator.pow, ast.Mod: operator.mod,
+}
+
+unary: Dict[type, Callable[[Any], Any]] = {ast.USub: operator.neg, ast.UAdd: operator.pos, ast.Not: lambda x: int(not x)}
+
+comparisons: Dict[type, Callable[[Any, Any], bool]] = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+}
+
+
+def to_python(expr: str) -> str:
+    expr = expr.replace('^', '**').replace('&&', ' and ').replace('||', ' or ')
+    return re.sub(r"!(?!=)", " not ", expr)
+
+
+def number(text: str) -> Union[int, float, str]:
+    try: return int(text)
+    except ValueError: pass
+    try: return float(text)
+    except ValueError: return text
+
+
+def strip_comment(line: str) -> str:
+    quote = None
+    for i, ch in enumerate(line):
+        if quote is None and ch in ('"', "'"): quote = ch
+        elif ch == quote: quote = None
+        elif quote is None and ch == '#': return line[:i]
+    return line
+
+
+def branches(args: List[str]) -> List[Tuple[str, List[str]]]:
+    """if BOOL then CMDS [elif BOOL CMDS]... [else CMDS]"""
+    res: List[Tuple[str, List[str]]] = []
+    cond, commands = args[0], []
+    i = 2
+    while i < len(args):
+        if args[i] == "elif":
+            res.append((cond, commands))
+            cond, commands = args[i + 1], []
+            i += 2
+        elif args[i] == "else":
+            res.append((cond, commands))
+            cond, commands = "1", []
+            i += 1
+        else:
+            commands.append(args[i])
+            i += 1
+    res.append((cond, commands))
+    return res
+
+
+def fmt(value: Any) -> str:
+    return f"{value:.15g}" if isinstance(value, float) else str(value)
+
+
+class Interpreter:
+    """Executes LAMMPS control flow of a template without a simulation
+
+    Follows label/jump/next loops (nested ones too), index, loop and uloop variables,
+    equal-style variables and 'if' commands, counting the steps of every 'run'. Whenever
+    a value depends on the simulation, Dynamic is raised and the label is open-ended.
+    """
+    def __init__(self, variables: Dict[str, Any], fixed: Dict[str, Any], limit: int = 1000000) -> None:
+        self.variables = variables  # evaluated by the parser, used for names this interpreter did not define
+        self.fixed = fixed  # user variables, their numeric definitions in templates are replaced by the generator
+        self.values: Dict[str, Any] = {}
+        self.lists: Dict[str, List[str]] = {}
+        self.step: Union[int, None] = 0
+        self.counted = 0
+        self.limit = limit
+        self.skip_jump = False  # a variable was exhausted by 'next', the next 'jump' is skipped
+
+    def value(self, name: str) -> Any:
+        if name.startswith("v_") and name not in self.values and name not in self.lists: name = name[2:]
+        if name in self.lists: return number(self.lists[name][0])
+        if name in self.values:
+            val = self.values[name]
+            if isinstance(val, Formula): return self.evaluate(val)
+            if val is Dynamic: raise Dynamic(f"variable '{name}'")
+            return val
+        if name == "step":
+            if self.step is None: raise Dynamic("step after open-ended label")
+            return self.step
+        if name in thermo_keywords or re.match(r"^[cf]_", name): raise Dynamic(f"'{name}'")
+        if name in self.variables: return self.variables[name]
+        raise Dynamic(f"unknown variable '{name}'")
+
+    def evaluate(self, expr: str) -> Any:
+        try:
+            return self.compute(ast.parse(to_python(self.substitute(expr)).strip(), mode='eval').body)
+        except Dynamic:
+            raise
+        except Exception as e:
+            raise Dynamic(f"can not evaluate '{expr}': {e}")
+
+    def compute(self, node: ast.AST) -> Any:
+        """Arithmetic, comparisons, logic and math functions of equal-style formulas, nothing else is evaluated"""
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool): return node.value
+        if isinstance(node, ast.Name):
+            if node.id in functions and not callable(functions[node.id]): return functions[node.id]
+            return self.value(node.id)
+        if isinstance(node, ast.BinOp) and type(node.op) in binary: return binary[type(node.op)](self.compute(node.left), self.compute(node.right))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in unary: return unary[type(node.op)](self.compute(node.operand))
+        if isinstance(node, ast.BoolOp):
+            # both sides are evaluated, as LAMMPS does, the result is 1 or 0
+            values = [bool(self.compute(v)) for v in node.values]
+            return int(all(values) if isinstance(node.op, ast.And) else any(values))
+        if isinstance(node, ast.Compare) and all(type(op) in comparisons for op in node.ops):
+            left, res = self.compute(node.left), True
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self.compute(comparator)
+                res = res and comparisons[type(op)](left, right)
+                left = right
+            return int(res)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and callable(functions.get(node.func.id)) and len(node.keywords) == 0:
+            return functions[node.func.id](*[self.compute(arg) for arg in node.args])
+        raise Dynamic(f"unsupported {type(node).__name__} in the formula")
+
+    def condition(self, expr: str) -> bool:
+        expr = self.substitute(expr)
+        try:
+            return bool(self.evaluate(expr))
+        except Dynamic:
+            # string comparison, e.g. "${style} == fene"
+            m = re.match(r"^\s*([^\s=!<>]+)\s*(==|!=)\s*([^\s=!<>]+)\s*$", expr)
+            if m is None or any(re.match(r"^(v|c|f)_", side) or side in thermo_keywords for side in (m.group(1), m.group(3))): raise
+            return (m.group(1) == m.group(3)) == (m.group(2) == "==")
+
+    def immediate(self, text: str) -> str:
+        """Substitutes $(expression) and $(expression:format), parentheses inside are nested"""
+        res: List[str] = []
+        i = 0
+        while (j := text.find("$(", i)) >= 0:
+            depth, k = 1, j + 2
+            while k < len(text) and depth > 0:
+                depth += {"(": 1, ")": -1}.get(text[k], 0)
+                k += 1
+            if depth > 0: raise Dynamic(f"unbalanced parentheses in '{text[j:].strip()}'")
+            m = re.match(r"^(.*?)(:(%[^()]*))?$", text[j + 2:k - 1], re.S)
+            assert m is not None
+            value = self.evaluate(m.group(1))
+            try: res += [text[i:j], m.group(3) % value if m.group(3) else fmt(value)]
+            except (TypeError, ValueError) as e: raise Dynamic(f"can not format '{text[j:k]}': {e}")
+            i = k
+        return "".join(res) + text[i:]
+
+    def substitute(self, text: str) -> str:
+        text = self.immediate(text)
+        text = re.sub(r"\$\{([^}]+)\}", lambda m: fmt(self.value(m.group(1))), text)
+        return re.sub(r"\$([a-zA-Z_\d])", lambda m: fmt(self.value(m.group(1))), text)
+
+    def tokens(self, line: str) -> List[str]:
+        # quoted text is substituted when it is used, as LAMMPS does
+        parts = re.split(r"(\"\"\".*?\"\"\"|\"[^\"]*\"|'[^']*')", strip_comment(line))
+        line = "".join(part if part[:1] in ('"', "'") else self.substitute(part) for part in parts)
+        try:
+            return shlex.split(line, comments=True)
+        except ValueError as e:
+            raise Dynamic(f"can not parse '{line.strip()}': {e}")
+
+    def variable(self, name: str, style: str, args: List[str]) -> None:
+        if style == "delete":
+            self.values.pop(name, None)
+            self.lists.pop(name, None)
+        elif style in ("index", "loop", "uloop", "world", "universe"):
+            if name in self.lists or name in self.values: return
+            if style in ("loop", "uloop"):
+                nums = [int(a) for a in args if a != "pad"]
+                lo, hi = (1, nums[0]) if len(nums) == 1 else (nums[0], nums[1])
+                self.lists[name] = [str(k) for k in range(lo, hi + 1)]
+            elif style == "world":
+                self.lists[name] = args[:1]
+            else:
+                self.lists[name] = list(args)
+        elif style == "equal":
+            expr = " ".join(args)
+            if name in self.fixed and re.match(r"^[\d.eE+-]+$", expr): return
+            self.values[name] = Formula(expr)
+        elif style == "string":
+            self.values[name] = " ".join(args)
+        elif style == "internal":
+            self.values[name] = number(args[0])
+        else:
+            self.values[name] = Dynamic
+
+    def next(self, names: List[str]) -> None:
+        for name in names:
+            if name not in self.lists: raise Dynamic(f"'next' on variable '{name}' that is not a list")
+            self.lists[name].pop(0)
+            if len(self.lists[name]) == 0:
+                del self.lists[name]
+                self.skip_jump = True
+
+    def execute(self, tokens: List[str]) -> Union[Jump, type, None]:
+        cmd, args = tokens[0], tokens[1:]
+        if cmd == "run":
+            if self.step is None and "upto" in args: raise Dynamic("'run upto' after open-ended label")
+            n = int(float(args[0]))
+            steps = n - self.step if "upto" in args and self.step is not None else n
+            self.counted += steps
+            if self.step is not None: self.step += steps
+        elif cmd == "variable":
+            self.variable(args[0], args[1], args[2:])
+        elif cmd == "next":
+            self.next(args)
+        elif cmd == "jump":
+            if self.skip_jump:
+                self.skip_jump = False
+                return None
+            if args[0] != "SELF": raise Dynamic(f"jump to other file '{args[0]}'")
+            if len(args) < 2: raise Dynamic("jump to the beginning of the file")
+            return args[1]
+        elif cmd == "if":
+            for cond, commands in branches(args):
+                if self.condition(cond):
+                    for command in commands:
+                        res = self.execute_line(command)
+                        if res is not None: return res
+                    break
+        elif cmd == "quit":
+            return Quit
+        return None
+
+    def execute_line(self, line: str) -> Union[Jump, type, None]:
+        tokens = self.tokens(line)
+        return self.execute(tokens) if len(tokens) > 0 else None
+
+    def block(self, lines: List[str]) -> Union[int, None]:
+        """Steps run by the lines of one label or None if they depend on the simulation"""
+        self.counted = 0
+        labels: Dict[str, int] = {}
+        for i, line in enumerate(lines):
+            m = re.match(r"^\s*label\s+(\S+)", line)
+            if m and m.group(1) not in labels: labels[m.group(1)] = i
+        try:
+            pc, executed = 0, 0
+            while pc < len(lines):
+                line = lines[pc]
+                pc += 1
+                if re.match(r"^\s*(#|$)", line): continue
+                executed += 1
+                if executed > self.limit: raise Dynamic(f"more than {self.limit} commands executed")
+                res = self.execute_line(line)
+                if res is Quit: break
+                elif isinstance(res, str):
+                    if res not in labels: raise Dynamic(f"jump to label '{res}' outside of the label")
+                    pc = labels[res] + 1
+        except Dynamic as e:
+            cs.sp.logger.info(f"    Steps depend on the simulation: {e}")
+            self.step = None
+            return None
+        return self.counted
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:32:14
+
+import os
+import json
+import time
+import fcntl
+import shutil
+from pathlib import Path
+from typing import Dict, Any, List, Tuple, Union
+
+from . import constants as cs
+from .model import Campaign
+from .init import check_required_fs, initialize
+from .restart import available_steps, retrieve_last_step_from_restart, restart
+from .utils import RestartMode, states, logs, read_state, load_state, RC, restart_suffix, restart_name, restart_base, restart_parts, atomic_write, locked, lock_file
+
+
+FICLONE = 0x40049409
+
+
+def clone(src: Path, dst: Path, allow_hardlink: bool) -> str:
+    """Hardlink, then reflink, then plain copy"""
+    if allow_hardlink:
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+    try:
+        with src.open('rb') as fsrc, dst.open('wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return "reflink"
+    except OSError:
+        dst.unlink(missing_ok=True)
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def restart_folders(folder: Path, nrep: int) -> List[Path]:
+    if nrep < 2: return [folder / cs.folders.restarts]
+    return [folder / cs.folders.restarts / f"r{k}" for k in range(nrep)]
+
+
+@logs
+def parent_restarts(parent: Path, pstate: Dict[str, Any], step: Union[int, None]) -> Tuple[int, List[Path]]:
+    """Restart file of every replica of the parent at the given (or the newest) step. Parent is not modified"""
+    basename = pstate[cs.sf.restart_files]
+    folders = restart_folders(parent, int(pstate.get(cs.sf.replicas, 1)))
+    mode = RestartMode(pstate[cs.sf.restart_mode])
+    if mode == RestartMode.multiple:
+        common = set.intersection(*[set(available_steps(folder, basename, restart_suffix(pstate))) for folder in folders])
+        if step is None:
+            if len(common) == 0: raise RuntimeError(f"Parent {parent.as_posix()} has no restart files")
+            step = max(common)
+        elif step not in common: raise RuntimeError(f"Parent has no restart files for step {step}, available: {sorted(common)}")
+        return step, [folder / restart_name(f".{step}", pstate) for folder in folders]
+
+    names = [restart_name("", pstate)] if mode == RestartMode.one else [restart_name(".a", pstate), restart_name(".b", pstate)]
+    files: List[Path] = []
+    found: List[int] = []
+    for folder in folders:
+        steps = {retrieve_last_step_from_restart(folder / name): folder / name for name in names if restart_base(folder / name).exists()}
+        if len(steps) == 0: raise RuntimeError(f"Parent has no restart files in {folder.as_posix()}")
+        st = max(steps) if step is None else step
+        if st not in steps: raise RuntimeError(f"Parent has no restart file for step {st}, available: {sorted(steps)}")
+        found.append(st)
+        files.append(steps[st])
+    if len(set(found)) != 1: raise RuntimeError(f"Parent replicas diverged, steps: {found}")
+    return found[0], files
+
+
+@logs
+def link_restarts(sources: List[Path], step: int) -> None:
+    """In 'one' and 'two' modes LAMMPS overwrites restart files in place, so they are never hardlinked to parent's ones
+
+    Per-processor restarts are cloned file by file, the part after the step (or '.a', '.b') is kept.
+    """
+    mode = RestartMode(cs.sp.state[cs.sf.restart_mode])
+    for src, folder in zip(sources, restart_folders(cs.sp.cwd, len(sources))):
+        if mode == RestartMode.multiple:
+            dst = folder / restart_name(f".{step}")
+        elif mode == RestartMode.one:
+            dst = folder / restart_name("")
+        else:
+            dst = folder / restart_name(".a")
+        prefix, dprefix = src.name.split('%')[0], dst.name.split('%')[0]
+        for part in restart_parts(src):
+            target = folder / (dprefix + part.name[len(prefix):])
+            how = clone(part, target, mode == RestartMode.multiple)
+            cs.sp.logger.info(f"{part.as_posix()} -> {target.as_posix()} ({how})")
+            if mode == RestartMode.two:
+                # both files of the pair at the same step, restart keeps '.b' and removes '.a'
+                os.link(target, folder / (restart_name(".b").split('%')[0] + part.name[len(prefix):]))
+
+
+def inherit_labels(campaign: Campaign, parent: Campaign, step: int) -> None:
+    """Open-ended labels the parent closed before the fork step are closed in the same way"""
+    for label in campaign.labels:
+        if label.end_step is not None: continue
+        try: pend = parent.label(label.name).end_step
+        except KeyError: break
+        if pend is None or pend > step: break
+        campaign.close(label.name, pend)
+
+
+def record_lineage(parent: Path, child: Dict[str, Any]) -> None:
+    lfile = parent / cs.files.lineage
+    lineage: Dict[str, Any] = {}
+    if lfile.exists():
+        with lfile.open('r') as fp: lineage = json.load(fp)
+    lineage.setdefault("children", []).append(child)
+    with atomic_write(lfile) as fp:
+        json.dump(lineage, fp, indent=4)
+
+
+@logs
+def fork() -> int:
+    parent = Path(cs.sp.args.parent).resolve()
+    pstate = read_state(parent)
+    if cs.sf.restart_files not in pstate: raise RuntimeError(f"Parent {parent.as_posix()} has no restarts declared")
+    nrep = int(pstate.get(cs.sf.replicas, 1))
+    step, sources = parent_restarts(parent, pstate, cs.sp.args.step)
+    cs.sp.logger.info(f"Forking {parent.as_posix()} at step {step}")
+
+    variables: Dict[str, Any] = dict(pstate[cs.sf.user_variables])
+    if cs.sp.args.params is not None: variables.update(json.loads(cs.sp.args.params))
+    cs.sp.logger.debug(f"Child variables: {json.dumps(variables, indent=4)}")
+
+    check_required_fs(nrep)
+    initialize(variables, RestartMode(pstate[cs.sf.restart_mode]), nrep)
+    link_restarts(sources, step)
+
+    campaign = Campaign.from_state(cs.sp.state)
+    inherit_labels(campaign, Campaign.from_state(pstate), step)
+    start = campaign.label("START")
+    if start.runs == 0: start.segments = []
+    if (label := campaign.resolve(step)) is None: raise RuntimeError(f"Step {step} is beyond the end of the child campaign")
+    cs.sp.logger.info(f"Child starts at label '{label.name}'")
+    campaign.to_state(cs.sp.state)
+
+    cs.sp.state[cs.sf.state] = states.started
+    cs.sp.state[cs.sf.parent] = {"path": parent.as_posix(), cs.sf.tag: pstate[cs.sf.tag], cs.sf.last_step: step, cs.sf.event_label: label.name}
+    record_lineage(parent, {"path": cs.sp.cwd.as_posix(), cs.sf.tag: cs.sp.state[cs.sf.tag], cs.sf.last_step: step, cs.sf.event_time: time.time()})
+    # watchdog and dispatcher may already see the child: its state is written under its lock and never seen half written
+    with locked(lock_file(cs.sp.cwd, cs.sp.state[cs.sf.tag])), atomic_write(cs.sp.cwd / cs.files.state) as f:
+        json.dump(cs.sp.state, f, indent=4)
+    cs.sp.logger.info("Fork complete")
+
+    if cs.sp.args.no_start: return 0
+    with load_state() as _:
+        rc: RC = restart()
+    return int(rc)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:32:14
+
+import os
+import gzip
+import json
+import time
+import logging
+import shutil
+import hashlib
+from pathlib import Path
+from typing import Dict, Any, List, Tuple, Set
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None  # type: ignore
+
+from . import constants as cs
+from .model import Campaign
+from .utils import logs, locked, atomic_write, render_table
+
+
+suffixes = {"raw": "", "zst": ".zst", "gz": ".gz"}
+
+
+def enabled() -> bool:
+    return len(cs.sp.history) > 0
+
+
+def root(folder: Path) -> Path:
+    return folder / cs.folders.history
+
+
+def object_file(folder: Path, digest: str, stored: str) -> Path:
+    return root(folder) / "objects" / digest[:2] / (digest + suffixes[stored])
+
+
+def read_index(folder: Path) -> Dict[str, Any]:
+    file = root(folder) / cs.files.history_index
+    if not file.exists(): return {"seq": 0, "checkpoints": {}, "objects": {}}
+    with file.open('r') as fp: return json.load(fp)
+
+
+def write_index(folder: Path, idx: Dict[str, Any]) -> None:
+    with atomic_write(root(folder) / cs.files.history_index) as fp:
+        json.dump(idx, fp, indent=4)
+
+
+def capture(steps: Dict[int, List[Path]], keep: Set[Path]) -> None:
+    """Moves restart files into the incoming folder before restart_cleanup removes them, the rest is done in background
+
+    Files that restart_cleanup would remove are renamed into the history, only the kept restart is copied:
+    it must not share the data with the stored object. Captured files are keyed by their path relative
+    to the restarts folder, so every replica folder is captured on its own, whether other replicas
+    of the step were already ingested or not.
+    """
+    folder = cs.sp.cwd
+    known = read_index(folder)["checkpoints"]
+    restarts = folder / cs.folders.restarts
+    incoming = root(folder) / "incoming"
+    incoming.mkdir(parents=True, exist_ok=True)
+    for step, paths in steps.items():
+        stored = known.get(str(step), {}).get("files", {})
+        paths = [path for path in paths if path.relative_to(restarts).as_posix() not in stored]
+        if len(paths) == 0: continue
+        tmp = incoming / f".{step}.{os.getpid()}.{time.time_ns()}"
+        for path in paths:
+            dst = tmp / path.relative_to(restarts)
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            if path in keep: shutil.copy2(path, dst)
+            else: os.replace(path, dst)
+        tmp.rename(incoming / tmp.name[1:])
+    start(folder, Campaign.from_state(cs.sp.state))
+
+
+def start(folder: Path, campaign: Campaign) -> None:
+    """Ingestion and compression run in a forked child detached from the session, restart returns without waiting for it
+
+    A child started while another one works waits for the history lock and finds the incoming folder processed.
+    """
+    settings = dict(cs.sp.history)
+    logger = cs.sp.logger.getChild("history")
+    if os.fork() > 0: return
+    code = 0
+    try:
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2): os.dup2(devnull, fd)
+        process(folder, campaign, settings, logger)
+    except Exception as e:
+        logger.error("Failed to process restart history")
+        logger.exception(e)
+        code = 1
+    finally:
+        # nothing of the parent (state written back, campaign lock released) may run in the child
+        os._exit(code)
+
+
+def digest_of(file: Path) -> str:
+    h = hashlib.sha256()
+    with file.open('rb') as fp:
+        while (chunk := fp.read(1 << 20)): h.update(chunk)
+    return h.hexdigest()
+
+
+def compress(src: Path, dst: Path, stored: str) -> None:
+    with src.open('rb') as fin, atomic_write(dst, 'wb') as fout:
+        if stored == "zst": zstd.ZstdCompressor(level=3, threads=-1).copy_stream(fin, fout)
+        else:
+            with gzip.GzipFile(fileobj=fout, mode='wb', compresslevel=6) as gz: shutil.copyfileobj(fin, gz, 1 << 20)
+
+
+def decompress(src: Path, dst: Path, stored: str) -> None:
+    """Writes a new file and replaces the destination with it, an existing destination is never written in place"""
+    with src.open('rb') as fin, atomic_write(dst, 'wb') as fout:
+        if stored == "zst": zstd.ZstdDecompressor().copy_stream(fin, fout)
+        elif stored == "gz":
+            with gzip.GzipFile(fileobj=fin, mode='rb') as gz: shutil.copyfileobj(gz, fout, 1 << 20)
+        else: shutil.copyfileobj(fin, fout, 1 << 20)
+
+
+def ingest(folder: Path, idx: Dict[str, Any], campaign: Campaign) -> None:
+    """Moves incoming files into the object store, identical files are stored once"""
+    incoming = root(folder) / "incoming"
+    if not incoming.is_dir(): return
+    for entry in sorted(incoming.iterdir()):
+        # capture renames its folder in place when it is done, one left behind belongs to an interrupted capture
+        if entry.name.startswith('.') and time.time() - entry.stat().st_mtime < cs.params.lock_stale: continue
+        step = entry.name.lstrip('.').split('.')[0]
+        if step not in idx["checkpoints"]:
+            label = campaign.resolve(int(step))
+            idx["seq"] += 1
+            idx["checkpoints"][step] = {"label": label.name if label is not None else None, "seq": idx["seq"], "time": time.time(), "files": {}}
+        files = idx["checkpoints"][step]["files"]
+        for file in sorted(f for f in entry.rglob('*') if f.is_file()):
+            digest = digest_of(file)
+            files[file.relative_to(entry).as_posix()] = digest
+            if digest in idx["objects"]: file.unlink()
+            else:
+                obj = object_file(folder, digest, "raw")
+                obj.parent.mkdir(parents=True, exist_ok=True)
+                size = file.stat().st_size
+                file.rename(obj)
+                idx["objects"][digest] = {"stored": "raw", "size": size, "bytes": size}
+        shutil.rmtree(entry)
+
+
+def policy(idx: Dict[str, Any], keep_raw: int, every: int) -> Tuple[List[str], List[str]]:
+    """Steps kept raw and steps kept at all: the newest raw, the last one of every label and every Nth captured"""
+    steps = sorted(idx["checkpoints"], key=int)
+    raw = steps[-keep_raw:] if keep_raw > 0 else []
+    last_of: Dict[Any, str] = {}
+    for step in steps: last_of[idx["checkpoints"][step]["label"]] = step
+    kept = set(raw) | set(last_of.values())
+    if every > 0: kept |= {s for s in steps if idx["checkpoints"][s]["seq"] % every == 0}
+    return raw, sorted(kept, key=int)
+
+
+def process(folder: Path, campaign: Campaign, settings: Dict[str, Any], logger: logging.Logger) -> None:
+    """Ingests, thins out and compresses, runs in the forked history process: the global logger is not touched there"""
+    with locked(root(folder) / cs.files.history_lock):
+        idx = read_index(folder)
+        ingest(folder, idx, campaign)
+        raw, kept = policy(idx, int(settings.get(cs.cf.keep_raw, 2)), int(settings.get(cs.cf.every, 10)))
+        for step in [s for s in idx["checkpoints"] if s not in kept]:
+            logger.debug(f"Thinning out checkpoint at step {step}")
+            del idx["checkpoints"][step]
+        referenced = {d: s for s in kept for d in idx["checkpoints"][s]["files"].values()}
+        raw_objects = {d for s in raw for d in idx["checkpoints"][s]["files"].values()}
+        for digest in [d for d in idx["objects"] if d not in referenced]:
+            object_file(folder, digest, idx["objects"][digest]["stored"]).unlink(missing_ok=True)
+            del idx["objects"][digest]
+        write_index(folder, idx)
+        stored = settings.get(cs.cf.compression, "zst")
+        if stored == "zst" and zstd is None: stored = "gz"  # zstandard is optional
+        for digest, obj in idx["objects"].items():
+            if obj["stored"] != "raw" or digest in raw_objects: continue
+            src = object_file(folder, digest, "raw")
+            dst = object_file(folder, digest, stored)
+            compress(src, dst, stored)
+            logger.debug(f"Compressed {digest[:12]}: {obj['size']} -> {dst.stat().st_size} bytes")
+            obj.update({"stored": stored, "bytes": dst.stat().st_size})
+            # index is written before the raw object goes, so it never points to a missing file
+            write_index(folder, idx)
+            src.unlink()
+
+
+def extract(folder: Path, step: int, dest: Path) -> List[Path]:
+    """Restores files of the checkpoint under their names relative to the restarts folder"""
+    with locked(root(folder) / cs.files.history_lock):
+        idx = read_index(folder)
+        if str(step) not in idx["checkpoints"]:
+            raise RuntimeError(f"No checkpoint at step {step}, available: {', '.join(sorted(idx['checkpoints'], key=int))}")
+        res: List[Path] = []
+        for rel, digest in idx["checkpoints"][str(step)]["files"].items():
+            stored = idx["objects"][digest]["stored"]
+            dst = dest / rel
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            decompress(object_file(folder, digest, stored), dst, stored)
+            res.append(dst)
+    return res
+
+
+def listing(idx: Dict[str, Any]) -> str:
+    rows = [["step", "label", "files", "size MB", "stored MB", "stored as"]]
+    for step in sorted(idx["checkpoints"], key=int):
+        cp = idx["checkpoints"][step]
+        objs = [idx["objects"][d] for d in cp["files"].values()]
+        rows.append([step, str(cp["label"]), str(len(objs)), f"{sum(o['size'] for o in objs) / 1024 ** 2:.1f}",
+                     f"{sum(o['bytes'] for o in objs) / 1024 ** 2:.1f}", ",".join(sorted({o['stored'] for o in objs}))])
+    lines = [render_table(rows)]
+    total = sum(o["bytes"] for o in idx["objects"].values())
+    lines.append(f"\n{len(idx['checkpoints'])} checkpoints, {len(idx['objects'])} unique files, {total / 1024 ** 2:.1f} MB stored")
+    return "\n".join(lines)
+
+
+@logs
+def checkpoints() -> int:
+    folder = cs.sp.cwd
+    if enabled() and (root(folder) / "incoming").is_dir():
+        process(folder, Campaign.from_state(cs.sp.state), cs.sp.history, cs.sp.logger)
+    print(listing(read_index(folder)))
+    return 0
+
+
+@logs
+def extract_checkpoint() -> int:
+    """Files go to the restarts folder by default, so 'restart --step' continues from there"""
+    dest = Path(cs.sp.args.to).resolve() if cs.sp.args.to else cs.sp.cwd / cs.folders.restarts
+    for file in extract(cs.sp.cwd, cs.sp.args.step, dest): cs.sp.logger.info(f"Extracted {file.as_posix()}")
+    return 0
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:32:14
+
+import re
+import json
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Tuple, Union, Iterator
+
+from . import regexs as rs
+from . import constants as cs
+from .utils import cache_dir, atomic_write
+
+
+# line number, text, include target
+Entry = Tuple[int, str, Union[str, None]]
+
+memo: Dict[str, List[Entry]] = {}
+
+
+def parse(text: str) -> List[Entry]:
+    """Joins '&' continuation lines and extracts include targets"""
+    entries: List[Entry] = []
+    pending = ""
+    start = 0
+    for i, line in enumerate(text.splitlines(keepends=True)):
+        if pending == "": start = i
+        if line.split('#')[0].rstrip().endswith('&'):
+            pending += line.split('#')[0].rstrip()[:-1] + " "
+            continue
+        line, pending = pending + line.lstrip() if pending else line, ""
+        if not line.endswith("\n"): line += "\n"
+        target = line.split('#')[0].split()[1] if re.match(rs.include, line) else None
+        entries.append((start, line, target))
+    if pending: entries.append((start, pending.rstrip() + "\n", None))
+    return entries
+
+
+def fragment(file: Path, persist: bool) -> List[Entry]:
+    """Parsed lines of one file, cached by the hash of its content
+
+    Template files are shared by whole sweeps, their parse results are kept in the cache folder,
+    so only edited fragments are parsed again. Generated files are cached in memory only.
+    """
+    data = file.read_bytes()
+    key = hashlib.sha256(data).hexdigest()
+    if key in memo: return memo[key]
+    if not persist:
+        memo[key] = parse(data.decode(errors='replace'))
+        return memo[key]
+    cfile = cache_dir() / cs.folders.includes / f"{key}.json"
+    try:
+        with cfile.open('r') as fp:
+            memo[key] = [tuple(entry) for entry in json.load(fp)]  # type: ignore
+        return memo[key]
+    except (OSError, ValueError):
+        pass
+    cs.sp.logger.debug(f"Parsing {file.as_posix()}")
+    memo[key] = parse(data.decode(errors='replace'))
+    cfile.parent.mkdir(exist_ok=True)
+    with atomic_write(cfile) as fp:
+        json.dump(memo[key], fp)
+    return memo[key]
+
+
+def chain(stack: List[Tuple[Path, int]]) -> str:
+    return " > ".join(f"{file.name}:{line + 1}" for file, line in stack)
+
+
+def expand(file: Path, stack: Union[List[Tuple[Path, int]], None] = None) -> Iterator[Tuple[str, str]]:
+    """Lines of the file with included files inlined, each with the include chain it comes from
+
+    Include paths are relative to the templates folder. Paths with LAMMPS variables can not be
+    resolved before the run, such include lines are left as they are.
+    """
+    stack = stack or []
+    templates = (cs.sp.cwd / cs.folders.in_templates).resolve()
+    for line_no, line, target in fragment(file, templates in file.resolve().parents):
+        here = stack + [(file, line_no)]
+        if target is None or '$' in target:
+            yield chain(here), line
+            continue
+        included = (templates / target).resolve()
+        if included in [f.resolve() for f, _ in here]: raise RuntimeError(f"Include cycle: {chain(here)} > {target}")
+        if not included.exists(): raise FileNotFoundError(f"Included file {included.as_posix()} not found: {chain(here)}")
+        yield chain(here), f"# include {target}\n"
+        yield from expand(included, here)
+
+
+if __name__ == "__main__":
+    pass
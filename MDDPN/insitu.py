@@ -0,0 +1,207 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:32:14
+
+import os
+import re
+import queue
+import shlex
+import shutil
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from typing import Dict, Any, List, Union, BinaryIO
+
+from . import constants as cs
+from .utils import replicas, atomic_write
+
+
+STYLES = ("atom", "custom", "local")  # text styles with 'ITEM: TIMESTEP' frames
+ROW = re.compile(rb"^\s*(#|\d+(\s|$))")  # analyzer output: rows starting with the step of their frame, '#' comments
+
+
+def settings() -> Dict[str, Any]:
+    return cs.sp.monitor.get(cs.cf.insitu, {})
+
+
+def streamed(name: str, style: str, suffix: str) -> bool:
+    """Dump goes through a FIFO: it is chosen, written as text to a single file, and there is a single monitor to read it"""
+    if name not in settings().get(cs.cf.dumps, []): return False
+    if style not in STYLES or suffix != "" or replicas() > 1:
+        cs.sp.logger.warning(f"Dump '{name}' ({style}{suffix}) can not be streamed, only text {', '.join(STYLES)} dumps to a single file without replicas are, writing it to file")
+        return False
+    return True
+
+
+def fifo_path(name: str) -> str:
+    """Path of the FIFO as written to LAMMPS input, monitor passes the folder"""
+    return f"${{{cs.params.fifo_var}}}/{name}"
+
+
+def results_file(folder: Path, name: str) -> Path:
+    return folder / cs.folders.insitu / f"{name}.txt"
+
+
+def rollback(file: Path, from_step: int) -> None:
+    """Drops rows from the step the segment restarts from on, they are computed again, so results match the restart"""
+    if not file.exists(): return
+    with file.open('r') as fp: lines = fp.readlines()
+    kept = [line for line in lines if (m := re.match(r"^\s*(#|\d+)", line)) and (m.group(1) == "#" or int(m.group(1)) < from_step)]
+    if len(kept) == len(lines): return
+    with atomic_write(file) as fp: fp.writelines(kept)
+
+
+class Relay(threading.Thread):
+    """Reads one dump from its FIFO frame by frame and passes frames to the analyzer
+
+    LAMMPS is not held by the analyzer for long: frames the analyzer has no room for (it is behind
+    by 'buffer' frames for more than the grace time) or that come after it exited are written to
+    the spill file, the dump file the frame would be written to without streaming. Once behind, the
+    relay spills without waiting until the analyzer catches up with half of the buffer.
+
+    The analyzer reads frames from stdin and writes rows to stdout, every row starts with the step
+    of the frame it comes from, lines starting with '#' are comments. Other lines are dropped, rows
+    have to be tied to steps to be rolled back when a segment is restarted.
+    """
+    grace = 0.5
+    def __init__(self, fifo: Path, analyzer: subprocess.Popen, spill: Path, buffer: int, out: BinaryIO) -> None:
+        super().__init__(daemon=True)
+        self.fifo = fifo
+        self.analyzer = analyzer
+        self.spill = spill
+        self.out = out
+        self.frames: "queue.Queue[Union[bytes, None]]" = queue.Queue(maxsize=buffer)
+        self.alive = True
+        self.behind = False
+        self.streamed = 0
+        self.spilled = 0
+        self.malformed = 0
+        self.spill_fp: Union[BinaryIO, None] = None
+        self.lock = threading.Lock()
+        self.closing = threading.Event()
+        self.feeder = threading.Thread(target=self.feed, daemon=True)
+        self.collector = threading.Thread(target=self.collect, daemon=True)
+        self.collector.start()
+
+    def feed(self) -> None:
+        assert self.analyzer.stdin is not None
+        while (frame := self.frames.get()) is not None:
+            if self.alive:
+                try:
+                    self.analyzer.stdin.write(frame)
+                    continue
+                except (BrokenPipeError, OSError):
+                    self.alive = False
+            with self.lock: self.streamed -= 1
+            self.write_spill(frame)
+        try: self.analyzer.stdin.close()
+        except (BrokenPipeError, OSError): pass
+
+    def collect(self) -> None:
+        assert self.analyzer.stdout is not None
+        for line in self.analyzer.stdout:
+            if ROW.match(line): self.out.write(line)
+            else: self.malformed += 1
+        self.out.flush()
+
+    def write_spill(self, frame: bytes) -> None:
+        """Frames are whole, so the spill file is a valid dump of the steps the analyzer missed"""
+        with self.lock:
+            if self.spill_fp is None:
+                self.spill.parent.mkdir(parents=True, exist_ok=True)
+                self.spill_fp = self.spill.open('ab')
+            self.spill_fp.write(frame)
+            self.spilled += 1
+
+    def deliver(self, frame: bytes) -> None:
+        if self.behind and self.frames.qsize() <= self.frames.maxsize // 2: self.behind = False
+        if self.alive and self.analyzer.poll() is None:
+            try:
+                self.frames.put(frame, timeout=0 if self.behind else self.grace)
+                with self.lock: self.streamed += 1
+                return
+            except queue.Full:
+                self.behind = True
+        self.write_spill(frame)
+
+    def read(self) -> None:
+        frame: List[bytes] = []
+        # opening blocks until LAMMPS opens the dump, or until close() opens it to end the relay
+        with self.fifo.open('rb') as fp:
+            for line in fp:
+                if line.startswith(b"ITEM: TIMESTEP") and len(frame) > 0:
+                    self.deliver(b"".join(frame))
+                    frame = []
+                frame.append(line)
+        if len(frame) > 0: self.deliver(b"".join(frame))
+
+    def run(self) -> None:
+        """The dump may be closed and opened again by LAMMPS (undump, then dump again), so the FIFO is reopened until close()"""
+        self.feeder.start()
+        while not self.closing.is_set(): self.read()
+        self.frames.put(None)
+        self.feeder.join()
+        if self.spill_fp is not None: self.spill_fp.close()
+
+    def close(self, timeout: float) -> None:
+        """Ends the relay once LAMMPS exited, waits for the analyzer to process what it got"""
+        self.closing.set()
+        while self.is_alive():
+            try: os.close(os.open(self.fifo, os.O_WRONLY | os.O_NONBLOCK))
+            except OSError: pass  # the relay did not open it yet
+            self.join(1)
+        try: self.analyzer.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.analyzer.kill()
+            self.analyzer.wait()
+        self.collector.join()
+
+
+class InSitu:
+    """FIFOs, analyzers and relays of the streamed dumps of one segment"""
+    def __init__(self, folder: Path, label: str, from_step: int) -> None:
+        self.folder = folder
+        self.label = label
+        self.from_step = from_step
+        self.fifos = Path(tempfile.mkdtemp(prefix=f"{cs.folders.tmp_dir_basename}.fifo."))
+        self.relays: Dict[str, Relay] = {}
+        self.outputs: List[BinaryIO] = []
+
+    def start(self) -> List[str]:
+        """LAMMPS arguments passing the FIFO folder"""
+        conf = settings()
+        tag = os.environ.get("SLURM_JOB_ID", str(os.getpid()))
+        for name in conf.get(cs.cf.dumps, []):
+            fifo = self.fifos / name
+            os.mkfifo(fifo)
+            results = results_file(self.folder, name)
+            results.parent.mkdir(exist_ok=True)
+            rollback(results, self.from_step)
+            out = results.open('ab')
+            self.outputs.append(out)
+            env = dict(os.environ, MDDPN_DUMP=name, MDDPN_LABEL=self.label, MDDPN_FROM_STEP=str(self.from_step))
+            analyzer = subprocess.Popen(shlex.split(conf[cs.cf.analyzer]), stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=self.folder, env=env)
+            spill = self.folder / cs.folders.dumps / f"{self.label}.{name}.{tag}"
+            self.relays[name] = Relay(fifo, analyzer, spill, int(conf.get(cs.cf.buffer, 8)), out)
+            self.relays[name].start()
+        return ["-var", cs.params.fifo_var, self.fifos.as_posix()]
+
+    def finish(self) -> None:
+        for name, relay in self.relays.items():
+            relay.close(float(settings().get(cs.cf.timeout, 600)))
+            cs.sp.logger.info(f"Dump '{name}': {relay.streamed} frames analyzed, analyzer exited with code {relay.analyzer.returncode}")
+            if relay.malformed > 0: cs.sp.logger.warning(f"Dump '{name}': {relay.malformed} lines of analyzer output do not start with a step and were dropped")
+            if relay.spilled > 0: cs.sp.logger.warning(f"Dump '{name}': analyzer fell behind or failed, {relay.spilled} frames written to {relay.spill.as_posix()}")
+        for out in self.outputs: out.close()
+        shutil.rmtree(self.fifos, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    pass
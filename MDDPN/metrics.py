@@ -0,0 +1,132 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:32:14
+
+import os
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Tuple, Union
+
+from . import constants as cs
+from .thermo import performance, newest_log
+from .utils import states, logs, cache_dir, atomic_write
+from .status import Index, scan, summarize
+
+
+# log file -> (size, mtime, throughput), logs of finished segments are not parsed again in daemon mode
+throughputs: Dict[str, Tuple[int, int, Union[float, None]]] = {}
+
+
+def usage(folder: Path) -> Tuple[int, float]:
+    """Bytes in the folder tree and the newest modification time"""
+    total, newest = 0, 0.
+    stack = [folder]
+    while len(stack) > 0:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(Path(entry.path))
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                    total += st.st_size
+                    newest = max(newest, st.st_mtime)
+        except FileNotFoundError:
+            continue
+    return total, newest
+
+
+def throughput(folder: Path) -> Union[float, None]:
+    """Timesteps per second of the last run reported in the newest LAMMPS log"""
+    if (log := newest_log(folder / cs.folders.slurm)) is None: return None
+    try: st = log.stat()
+    except FileNotFoundError: return None
+    cached = throughputs.get(log.as_posix())
+    if cached is not None and cached[:2] == (st.st_size, st.st_mtime_ns): return cached[2]
+    measured = performance(log)
+    tps = measured[-1] if len(measured) > 0 else None
+    throughputs[log.as_posix()] = (st.st_size, st.st_mtime_ns, tps)
+    return tps
+
+
+def escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def fmt(value: Union[int, float]) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(summary: Dict[str, Any], extra: Dict[str, Any]) -> str:
+    """Text exposition of one campaign, readable by node-exporter textfile collector and OpenMetrics parsers"""
+    common = f'campaign="{escape(summary["path"])}",tag="{escape(summary[cs.sf.tag])}"'
+    lines: List[str] = []
+
+    def metric(name: str, kind: str, help: str, samples: List[Tuple[str, Union[int, float]]]) -> None:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{{{common}{labels}}} {fmt(value)}")
+
+    metric("mddpn_campaign_state", "gauge", "Campaign state, 1 for the current one",
+           [(f',state="{st.value}"', int(st.value == summary[cs.sf.state])) for st in states])
+    if summary.get('label') is not None:
+        metric("mddpn_campaign_label_info", "gauge", "Label the campaign is running", [(f',label="{escape(summary["label"])}"', 1)])
+    if summary.get(cs.sf.last_step) is not None:
+        metric("mddpn_campaign_step", "gauge", "Last step reached", [("", summary[cs.sf.last_step])])
+        if summary.get(cs.sf.end_step):
+            metric("mddpn_campaign_progress_ratio", "gauge", "Fraction of the campaign done", [("", min(summary[cs.sf.last_step] / summary[cs.sf.end_step], 1.))])
+    metric("mddpn_segments_submitted_total", "counter", "Segments submitted", [("", summary.get('submitted', 0))])
+    metric("mddpn_segments_completed_total", "counter", "Segments completed", [("", summary.get('completed', 0))])
+    metric("mddpn_restarts_total", "counter", "Restarts of the campaign", [("", summary.get(cs.sf.restart, 0))])
+    if extra['checkpoint'] > 0:
+        metric("mddpn_checkpoint_age_seconds", "gauge", "Seconds since the newest restart file was written", [("", round(extra['now'] - extra['checkpoint'], 3))])
+    if extra['tps'] is not None:
+        metric("mddpn_segment_throughput_steps_per_second", "gauge", "Throughput of the last segment", [("", extra['tps'])])
+    metric("mddpn_folder_bytes", "gauge", "Bytes in campaign folders",
+           [(f',folder="{cs.folders.dumps}"', extra['dumps']), (f',folder="{cs.folders.restarts}"', extra['restarts'])])
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write(outdir: Path, name: str, text: str) -> None:
+    """Atomic: the collector reads only *.prom files, temporary one is renamed over the old file"""
+    with atomic_write(outdir / name) as fp:
+        fp.write(text)
+
+
+def export(outdir: Path, folder: Path, summary: Dict[str, Any]) -> Dict[str, Any]:
+    if 'submitted' not in summary: summary = summarize(folder)  # cached by an older version
+    dumps, _ = usage(folder / cs.folders.dumps)
+    restarts, checkpoint = usage(folder / cs.folders.restarts)
+    extra = {'now': time.time(), 'dumps': dumps, 'restarts': restarts, 'checkpoint': checkpoint, 'tps': throughput(folder)}
+    write(outdir, f"mddpn_{summary[cs.sf.tag]}.prom", render(summary, extra))
+    return summary
+
+
+@logs
+def metrics() -> int:
+    args = cs.sp.args
+    roots = [Path(root).resolve() for root in args.roots] if args.roots else [cs.sp.cwd]
+    outdir = Path(args.output).resolve()
+    outdir.mkdir(parents=True, exist_ok=True)
+    index = None if args.no_cache else Index(cache_dir() / cs.files.status_cache)
+    while True:
+        started = time.time()
+        summaries = scan(roots, args.depth, args.workers, index, lambda folder, summary: export(outdir, folder, summary))
+        if index is not None: index.save()
+        for s in summaries:
+            if str(s[cs.sf.state]).startswith("unreadable"): cs.sp.logger.warning(f"{s['path']}: {s[cs.sf.state]}")
+        cs.sp.logger.info(f"Exported {len(summaries)} campaigns in {time.time() - started:.1f} s")
+        if args.every <= 0: return 0
+        time.sleep(max(args.every - (time.time() - started), 0))
+
+
+if __name__ == "__main__":
+    pass
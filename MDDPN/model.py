@@ -0,0 +1,189 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:08:31
+
+import math
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Dict, Any, List, Union
+
+from . import constants as cs
+
+
+MODEL_VERSION: int = 1
+
+
+@dataclass
+class Segment:
+    __slots__ = ('num', 'jobid', 'in_file', 'dump_file', 'run_no', 'last_step', 'extra')
+    num: int
+    jobid: Union[int, None]
+    in_file: Union[str, None]
+    dump_file: Union[str, None]
+    run_no: Union[int, None]
+    last_step: Union[int, None]
+    extra: Dict[str, Any]
+
+    @classmethod
+    def from_state(cls, num: int, run: Dict[str, Any]) -> "Segment":
+        known = (cs.sf.jobid, cs.sf.in_file, cs.sf.dump_file, cs.sf.run_no, cs.sf.last_step)
+        return cls(num, run.get(cs.sf.jobid), run.get(cs.sf.in_file), run.get(cs.sf.dump_file), run.get(cs.sf.run_no), run.get(cs.sf.last_step),
+                   {k: v for k, v in run.items() if k not in known})
+
+    def to_state(self) -> Dict[str, Any]:
+        run: Dict[str, Any] = {}
+        if self.jobid is not None: run[cs.sf.jobid] = self.jobid
+        if self.in_file is not None: run[cs.sf.in_file] = self.in_file
+        if self.dump_file is not None: run[cs.sf.dump_file] = self.dump_file
+        if self.run_no is not None: run[cs.sf.run_no] = self.run_no
+        if self.last_step is not None: run[cs.sf.last_step] = self.last_step
+        run.update(self.extra)
+        return run
+
+
+@dataclass
+class Label:
+    __slots__ = ('name', 'begin_step', 'end_step', 'runs', 'segments', 'extra')
+    name: str
+    begin_step: int
+    end_step: Union[int, None]
+    runs: int
+    segments: List[Segment]
+    extra: Dict[str, Any]
+
+    @classmethod
+    def from_state(cls, name: str, desc: Dict[str, Any]) -> "Label":
+        segments: List[Segment] = []
+        while str(len(segments)) in desc:
+            segments.append(Segment.from_state(len(segments), desc[str(len(segments))]))
+        known = (cs.sf.begin_step, cs.sf.end_step, cs.sf.runs)
+        extra = {k: v for k, v in desc.items() if k not in known and not k.isdigit()}
+        return cls(name, desc[cs.sf.begin_step], desc[cs.sf.end_step], int(desc[cs.sf.runs]), segments, extra)
+
+    def to_state(self) -> Dict[str, Any]:
+        desc: Dict[str, Any] = {cs.sf.begin_step: self.begin_step, cs.sf.end_step: self.end_step, cs.sf.runs: self.runs}
+        desc.update(self.extra)
+        for seg in self.segments:
+            desc[str(seg.num)] = seg.to_state()
+        return desc
+
+    def append(self, segment: Segment) -> Segment:
+        """Registers next run of the label. Records beyond the run counter (e.g. START0 placeholder) are overwritten"""
+        segment.num = self.runs
+        if self.runs < len(self.segments): self.segments[self.runs] = segment
+        else: self.segments.append(segment)
+        self.runs += 1
+        return segment
+
+
+@dataclass
+class RestartEvent:
+    __slots__ = ('count', 'step', 'label', 'time')
+    count: int
+    step: int
+    label: str
+    time: float
+
+
+class Campaign:
+    """Typed view of the state file with a sorted interval index over the label timeline
+
+    Labels following an open-ended label are numbered relative to the end of that label
+    (see init.process_file), so only the prefix up to and including the first open-ended
+    label is indexed. Closing an open-ended label shifts later labels and extends the index.
+    """
+    __slots__ = ('tag', 'labels', 'events', '_names', '_ends')
+
+    def __init__(self, tag: Union[int, None], labels: List[Label], events: List[RestartEvent]) -> None:
+        self.tag = tag
+        self.labels = labels
+        self.events = events
+        self._names: Dict[str, int] = {label.name: i for i, label in enumerate(labels)}
+        self._ends: List[float] = []
+        self._reindex(0)
+
+    def _reindex(self, start: int) -> None:
+        del self._ends[start:]
+        for label in self.labels[len(self._ends):]:
+            if label.end_step is None:
+                self._ends.append(math.inf)
+                break
+            self._ends.append(label.end_step - 1)
+
+    def label(self, name: str) -> Label:
+        return self.labels[self._names[name]]
+
+    def resolve(self, step: int) -> Union[Label, None]:
+        i = bisect_right(self._ends, step)
+        if i >= len(self._ends): return None
+        label = self.labels[i]
+        if step < label.begin_step: return None
+        return label
+
+    def close(self, name: str, end_step: int) -> None:
+        i = self._names[name]
+        self.labels[i].end_step = end_step
+        for label in self.labels[i + 1:]:
+            label.begin_step += end_step
+            if label.end_step is not None:
+                label.end_step += end_step
+        self._reindex(i)
+
+    def append_label(self, label: Label) -> None:
+        self._names[label.name] = len(self.labels)
+        self.labels.append(label)
+        if len(self._ends) == len(self.labels) - 1 and (len(self._ends) == 0 or self._ends[-1] != math.inf):
+            self._ends.append(math.inf if label.end_step is None else label.end_step - 1)
+
+    def record_restart(self, step: int, label: str, time: float) -> RestartEvent:
+        event = RestartEvent(len(self.events) + 1, step, label, time)
+        self.events.append(event)
+        return event
+
+    @property
+    def end_step(self) -> Union[int, None]:
+        ends = [label.end_step for label in self.labels]
+        if len(ends) == 0 or None in ends: return None
+        return max(ends)  # type: ignore
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "Campaign":
+        """Migration from the state file layout"""
+        labels = [Label.from_state(name, desc) for name, desc in state.get(cs.sf.run_labels, {}).items()]
+        events = [RestartEvent(int(k), v[cs.sf.last_step], v[cs.sf.event_label], v[cs.sf.event_time]) for k, v in sorted(state.get(cs.sf.restarts, {}).items(), key=lambda kv: int(kv[0]))]
+        return cls(state.get(cs.sf.tag), labels, events)
+
+    def to_state(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        state[cs.sf.run_labels] = {label.name: label.to_state() for label in self.labels}
+        state[cs.sf.labels_list] = [label.name for label in self.labels]
+        if len(self.events) > 0 or cs.sf.restarts in state:
+            state[cs.sf.restarts] = {str(e.count): {cs.sf.last_step: e.step, cs.sf.event_label: e.label, cs.sf.event_time: e.time} for e in self.events}
+        return state
+
+    def dump(self) -> Dict[str, Any]:
+        return {
+            cs.sf.model_version: MODEL_VERSION,
+            cs.sf.tag: self.tag,
+            cs.sf.labels_list: [[label.name, label.begin_step, label.end_step, label.runs, label.extra,
+                                 [[s.jobid, s.in_file, s.dump_file, s.run_no, s.last_step, s.extra] for s in label.segments]] for label in self.labels],
+            cs.sf.restarts: [[e.count, e.step, e.label, e.time] for e in self.events]
+        }
+
+    @classmethod
+    def load(cls, data: Dict[str, Any]) -> "Campaign":
+        version = data.get(cs.sf.model_version)
+        if version is None: return cls.from_state(data)
+        if version != MODEL_VERSION: raise RuntimeError(f"Unsupported campaign model version: {version}")
+        labels = [Label(name, begin, end, runs, [Segment(i, *seg) for i, seg in enumerate(segs)], extra) for name, begin, end, runs, extra, segs in data[cs.sf.labels_list]]
+        events = [RestartEvent(*e) for e in data[cs.sf.restarts]]
+        return cls(data[cs.sf.tag], labels, events)
+
+
+if __name__ == "__main__":
+    pass
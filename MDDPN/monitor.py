@@ -0,0 +1,273 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:27:58
+
+import os
+import re
+import json
+import time
+import shlex
+import signal
+import threading
+import subprocess
+from pathlib import Path
+from typing import Dict, Any, List, Union
+
+from . import insitu
+from . import constants as cs
+from .model import Campaign
+from .stage import Stager, prepare_scratch, remove_scratch
+from .thermo import ThermoReader
+from .utils import RestartMode, logs, replicas, replica_folder, replica_path, restart_name, restart_base
+
+
+class Condition:
+    """Stopping condition on thermo column
+
+    Operators '>', '<', '>=', '<=' compare the value itself, 'drop' and 'rise' compare the
+    difference from the running maximum (minimum) of the column. Condition is met when it
+    holds for 'samples' consecutive thermo outputs.
+    """
+    ops = {
+        '>': lambda v, x: v > x,
+        '<': lambda v, x: v < x,
+        '>=': lambda v, x: v >= x,
+        '<=': lambda v, x: v <= x,
+    }
+
+    def __init__(self, column: str, op: str, value: float, samples: int = 1) -> None:
+        if op not in self.ops and op not in ('drop', 'rise'): raise ValueError(f"Unknown condition operator: '{op}'")
+        self.column = column
+        self.op = op
+        self.value = float(value)
+        self.samples = int(samples)
+        self.count = 0
+        self.extremum: Union[float, None] = None
+
+    @classmethod
+    def from_conf(cls, conf: Dict[str, Any]) -> "Condition":
+        return cls(conf[cs.cf.column], conf[cs.cf.op], conf[cs.cf.value], conf.get(cs.cf.samples, 1))
+
+    def check(self, v: float) -> bool:
+        if self.op == 'drop':
+            self.extremum = v if self.extremum is None else max(self.extremum, v)
+            return self.extremum - v > self.value
+        elif self.op == 'rise':
+            self.extremum = v if self.extremum is None else min(self.extremum, v)
+            return v - self.extremum > self.value
+        return self.ops[self.op](v, self.value)
+
+    def feed(self, row: Dict[str, float]) -> bool:
+        if self.column not in row: return False
+        self.count = self.count + 1 if self.check(row[self.column]) else 0
+        return self.count >= self.samples
+
+    def __str__(self) -> str:
+        return f"{self.column} {self.op} {self.value} for {self.samples} samples"
+
+
+def conditions(label: str) -> List[Condition]:
+    """Only open-ended labels are ended by conditions, the end of a closed label is known and a halt would not move it"""
+    if Campaign.from_state(cs.sp.state).label(label).end_step is not None: return []
+    declared: Dict[str, Any] = cs.sp.monitor.get(cs.cf.conditions, {})
+    return [Condition.from_conf(c) for c in declared.get(label, declared.get('*', []))]
+
+
+def checkpoint_lead() -> int:
+    return int(cs.sp.monitor.get(cs.cf.checkpoint_lead, 0))
+
+
+def sbatch_signal() -> Union[str, None]:
+    """sbatch --signal value asking Slurm to send USR1 to the batch shell checkpoint_lead seconds before walltime"""
+    if checkpoint_lead() <= 0: return None
+    return f"B:USR1@{checkpoint_lead()}"
+
+
+def staging() -> Dict[str, Any]:
+    return cs.sp.monitor.get(cs.cf.staging, {})
+
+
+def scratch_prefix() -> str:
+    """Dumps and restarts are written to node-local scratch, monitor passes its path to LAMMPS"""
+    return f"${{{cs.params.scratch_var}}}/" if cs.cf.scratch in staging() else ""
+
+
+def enabled() -> bool:
+    return (len(cs.sp.monitor.get(cs.cf.conditions, {})) > 0 or checkpoint_lead() > 0 or cs.cf.scratch in staging()
+            or len(insitu.settings().get(cs.cf.dumps, [])) > 0)
+
+
+def halt_file(label: str) -> Path:
+    return cs.sp.cwd / cs.folders.signals / f"{label}.halt"
+
+
+def halt_block(label: str) -> str:
+    """LAMMPS commands stopping the run softly once the halt file appears
+
+    Soft halt forces timer timeout, so all following run commands are skipped,
+    while the remaining commands (e.g. checkpoint written by checkpoint_block) are executed.
+    """
+    every = cs.sp.monitor.get(cs.cf.halt_every, 100)
+    return (f"variable mddpn_halt equal is_file({cs.folders.signals}/{label}.halt)\n"
+            f"fix mddpn_halt all halt {every} v_mddpn_halt > 0 error soft message yes\n")
+
+
+def checkpoint_block() -> str:
+    mode = RestartMode(cs.sp.state[cs.sf.restart_mode])
+    tail = ".*" if mode == RestartMode.multiple else (".a" if mode == RestartMode.two else "")
+    rfn = f"{scratch_prefix()}{replica_path()}/{restart_name(tail)}"
+    return f"write_restart {rfn} {cs.sp.state.get(cs.sf.restart_options, '')}".rstrip() + "\n"
+
+
+def checkpoint_name(step: int) -> str:
+    """Name of the file checkpoint_block writes at given step"""
+    mode = RestartMode(cs.sp.state[cs.sf.restart_mode])
+    if mode == RestartMode.multiple: return restart_name(f".{step}")
+    elif mode == RestartMode.two: return restart_name(".a")
+    return restart_name("")
+
+
+def job_deadline() -> Union[float, None]:
+    """End time of the current job as scheduled by SLURM"""
+    jobid = os.environ.get("SLURM_JOB_ID")
+    if jobid is None: return None
+    try:
+        res = subprocess.run(["squeue", "-h", "-j", jobid, "-o", "%e"], capture_output=True, text=True, timeout=60)
+        return time.mktime(time.strptime(res.stdout.strip(), "%Y-%m-%dT%H:%M:%S"))
+    except (OSError, subprocess.TimeoutExpired, ValueError):
+        return None
+
+
+def halted_step(logfile: Path) -> Union[int, None]:
+    step = None
+    if not logfile.exists(): return step
+    with logfile.open('r', errors='replace') as fp:
+        for line in fp:
+            if (m := re.search(r"Fix halt condition for fix-id \S+ met on step (\d+)", line)):
+                step = int(m.group(1))
+    return step
+
+
+@logs
+def record_checkpoint(step: int) -> None:
+    """Lets restart take the step of the checkpoint from the record instead of converting the restart file"""
+    name = checkpoint_name(step)
+    folders = [replica_folder(k) for k in range(replicas())] if replicas() > 1 else [cs.sp.cwd / cs.folders.restarts]
+    for folder in folders:
+        file = folder / name
+        if not restart_base(file).exists():
+            cs.sp.logger.warning(f"Checkpoint {file.as_posix()} was not written")
+            continue
+        with (folder / cs.files.checkpoint).open('w') as fp:
+            json.dump({cs.sf.last_step: step, "file": name, "mtime": restart_base(file).stat().st_mtime_ns}, fp)
+        cs.sp.logger.info(f"Checkpoint at step {step} recorded: {file.as_posix()}")
+
+
+@logs
+def halt(label: str, step: int, reason: str) -> None:
+    cs.sp.logger.info(f"Condition met at step {step}: {reason}")
+    sfile = cs.sp.cwd / cs.folders.signals / f"{label}.signal"
+    with sfile.open('w') as fp:
+        fp.write(f"{step}  # {reason}\n")
+    cs.sp.logger.info(f"Signal file written: {sfile.as_posix()}")
+    halt_file(label).touch()
+    cs.sp.logger.info("Halt requested, waiting LAMMPS to write checkpoint and exit")
+
+
+@logs
+def monitor() -> int:
+    """Runs LAMMPS, stops it when stopping condition is met or when walltime is close
+
+    Before walltime (checkpoint_lead seconds before the job end, or on USR1/TERM sent to the
+    monitor) the halt file is created without closing the label, so LAMMPS writes the checkpoint
+    and exits and the next segment continues the same label. The main job is submitted with
+    --signal=B:USR1@<lead> and its batch shell execs the monitor, so the signal Slurm sends
+    to the batch shell reaches the monitor; packed jobs rely on checkpoint_lead alone.
+
+    With staging, LAMMPS writes dumps and restarts to node-local scratch of the node the
+    monitor runs on (rank 0 of every partition is expected there) and they are copied
+    to the campaign folder in the background.
+
+    Streamed dumps are written by LAMMPS to FIFOs on the same node and passed to analyzers,
+    only their reduced results reach the campaign folder.
+    """
+    label: str = cs.sp.args.label
+    logfile = Path(cs.sp.args.log)
+    if not logfile.is_absolute(): logfile = cs.sp.cwd / logfile
+    cmd: List[str] = cs.sp.args.cmd[1:] if cs.sp.args.cmd[:1] == ["--"] else cs.sp.args.cmd
+    cmd = shlex.split(cs.sp.args.launcher or cs.sp.monitor.get(cs.cf.launcher, "srun")) + cmd
+
+    stager: Union[Stager, None] = None
+    if cs.cf.scratch in staging():
+        scratch = prepare_scratch(cs.sp.state[cs.sf.tag], replicas())
+        cmd += ["-var", cs.params.scratch_var, scratch.as_posix()]
+        stager = Stager(scratch, cs.sp.cwd, staging().get(cs.cf.every, 60), staging().get(cs.cf.bandwidth))
+        stager.start()
+        cs.sp.logger.info(f"Staging from {scratch.as_posix()}")
+
+    streams: Union[insitu.InSitu, None] = None
+    if len(insitu.settings().get(cs.cf.dumps, [])) > 0:
+        events = Campaign.from_state(cs.sp.state).events
+        streams = insitu.InSitu(cs.sp.cwd, label, events[-1].step if len(events) > 0 else 0)
+        cmd += streams.start()
+        cs.sp.logger.info(f"Streaming dumps {', '.join(insitu.settings()[cs.cf.dumps])} through {streams.fifos.as_posix()}")
+
+    conds = conditions(label)
+    cs.sp.logger.info(f"Label '{label}', conditions: {', '.join(str(c) for c in conds) if conds else 'none'}")
+
+    wake = threading.Event()
+    requested: List[str] = []
+
+    def on_signal(signum, frame) -> None:
+        requested.append(signal.Signals(signum).name)
+        wake.set()
+
+    for sig in (signal.SIGUSR1, signal.SIGTERM): signal.signal(sig, on_signal)
+    lead = checkpoint_lead()
+    deadline = job_deadline() if lead > 0 else None
+    if deadline is not None: cs.sp.logger.info(f"Checkpoint will be requested at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(deadline - lead))}")
+
+    cs.sp.logger.info(f"Launching: {' '.join(cmd)}")
+    proc = subprocess.Popen(cmd, cwd=cs.sp.cwd)
+    reader = ThermoReader(logfile)
+    every: float = cs.sp.monitor.get(cs.cf.every, 30)
+    halted = False
+    while proc.poll() is None:
+        timeout = every if deadline is None else min(every, max(deadline - lead - time.time(), 0.1))
+        wake.wait(timeout)
+        wake.clear()
+        if halted:
+            proc.wait()
+            continue
+        if len(requested) > 0 or (deadline is not None and time.time() >= deadline - lead):
+            cs.sp.logger.info(f"Checkpoint requested ({requested[0] if requested else 'walltime is close'}), waiting LAMMPS to write it and exit")
+            halt_file(label).touch()
+            halted = True
+            continue
+        for row in reader.poll():
+            met = [c for c in conds if c.feed(row)]
+            if len(met) > 0:
+                halt(label, int(row.get("Step", 0)), "; ".join(str(c) for c in met))
+                halted = True
+                break
+
+    cs.sp.logger.info(f"LAMMPS exited with code {proc.returncode}")
+    if streams is not None: streams.finish()
+    if stager is not None:
+        try:
+            stager.finish()
+            remove_scratch(stager.scratch)
+        except OSError as e:
+            cs.sp.logger.error(f"Stage-out failed, files are left in {stager.scratch.as_posix()}: {e}")
+    if halted and (step := halted_step(logfile)) is not None: record_checkpoint(step)
+    return proc.returncode
+
+
+if __name__ == "__main__":
+    pass
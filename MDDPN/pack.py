@@ -0,0 +1,250 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:25:20
+
+import copy
+import json
+import time
+import shlex
+import subprocess
+from pathlib import Path
+from contextlib import contextmanager, ExitStack
+from typing import Dict, Any, List, Union, Generator
+
+from MPMU import confdict
+import pysbatch_ng
+
+from . import config
+from . import constants as cs
+from .model import Campaign
+from .run import main_command
+from .restart import prepare, register, submitted
+from .utils import states, logs, load_state, locked, lock_file
+
+
+@contextmanager
+def campaign(folder: Path, timeout: Union[float, None] = None, write: bool = True) -> Generator[Dict[str, Any], None, None]:
+    """Switches global state to another campaign folder for the duration of the block, the campaign is locked"""
+    old_cwd, old_state = cs.sp.cwd, cs.sp.state
+    cs.sp.cwd = folder
+    try:
+        with load_state(timeout, write) as state:
+            yield state
+    finally:
+        cs.sp.cwd, cs.sp.state = old_cwd, old_state
+
+
+def pending(state: Dict[str, Any]) -> bool:
+    """Campaign waits for its next segment: it is running and nothing of it is queued or running"""
+    if states(state[cs.sf.state]) not in (states.fully_initialized, states.started, states.restarted): return False
+    return submitted(state) is None
+
+
+def ntasks(sconf: Dict[str, Any]) -> int:
+    return int(sconf[pysbatch_ng.cs.fields.nnodes]) * int(sconf[pysbatch_ng.cs.fields.ntpn])
+
+
+def compat_key(sconf: Dict[str, Any]) -> str:
+    """Segments can share an allocation if everything but the shape and the command is the same (partition, walltime, account...)"""
+    shape = (pysbatch_ng.cs.fields.nnodes, pysbatch_ng.cs.fields.ntpn, pysbatch_ng.cs.fields.executable, pysbatch_ng.cs.fields.args)
+    return json.dumps({k: v for k, v in sconf.items() if k not in shape}, sort_keys=True, default=str)
+
+
+def first_fit(items: List[Dict[str, Any]], capacity: int) -> List[List[Dict[str, Any]]]:
+    """First-fit decreasing by number of tasks"""
+    bins: List[List[Dict[str, Any]]] = []
+    free: List[int] = []
+    for item in sorted(items, key=lambda it: it['ntasks'], reverse=True):
+        for i in range(len(bins)):
+            if free[i] >= item['ntasks']:
+                bins[i].append(item)
+                free[i] -= item['ntasks']
+                break
+        else:
+            bins.append([item])
+            free.append(capacity - item['ntasks'])
+    return bins
+
+
+@logs
+def collect(folders: List[Path], capacity: int) -> List[Dict[str, Any]]:
+    candidates: List[Dict[str, Any]] = []
+    for folder in folders:
+        try:
+            # campaign being restarted right now is not waiting, nothing is decided here, so the state is not written
+            with campaign(folder, 0, write=False) as state:
+                if not pending(state):
+                    cs.sp.logger.info(f"Skipping {folder.as_posix()}: not waiting for the next segment")
+                    continue
+                if not config.cached_configure(Path(state[cs.sf.conffile_path]).resolve(), state[cs.sf.conffile_format]):
+                    cs.sp.logger.error(f"Skipping {folder.as_posix()}: bad configuration")
+                    continue
+                nt = ntasks(cs.sp.sconf_main)
+                if nt > capacity:
+                    cs.sp.logger.warning(f"Skipping {folder.as_posix()}: {nt} tasks do not fit into {capacity}, restart it separately")
+                    continue
+                candidates.append({'folder': folder, 'ntasks': nt, 'key': compat_key(cs.sp.sconf_main), 'sconf': dict(cs.sp.sconf_main)})
+        except Exception as e:
+            cs.sp.logger.error(f"Skipping {folder.as_posix()}: {e}")
+    return candidates
+
+
+def rollback(snapshot: Dict[str, Any]) -> None:
+    """Puts the state back as it was before prepare(), so the segment is decided again by the next restart"""
+    cs.sp.state.clear()
+    cs.sp.state.update(snapshot)
+
+
+@logs
+def submit_pack(items: List[Dict[str, Any]], manifest_file: Path) -> None:
+    """Campaigns stay locked from the decision until the job id is recorded, so a poller can not submit the same segment
+
+    Segments are registered before submission without a job id, the job id is filled in after
+    sbatch returns, or the campaigns are rolled back if it fails.
+    """
+    launcher: str = cs.sp.args.launcher
+    segments: List[Dict[str, Any]] = []
+    snapshots: Dict[str, Dict[str, Any]] = {}
+    with ExitStack() as held:
+        # the same order in every packer
+        for item in sorted(items, key=lambda it: it['folder']):
+            folder: Path = item['folder']
+            try:
+                held.enter_context(locked(lock_file(folder)))
+                with campaign(folder) as state:
+                    if not pending(state):
+                        cs.sp.logger.info(f"Skipping {folder.as_posix()}: restarted since it was collected")
+                        continue
+                    if not config.cached_configure(Path(state[cs.sf.conffile_path]).resolve(), state[cs.sf.conffile_format]):
+                        cs.sp.logger.error(f"Skipping {folder.as_posix()}: bad configuration")
+                        continue
+                    snapshot = copy.deepcopy(state)
+                    try:
+                        prepared = prepare()
+                        if prepared is None:
+                            cs.sp.logger.info(f"End was reached in {folder.as_posix()}, run 'end' there to do post processing")
+                            continue
+                        label, num, in_file = prepared
+                        logdir = f"{cs.folders.slurm}/{label}{num}"
+                        (folder / logdir).mkdir(parents=True, exist_ok=True)
+                        step_launcher = f"{launcher} -n {item['ntasks']}"
+                        executable, args = main_command(in_file, label, logdir, step_launcher)
+                        cmd = f"{executable} {args}" if executable == cs.execs.MDDPN else f"{step_launcher} {executable} {args}"
+                        state[cs.sf.run_counter] += 1
+                        num = register(label, num, in_file, None, **{cs.sf.packed: manifest_file.as_posix()}).num
+                    except Exception:
+                        rollback(snapshot)
+                        raise
+                    snapshots[folder.as_posix()] = snapshot
+                    segments.append({'folder': folder.as_posix(), 'label': label, 'num': num, 'in_file': in_file.as_posix(), 'ntasks': item['ntasks'], 'cmd': cmd})
+            except Exception as e:
+                cs.sp.logger.error(f"Skipping {folder.as_posix()}: failed to prepare segment")
+                cs.sp.logger.exception(e)
+        if len(segments) == 0: return
+
+        with manifest_file.open('w') as fp:
+            json.dump({
+                'segments': segments,
+                'chain': cs.sp.args.chain,
+                'cores': cs.sp.args.cores,
+                'nodes': cs.sp.args.nodes,
+                'launcher': launcher
+            }, fp, indent=4)
+
+        sconf = dict(items[0]['sconf'])
+        sconf[pysbatch_ng.cs.fields.nnodes] = cs.sp.args.nodes
+        sconf[pysbatch_ng.cs.fields.ntpn] = cs.sp.args.cores
+        sconf[pysbatch_ng.cs.fields.executable] = cs.execs.MDDPN
+        sconf[pysbatch_ng.cs.fields.args] = f"--no_screen packrun {manifest_file.as_posix()}"
+        try:
+            jobid = pysbatch_ng.sbatch.run(cs.sp.cwd, cs.sp.logger.getChild("submitter"), confdict(sconf))
+        except Exception:
+            cs.sp.logger.error(f"Submission of {len(segments)} segments failed, rolling their campaigns back")
+            for seg in segments:
+                with campaign(Path(seg['folder'])) as state: rollback(snapshots[seg['folder']])
+            raise
+        cs.sp.logger.info(f"Submitted {len(segments)} segments as job {jobid}, manifest: {manifest_file.as_posix()}")
+
+        for seg in segments:
+            with campaign(Path(seg['folder'])) as state:
+                camp = Campaign.from_state(state)
+                camp.label(seg['label']).segments[seg['num']].jobid = jobid
+                camp.to_state(state)
+
+
+@logs
+def pack() -> int:
+    folders = [Path(folder).resolve() for folder in cs.sp.args.folders]
+    capacity = cs.sp.args.cores * cs.sp.args.nodes
+    candidates = collect(folders, capacity)
+
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for item in candidates:
+        groups.setdefault(item['key'], []).append(item)
+
+    plan = [alloc for group in groups.values() for alloc in first_fit(group, capacity)]
+    for i, alloc in enumerate(plan):
+        used = sum(item['ntasks'] for item in alloc)
+        cs.sp.logger.info(f"Allocation {i}: {used}/{capacity} tasks: " + ", ".join(f"{item['folder'].name} ({item['ntasks']})" for item in alloc))
+    if cs.sp.args.test:
+        cs.sp.logger.info("This is a test, not submitting anything")
+        return 0
+
+    (cs.sp.cwd / cs.folders.pack).mkdir(exist_ok=True)
+    stamp = round(time.time())
+    for i, alloc in enumerate(plan):
+        submit_pack(alloc, cs.sp.cwd / cs.folders.pack / f"{stamp}.{i}.json")
+    return 0
+
+
+@logs
+def finished(seg: Dict[str, Any], code: int) -> None:
+    cs.sp.logger.info(f"{seg['folder']}: {seg['label']}{seg['num']} exited with code {code}")
+    try:
+        with campaign(Path(seg['folder'])) as state:
+            camp = Campaign.from_state(state)
+            camp.label(seg['label']).segments[seg['num']].extra[cs.sf.exit_code] = code
+            camp.to_state(state)
+    except Exception as e:
+        cs.sp.logger.error(f"Failed to update state of {seg['folder']}")
+        cs.sp.logger.exception(e)
+
+
+@logs
+def packrun() -> int:
+    """Runs packed segments as concurrent job steps inside one allocation"""
+    manifest_file = Path(cs.sp.args.manifest).resolve()
+    with manifest_file.open('r') as fp:
+        manifest: Dict[str, Any] = json.load(fp)
+
+    procs: List[subprocess.Popen] = []
+    for seg in manifest['segments']:
+        cs.sp.logger.info(f"Launching in {seg['folder']}: {seg['cmd']}")
+        procs.append(subprocess.Popen(shlex.split(seg['cmd']), cwd=seg['folder']))
+
+    running = set(range(len(procs)))
+    rc = 0
+    while len(running) > 0:
+        time.sleep(5)
+        for i in list(running):
+            if (code := procs[i].poll()) is not None:
+                running.remove(i)
+                finished(manifest['segments'][i], code)
+                rc = rc or code
+
+    if manifest.get('chain'):
+        folders = [seg['folder'] for seg in manifest['segments']]
+        cmd = [cs.execs.MDDPN, "--no_screen", "pack", "--chain", "--cores", str(manifest['cores']), "--nodes", str(manifest['nodes']), "--launcher", manifest['launcher']] + folders
+        cs.sp.logger.info(f"Chaining: {' '.join(cmd)}")
+        subprocess.run(cmd, cwd=cs.sp.cwd)
+    return rc
+
+
+if __name__ == "__main__":
+    pass
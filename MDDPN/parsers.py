@@ -6,7 +6,7 @@
 # This software is released under the MIT License.
 # https://opensource.org/licenses/MIT
 
-# Last modified: 01-05-2024 22:33:28
+# Last modified: 19-10-2026 14:24:02
 
 import re
 import json
@@ -14,9 +14,12 @@ import shutil
 from pathlib import Path
 from typing import Dict, Any, Union
 
+from . import monitor
+from . import insitu
+from . import includes
 from . import regexs as rs
 from . import constants as cs
-from .utils import RestartMode, Part, logs
+from .utils import RestartMode, Part, logs, replicas, replica_path, restart_name, parallel_suffix
 
 
 @logs
@@ -51,50 +54,23 @@ def eva(variables: Dict, evaluand: str):
     return evaluated
 
 
-@logs
-def ift(state: Dict, line: str) -> Dict[str, Any]:
-    line = line.split('#')[0].strip()
-    line = line.replace('"', "").replace("'", "").replace('$', '').replace('{', '').replace('}', '')
-    line = line[2:].strip()
-    condition, outcome = line.split('then')
-    condition = condition.strip()
-    outcome = outcome.strip()
-    mc = re.findall(r"(\W|^)temp(\W|$)", condition)
-    if len(mc) == 0:
-        pass
-    if len(re.findall(rs.jump_inc, line)) > 0:
-        jmp_label = line.split('#')[0].strip().split()[-1]
-        cs.sp.logger.debug("   Jump found in outcome")
-        if state['c_lmp_label'] == jmp_label:
-            cs.sp.logger.debug(f"    Jump and currenl lmp_label are equal '{jmp_label}'")
-            state[cs.sf.run_labels][state["clabel"]] = [(None if isinstance(el, dict) else el) for el in state[cs.sf.run_labels][state["clabel"]]]
-            # state[cs.sf.run_labels][state["clabel"]] = None
-            state['c_lmp_label'] = None
-        else:
-            cs.sp.logger.error(f"Current lmp_label is '{state['c_lmp_label']}', but jump is '{jmp_label}'")
-            raise RuntimeError(f"Current lmp_label is '{state['c_lmp_label']}', but jump is '{jmp_label}'")
-    else:
-        cs.sp.logger.debug("    Nothing was found in outcome")
-    return state
-
-
 @logs
 def restart(state: Dict, line: str) -> Dict[str, Any]:
     rmode = RestartMode.none
     if re.match(rs.restart_one, line):
         cs.sp.logger.debug("    found one-file restart mode")
         rmode = RestartMode.one
-        w_restart, RESTART_FREQUENCY, RESTART_FILE = line.split('#')[0].strip().split()
+        w_restart, RESTART_FREQUENCY, RESTART_FILE, *options = line.split('#')[0].strip().split()
         pass
     elif re.match(rs.restart_two, line):
         cs.sp.logger.debug("    found two-file restart mode")
         rmode = RestartMode.two
-        w_restart, RESTART_FREQUENCY, RESTART_FILE1, RESTART_FILE2 = line.split('#')[0].strip().split()
+        w_restart, RESTART_FREQUENCY, RESTART_FILE, RESTART_FILE2, *options = line.split('#')[0].strip().split()
         pass
     elif re.match(rs.restart_multiple, line):
         cs.sp.logger.debug("    found multiple-file restart mode")
         rmode = RestartMode.multiple
-        w_restart, RESTART_FREQUENCY, RESTART_FILES = line.split('#')[0].strip().split()
+        w_restart, RESTART_FREQUENCY, RESTART_FILE, *options = line.split('#')[0].strip().split()
         # RESTART_FILES = Path(RESTART_FILES).parts[-1].split('.')[-2]
         # state[cs.sf.restart_files] = RESTART_FILES
         pass
@@ -111,9 +87,15 @@ def restart(state: Dict, line: str) -> Dict[str, Any]:
     else:
         cs.sp.logger.warning(f"    Restart modes are not equal, specified: {state[cs.sf.restart_mode]}, infile: {rmode}")
         cs.sp.logger.warning("    Using specified restart mode")
+    suffix = parallel_suffix(RESTART_FILE)
+    if len(options) > 0 and suffix != '.%':
+        raise RuntimeError("    'fileper' and 'nfile' restart keywords require '%' in restart file name")
+    cs.sp.logger.debug(f"    Restart file suffix: '{suffix}', options: '{' '.join(options)}'")
     RESTART_FREQUENCY = eva(state[cs.sf.variables], RESTART_FREQUENCY)
     state[cs.sf.restart_every] = RESTART_FREQUENCY
     state[cs.sf.restart_files] = 'restart'
+    state[cs.sf.restart_suffix] = suffix
+    state[cs.sf.restart_options] = " ".join(options)
 
     return state
 
@@ -146,19 +128,18 @@ def timestep(state: Dict, line: str) -> Dict[str, Any]:
     return state
 
 
-@logs
-def run(state: Dict, line: str) -> Dict[str, Any]:
-    w_run, RUN_STEPS = line.split()
-    RUN_STEPS = eva(state[cs.sf.variables], RUN_STEPS)
-    if state['c_lmp_label'] is not None:
-        cs.sp.logger.debug(f"    Current LAMMPS label is set: '{state['c_lmp_label']}'")
-        cs.sp.logger.debug(f"    Setting state[{cs.sf.run_labels}][{state['clabel']}]+=[" + "{" + f"'{state['c_lmp_label']}':{RUN_STEPS}" + "}]")
-        state[cs.sf.run_labels][state["clabel"]] += [{state['c_lmp_label']: RUN_STEPS}]  # type: ignore
-    else:
-        cs.sp.logger.debug(f"    Setting state[{cs.sf.run_labels}][{state['clabel']}]+=[{RUN_STEPS}]")
-        state[cs.sf.run_labels][state["clabel"]] += [RUN_STEPS]  # type: ignore
+def dump_suffix(filename: str) -> str:
+    """Parts of dump file name LAMMPS gives meaning to
 
-    return state
+    '*' (file per snapshot) and '%' (file per processor) wildcards and extensions selecting
+    the format: binary, compressed, MPI-IO, NetCDF, HDF5. Other extensions are dropped.
+    """
+    suffix = ""
+    for i, part in enumerate(Path(filename).name.split('.')):
+        if '*' in part: suffix += ".*"
+        elif '%' in part: suffix += ".%"
+        elif i > 0 and part in cs.params.dump_extensions: suffix += f".{part}"
+    return suffix
 
 
 @logs
@@ -174,9 +155,16 @@ def __generator(num: int, label: str) -> Path:
 
     stf: Path = (cs.sp.cwd / cs.folders.in_templates / cs.files.template)
 
+    nrep = replicas()
+    seeds: Dict[str, Any] = cs.sp.state.get(cs.sf.seeds, {}) if nrep > 1 else {}
+    rsuffix = f".r${{{cs.params.replica_var}}}" if nrep > 1 else ""
+
     cs.sp.logger.info("Starting line by line rewriting")
-    with stf.open('r') as fin, out_in_file.open('w') as fout:
-        for i, line in enumerate(fin):
+    with out_in_file.open('w') as fout:
+        if nrep > 1:
+            cs.sp.logger.debug(f"Declaring {nrep} replicas")
+            fout.write(f"variable {cs.params.replica_var} world {' '.join(str(k) for k in range(nrep))}\n")
+        for i, (_, line) in enumerate(includes.expand(stf)):
             if re.match(rs.variable_equal_const, line):
                 cs.sp.logger.debug(f"Line {i}, found const variable")
                 w_variable, VAR_NAME, w_equal, VAR_VAL = line.split('#')[0].strip().split()
@@ -188,35 +176,42 @@ def __generator(num: int, label: str) -> Path:
                 for var, value in variables.items():
                     if re.match(rs.required_variable_equal_numeric(var), line):
                         fl = False
-                        cs.sp.logger.debug(f"    Variable: '{var}', setting to {value}")
-                        line = f"variable {var} equal {value}\n"
+                        if var in seeds:
+                            cs.sp.logger.debug(f"    Variable: '{var}', setting per replica to {seeds[var]}")
+                            line = f"variable {var} world {' '.join(str(seed) for seed in seeds[var])}\n"
+                        else:
+                            cs.sp.logger.debug(f"    Variable: '{var}', setting to {value}")
+                            line = f"variable {var} equal {value}\n"
                 if fl:
                     cs.sp.logger.debug("    Known user variables were not found in this line")
             elif re.match(rs.set_dump, line):
                 cs.sp.logger.debug(f"Line {i}, found set dump")
                 w_dump, DUMP_NAME, GROUP, DUMP_STYLE, DUMP_FREQUENCY, DUMP_FILE, *other_args = line.split("#")[0].strip().split()
-                dfn = f"{cs.folders.dumps}/{label}{num}"
-                line = f"dump {DUMP_NAME} {GROUP} {DUMP_STYLE} {DUMP_FREQUENCY} {dfn} "
-                line += " ".join(other_args) + "\n"
+                dfn = f"{monitor.scratch_prefix()}{cs.folders.dumps}/{label}{num}{rsuffix}{dump_suffix(DUMP_FILE)}"
+                if insitu.streamed(DUMP_NAME, DUMP_STYLE, dump_suffix(DUMP_FILE)): dfn = insitu.fifo_path(DUMP_NAME)
+                line = " ".join([f"dump {DUMP_NAME} {GROUP} {DUMP_STYLE} {DUMP_FREQUENCY} {dfn}"] + other_args) + "\n"
                 cs.sp.logger.debug(f"Dump file will be {dfn}")
             elif re.match(rs.write_restart, line):
                 cs.sp.logger.debug(f"Line {i}, found write_restart")
-                cs.sp.logger.debug(f"    Redirecting to '{cs.folders.special_restarts}/{label}.{num}'")
-                line = f"write_restart {cs.folders.special_restarts}/{label}.{num}\n"
+                cs.sp.logger.debug(f"    Redirecting to '{cs.folders.special_restarts}/{label}.{num}{rsuffix}'")
+                w_write_restart, WRITE_FILE, *options = line.split("#")[0].strip().split()
+                line = " ".join([w_write_restart, f"{cs.folders.special_restarts}/{label}.{num}{rsuffix}{parallel_suffix(WRITE_FILE)}"] + options) + "\n"
             elif re.match(rs.set_restart, line):
                 cs.sp.logger.debug(f"Line {i}, found set restart")
-                rfn = f"{cs.folders.restarts}/{cs.sp.state[cs.sf.restart_files]}"
+                rfn = f"{monitor.scratch_prefix()}{replica_path()}/"
+                line_list = line.split("#")[0].split()[:2]
                 if RestartMode(cs.sp.state[cs.sf.restart_mode]) == RestartMode.multiple:
                     cs.sp.logger.debug("Restart mode is multiple-filed")
-                    line_list = line.split()[:-1] + [f"{rfn}.*", "\n"]
+                    line_list += [rfn + restart_name(".*")]
                 elif RestartMode(cs.sp.state[cs.sf.restart_mode]) == RestartMode.one:
                     cs.sp.logger.debug("Restart mode is one-filed")
-                    line_list = line.split()[:-1] + [f"{rfn}", "\n"]
+                    line_list += [rfn + restart_name("")]
                 elif RestartMode(cs.sp.state[cs.sf.restart_mode]) == RestartMode.two:
                     cs.sp.logger.debug("Restart mode is two-filed")
-                    line_list = line.split()[:-1] + [f"{rfn}.a {rfn}.b", "\n"]
+                    line_list += [rfn + restart_name(".a"), rfn + restart_name(".b")]
                 else: raise RuntimeError("Software bug")
-                line = " ".join(line_list)
+                if cs.sp.state.get(cs.sf.restart_options): line_list.append(cs.sp.state[cs.sf.restart_options])
+                line = " ".join(line_list) + "\n"
             else:
                 pass  # leave unrecognized line
             fout.write(line)
@@ -225,11 +220,27 @@ def __generator(num: int, label: str) -> Path:
 
 
 @logs
-def generator(num: int, current_label: str,  restart_file: Union[Path, None] = None) -> Path:
+def supervise(out_file: Path, label: str) -> Path:
+    """Halt fix is injected for closed labels too: it only reacts to the halt file, which monitor touches for checkpoints there"""
+    cs.sp.logger.debug("Injecting halt fix before first run and checkpoint at the end")
+    with out_file.open('r') as fp:
+        lines = fp.readlines()
+    for i, line in enumerate(lines):
+        if re.match(rs.run, line):
+            lines.insert(i, monitor.halt_block(label))
+            break
+    lines.append(monitor.checkpoint_block())
+    with out_file.open('w') as fp:
+        fp.writelines(lines)
+    return out_file
+
+
+@logs
+def generator(num: int, current_label: str,  restart_file: Union[Path, None] = None, supervised: bool = True) -> Path:
     cs.sp.logger.info("Generating input file from template")
     out_file = __generator(num, current_label)
     if restart_file is None:
-        return out_file
+        return supervise(out_file, current_label) if supervised and monitor.enabled() else out_file
     out_file_tmp_name = out_file.parts[-1] + ".bak"
     out_file_tmp_parts = list(out_file.parts[:-1]) + [out_file_tmp_name]
     out_file_tmp = Path(*out_file_tmp_parts)
@@ -245,6 +256,9 @@ def generator(num: int, current_label: str,  restart_file: Union[Path, None] = N
     label = None
     cs.sp.logger.debug("Start line by line rewriting")
     with out_file_tmp.open('r') as fin, out_file.open('w') as fout:
+        if replicas() > 1:
+            # restart file path depends on replica, LAMMPS ignores the second declaration from template part
+            fout.write(f"variable {cs.params.replica_var} world {' '.join(str(k) for k in range(replicas()))}\n")
         fout.write(f"read_restart {restart_file.as_posix()}\n")
         fout.write("run 0\n")
         for i, line in enumerate(fin):
@@ -287,7 +301,7 @@ def generator(num: int, current_label: str,  restart_file: Union[Path, None] = N
     # shutil.copy(out_file_tmp, out_file)
     out_file_tmp.unlink()
 
-    return out_file
+    return supervise(out_file, current_label) if supervised and monitor.enabled() else out_file
 
 
 if __name__ == "__main__":
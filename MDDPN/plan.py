@@ -0,0 +1,220 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:32:14
+
+import re
+import json
+import tempfile
+from pathlib import Path
+from typing import Dict, Any, List, Tuple, Union
+
+import pysbatch_ng
+
+from . import parsers, includes, regexs as rs, constants as cs
+from .init import initialize
+from .model import Campaign
+from .thermo import performance
+from .monitor import checkpoint_lead
+from .restart import retrieve_current_label, set_last_timestep, register
+from .utils import RestartMode, states, logs, render_table
+
+
+def parse_walltime(walltime: str) -> float:
+    """Seconds from slurm time format: minutes, [D-]HH:MM[:SS]"""
+    days = 0
+    if '-' in walltime:
+        d, walltime = walltime.split('-')
+        days = int(d)
+    parts = [int(p) for p in walltime.split(':')]
+    if len(parts) == 1 and days == 0: return parts[0] * 60.
+    while len(parts) < 3: parts.append(0)
+    h, m, s = parts
+    return float(((days * 24 + h) * 60 + m) * 60 + s)
+
+
+def open_lengths(specs: Union[List[str], None]) -> Dict[str, int]:
+    res: Dict[str, int] = {}
+    for spec in specs or []:
+        name, steps = spec.split('=')
+        res[name.strip()] = int(steps)
+    return res
+
+
+@logs
+def dump_schedule(template: Path) -> Dict[str, Dict[str, int]]:
+    """Frequencies of dumps active in every label, dumps persist across labels until undump"""
+    variables = cs.sp.state[cs.sf.variables]
+    schedule: Dict[str, Dict[str, int]] = {"START": {}}
+    label = "START"
+    active: Dict[str, int] = {}
+    for _, line in includes.expand(template):
+        if re.match(rs.label_declaration, line):
+            label = line.strip().split()[-1]
+            schedule[label] = dict(active)
+        elif re.match(rs.set_dump, line):
+            w_dump, DUMP_NAME, GROUP, DUMP_STYLE, DUMP_FREQUENCY, *other = line.split("#")[0].strip().split()
+            active[DUMP_NAME] = int(parsers.eva(variables, DUMP_FREQUENCY))
+            schedule[label][DUMP_NAME] = active[DUMP_NAME]
+        elif re.match(rs.undump, line):
+            active.pop(line.split()[-1], None)
+    return schedule
+
+
+def frames(lo: int, hi: int, every: int) -> int:
+    """Dump frames written on [lo, hi), including the first step of the run"""
+    return (hi - 1) // every - (lo - 1) // every
+
+
+def horizon(campaign: Campaign, step: int, lengths: Dict[str, int]) -> Tuple[int, Union[str, None]]:
+    """Step where the job input ends: end of the campaign or halt at the end of open-ended label (returned too)"""
+    label = campaign.resolve(step)
+    if label is None: raise RuntimeError(f"Step {step} is outside of the campaign")
+    for lb in campaign.labels[campaign.labels.index(label):]:
+        if lb.end_step is None:
+            if lb.name not in lengths: raise RuntimeError(f"Label '{lb.name}' is open-ended, give its length with --open {lb.name}=STEPS")
+            return lb.begin_step + lengths[lb.name], lb.name
+    return campaign.end_step, None  # type: ignore
+
+
+@logs
+def replay(tps: float, walltime: float, schedule: Dict[str, Dict[str, int]]) -> Dict[str, Any]:
+    """Restart cycle on scratch state with fake clock, using the same label resolution as real restarts"""
+    args = cs.sp.args
+    state = cs.sp.state
+    every = int(state[cs.sf.restart_every])
+    lengths = open_lengths(args.open)
+    lead = checkpoint_lead()
+    per_label: Dict[str, Dict[str, Any]] = {name: {"steps": 0, "segments": 0, "frames": 0} for name in state[cs.sf.labels_list]}
+    clock = 0.
+    lost = 0
+    used_total = 0.
+    restart_peak = 0
+    segments = 0
+
+    step = 0
+    current = "START"
+    state[cs.sf.state] = states.started
+    while True:
+        if segments > 0:
+            campaign = Campaign.from_state(state)
+            current = retrieve_current_label(step, campaign)
+            campaign.record_restart(step, current, clock)
+            campaign.to_state(state)
+            set_last_timestep(step, current)
+            if (end := campaign.end_step) is not None and step >= end - every: break
+        if segments >= args.max_segments: raise RuntimeError(f"More than {args.max_segments} segments, giving up")
+
+        campaign = Campaign.from_state(state)
+        stop, halted = horizon(campaign, step, lengths)
+        clock += args.queue_wait
+        reach = step + tps * max(walltime - args.startup - lead, 0)
+        if reach >= stop:
+            reached = stop
+            last = stop if halted is not None else stop // every * every
+            used = args.startup + (stop - step) / tps
+        else:
+            reached = int(reach)
+            # with graceful checkpoint the job writes restart at the step it was stopped
+            last = reached if lead > 0 else reached // every * every
+            used = walltime
+        if last <= step: raise RuntimeError(f"Segment started at step {step} does not reach the next restart, walltime is too short")
+
+        for lb in campaign.labels[campaign.labels.index(campaign.resolve(step)):]:  # type: ignore
+            end = lb.end_step if lb.end_step is not None else stop
+            lo, hi = max(step, lb.begin_step), min(reached, end)
+            if lo < hi:
+                rec = per_label[lb.name]
+                rec["steps"] += hi - lo
+                rec["frames"] += sum(frames(lo, hi, f) for f in schedule.get(lb.name, {}).values())
+            if lb.end_step is None or end >= reached: break
+        per_label[current]["segments"] += 1
+
+        restart_peak = max(restart_peak, (last - step) // every if RestartMode(state[cs.sf.restart_mode]) == RestartMode.multiple else (2 if RestartMode(state[cs.sf.restart_mode]) == RestartMode.two else 1))
+        lost += reached - last
+        used_total += used
+        clock += used
+        segments += 1
+        num = int(state[cs.sf.run_labels][current][cs.sf.runs])
+        state[cs.sf.run_counter] += 1
+        register(current, num, Path(f"{current}{num}.in"), segments)
+        if halted is not None and reach >= stop:
+            # what monitor would write when the stopping condition is met
+            with (cs.sp.cwd / cs.folders.signals / f"{halted}.signal").open('w') as fp:
+                fp.write(f"{stop}  # planned\n")
+        if halted is None and reach >= stop: break
+        step = last
+
+    nnodes = int(cs.sp.sconf_main[pysbatch_ng.cs.fields.nnodes])
+    return {
+        "segments": segments,
+        "submissions": segments * (1 + int(cs.sp.run_tests) + int(not args.no_auto)) + int(cs.sp.allow_post_process),
+        "wall_hours": clock / 3600,
+        "node_hours": used_total * nnodes / 3600,
+        "lost_steps": lost,
+        "lost_node_hours": lost / tps * nnodes / 3600,
+        "restart_files_peak": restart_peak,
+        "labels": per_label
+    }
+
+
+def report(res: Dict[str, Any]) -> str:
+    args = cs.sp.args
+    lines = [
+        f"Segments:            {res['segments']}",
+        f"Queue submissions:   {res['submissions']}",
+        f"Node-hours:          {res['node_hours']:.1f}",
+        f"Wall time:           {res['wall_hours']:.1f} h",
+        f"Lost work:           {res['lost_steps']} steps, {res['lost_node_hours']:.1f} node-hours",
+        f"Restart files peak:  {res['restart_files_peak']}" + (f" ({res['restart_files_peak'] * args.restart_mb:.0f} MB)" if args.restart_mb else ""),
+        "",
+    ]
+    rows = [["label", "steps", "segments", "dump frames", "dump MB"]]
+    for name, rec in res['labels'].items():
+        rows.append([name, str(rec['steps']), str(rec['segments']), str(rec['frames']), f"{rec['frames'] * args.frame_mb:.0f}" if args.frame_mb else "-"])
+    lines.append(render_table(rows))
+    return "\n".join(lines)
+
+
+@logs
+def plan() -> int:
+    args = cs.sp.args
+    if args.tps is not None: tps = args.tps
+    elif args.log is not None:
+        measured = performance(Path(args.log))
+        if len(measured) == 0: raise RuntimeError(f"No performance lines found in {args.log}")
+        tps = measured[-1]
+    else: raise RuntimeError("Either throughput (--tps) or LAMMPS log to measure it from (--log) is required")
+    walltime = parse_walltime(args.walltime)
+    cs.sp.logger.info(f"Throughput {tps} steps/s, walltime {walltime} s")
+
+    if args.fname is not None:
+        with (cs.sp.cwd / args.fname).open('r') as f: variables = json.load(f)
+    elif args.params_from_conf: variables = cs.sp.params
+    else: variables = json.loads(args.params)
+
+    templates = (cs.sp.cwd / cs.folders.in_templates).resolve()
+    old_cwd, old_templates, old_state = cs.sp.cwd, cs.folders.in_templates, cs.sp.state
+    with tempfile.TemporaryDirectory(prefix=cs.folders.tmp_dir_basename) as tmp:
+        # scratch campaign, nothing is written to the working directory
+        cs.sp.cwd = Path(tmp)
+        cs.folders.in_templates = templates.as_posix()
+        try:
+            for folder in (cs.folders.in_file, cs.folders.signals, cs.folders.restarts): (cs.sp.cwd / folder).mkdir()
+            initialize(variables, RestartMode(str(args.restart_mode)), 1)
+            res = replay(tps, walltime, dump_schedule(templates / cs.files.template))
+        finally:
+            cs.sp.cwd, cs.folders.in_templates, cs.sp.state = old_cwd, old_templates, old_state
+
+    if args.json: print(json.dumps(res, indent=4))
+    else: print(report(res))
+    return 0
+
+
+if __name__ == "__main__":
+    pass
@@ -6,42 +6,57 @@
 # This software is released under the MIT License.
 # https://opensource.org/licenses/MIT
 
-# Last modified: 25-09-2023 15:08:24
+# Last modified: 19-10-2026 14:27:16
+
+import re
 
 variable_equal_numeric = r"^\s*variable\s+[a-zA-Z_\d]+\s+equal\s+\d+[\.\/]?\d+\s*"
 variable_equal_const = r"^\s*variable\s+[a-zA-Z_\d]+\s+equal\s+(\d+|\$\{.*?\})\s*#!const\s*$"
 
 variable_equal = r"^\s*variable\s+[a-zA-Z_\d]+\s+equal\s+.*$"
-variable_loop = r"^\s*variable\s+[a-zA-Z_\d]+\s+loop\s+.*$"
 
 run = r"^\s*run\s+.*$"
-ift = r"^\s*if\s+\".*?\"\s+then\s+.*$"
 set_timestep = r"^\s*timestep\s+.*$"
 
 set_restart = r"^\s*restart\s+.*$"
-restart_one = r"^\s*restart\s+(\d+|\$\{.*?\})\s+[a-zA-Z_/\d]+\.[a-zA-Z_\d]+\s*$"
-restart_two = r"^\s*restart\s+(\d+|\$\{.*?\})\s+[a-zA-Z_/\d]+\.[a-zA-Z_\d]+\s+[a-zA-Z_/\d]+\.[a-zA-Z_\d]\s*$"
-restart_multiple = r"^\s*restart\s+(\d+|\$\{.*?\})\s+[a-zA-Z_/]+\.\*\s*$"
+# parallel restarts: '.mpiio' suffix (MPI-IO) or '%' (file per processor), the latter with 'fileper' or 'nfile' keywords
+restart_suffix = r"(\.mpiio|\.%)?"
+restart_keywords = r"(\s+(fileper|nfile)\s+(\d+|\$\{.*?\}))*"
+restart_one = r"^\s*restart\s+(\d+|\$\{.*?\})\s+[a-zA-Z_/\d\$\{\}]+\.?[a-zA-Z_\d]*" + restart_suffix + restart_keywords + r"\s*$"
+restart_two = r"^\s*restart\s+(\d+|\$\{.*?\})\s+[a-zA-Z_/\d\$\{\}]+\.[a-zA-Z_\d]+" + restart_suffix + r"\s+[a-zA-Z_/\d\$\{\}]+\.[a-zA-Z_\d]+" + restart_suffix + restart_keywords + r"\s*$"
+restart_multiple = r"^\s*restart\s+(\d+|\$\{.*?\})\s+[a-zA-Z_/\d\$\{\}]+\.\*" + restart_suffix + restart_keywords + r"\s*$"
+
+write_restart = r"^\s*write_restart\s+[a-zA-Z_/\.%]+" + restart_keywords + r"\s*$"
+
+# dump ID group style N file args, args are style specific and are not checked
+set_dump = r"^\s*dump\s+[a-zA-Z_\d]+\s+[a-zA-Z_\d]+\s+[a-zA-Z_\d]+(\/[a-zA-Z_\d]+)?\s+(\d+|\$\{[a-zA-Z_\d]+\})\s+[^\s#]+(\s+[^#]*)?(#.*)?$"
 
-write_restart = r"^\s*write_restart\s+[a-zA-Z_/\.]+\s*$"
+include = r"^\s*include\s+[^\s#]+\s*(#.*)?$"
 
-set_dump = r"^\s*dump\s+[a-zA-Z_]+\s+[a-zA-Z_]+\s+[a-zA-Z_]+\/?[a-zA-Z_]+\s+(\d+|\$\{[a-zA-Z_\d]+\})\s+[a-zA-Z_\d]+\.?[a-zA-Z_]*(\s+[a-zA-Z_]+)*\s*$"
+undump = r"^\s*undump\s+[a-zA-Z_\d]+\s*$"
 
-lmp_label = r"^\s*label\s+[a-zA-Z_]+\s*$"
-jump = r"^\s*jump\s+SELF\s+[a-zA-Z_]+\s*$"
-jump_inc = r"jump\s+SELF\s+[a-zA-Z_]+$"
-next = r"^\s*next\s+[a-zA-Z_]+\s*$"
 label_declaration = r"^\s*#\s+label:\s[a-zA-Z]+\s*"
 
 datafile_header = r"^LAMMPS data file via write_data, version \d{1,2} [a-zA-Z]{3} \d{4}, timestep = \d+, units = [a-zA-Z_]+$"
 
 part_spec = r"^\s*# part: [a-zA-Z_]+\s*$"
 
+# sbatch errors worth retrying later: QOS and association limits, busy controller
+sbatch_rejected = r"(QOSMax\w*|QOSGrp\w*|AssocMax\w*|AssocGrp\w*|MaxSubmit\w*|[Jj]ob violates accounting/QOS policy|[Ss]ocket timed out|[Rr]esource temporarily unavailable|[Tt]ry again)"
+# squeue error for a job slurmctld no longer knows, it ended long ago
+squeue_unknown_job = r"[Ii]nvalid job id"
+
 
 def required_variable_equal_numeric(var) -> str:
     return r"^\s*variable\s+" + str(var) + r"\s+equal\s+[\d]+[\.\/]?\d+\s*"
 
 
+def restart_numbered(basename: str, suffix: str) -> str:
+    """Files of numbered restarts (multiple mode), step is the first group. Per-processor ones are the '.base' file and a file per processor"""
+    parallel = r"\.(base|\d+)" if suffix == ".%" else re.escape(suffix)
+    return r"^" + re.escape(basename) + r"\.(\d+)" + parallel + "$"
+
+
 def read_restart_specify(restart_file):
     return r"\s*read_restart\s+" + restart_file + r"\d+\s*"
 
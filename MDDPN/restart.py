@@ -6,52 +6,60 @@
 # This software is released under the MIT License.
 # https://opensource.org/licenses/MIT
 
-# Last modified: 02-05-2024 23:10:22
+# Last modified: 19-10-2026 14:28:02
 
+import os
 import re
-import shutil
+import copy
+import json
+import time
 from pathlib import Path
-from typing import Dict, Tuple, Any
+from typing import Dict, Any, Tuple, Union, List
 
 from MPMU import wexec
 
-from . import parsers
+from . import parsers, series, history
 from . import regexs as rs
-from .run import submit_run, run_polling
+from .run import submit_run, run_polling, job_active, rejected, enqueue
+from .monitor import halt_file
 from . import constants as cs
-from .utils import RestartMode, states, logs, RC
+from .model import Campaign, Segment
+from .utils import intent_file, RestartMode, states, logs, read_signal, replicas, replica_folder, replica_path, RC
+from .utils import restart_suffix, restart_name, restart_base, restart_parts, remove_restart
 
 
-def find_last(folder: Path, basename: str) -> int:
+def available_steps(folder: Path, basename: str, suffix: Union[str, None] = None) -> List[int]:
+    """Steps of restarts in multiple mode, per-processor restarts are found by their base file"""
+    if suffix is None: suffix = restart_suffix()
+    regex = re.compile(r"^" + basename + r"\.(\d+)" + re.escape(suffix.replace('%', 'base')) + "$")
     files = []
     for file in folder.iterdir():
-        filename = file.parts[-1]
-        if re.match(r"^" + basename + r"\.\d+$", filename):
-            files.append(int(filename.split('.')[-1]))
+        if (m := regex.match(file.name)):
+            files.append(int(m.group(1)))
+    return files
+
+
+def find_last(folder: Path, basename: str, suffix: Union[str, None] = None) -> int:
+    files = available_steps(folder, basename, suffix)
     if len(files) < 1:
         return -1
     return max(files)
 
 
-def restart_cleanup(fl: int) -> None:
-    rf: Path = cs.sp.cwd / cs.folders.restarts
-    filename = cs.sp.state[cs.sf.restart_files] + '.' + str(fl)
-    to_save: Path = rf / filename
-    temp_file: Path = cs.sp.cwd / filename
-    shutil.copy(to_save, temp_file)
+def restart_cleanup(fl: int, rf: Union[Path, None] = None) -> None:
+    if rf is None: rf = cs.sp.cwd / cs.folders.restarts
+    keep = set(restart_parts(rf / restart_name(f".{fl}")))
+    if history.enabled():
+        history.capture({step: restart_parts(rf / restart_name(f".{step}")) for step in available_steps(rf, cs.sp.state[cs.sf.restart_files])}, keep)
     for file in rf.iterdir():
-        file.unlink()
-    shutil.copy(temp_file, to_save)
-    temp_file.unlink()
+        if file.is_file() and file not in keep:
+            file.unlink()
 
 
 @logs
 def restart2data(restartfile: Path) -> Path:
-    parts = list(restartfile.parts)
-    filename = parts[-1]
-    file_basename = ".".join(filename.split('.')[:-1])
-    datafile_parts = parts + [file_basename + ".dat"]
-    datafile = Path(*datafile_parts)
+    # per-processor restart is read by its name with '%', but the data file can not contain it
+    datafile = restartfile.parent / (restart_base(restartfile).name + ".dat")
     cs.sp.logger.debug(f"Resulting datafile: {datafile.as_posix()}")
     cmd = f"{cs.execs.lammps_nonmpi} -restart2data {restartfile.as_posix()} {datafile.as_posix()}"
     wexec(cmd, cs.sp.logger.getChild('lammps-r2d'))
@@ -71,77 +79,118 @@ def retrieve_last_step_from_restart(restartfile: Path) -> int:
     else: raise RuntimeError(f"Resulting datafile does not contain proper header: {datafile.as_posix()}")
 
 
-@logs
-def retrieve_last_timestep() -> Tuple[int, Path]:
+def recorded_checkpoint(folder: Path) -> Union[Tuple[int, Path], None]:
+    """Checkpoint written on halt, recorded by monitor. Valid while the file was not overwritten since"""
+    record = folder / cs.files.checkpoint
+    if not record.exists(): return None
+    try:
+        with record.open('r') as fp: data = json.load(fp)
+        file = folder / data["file"]
+        base = restart_base(file)
+        if base.exists() and base.stat().st_mtime_ns == data["mtime"]: return (int(data[cs.sf.last_step]), file)
+    except (ValueError, KeyError, TypeError):
+        cs.sp.logger.warning(f"Checkpoint record {record.as_posix()} is unreadable, ignoring it")
+    return None
+
+
+def last_timestep_in(folder: Path) -> Tuple[int, Path]:
     if RestartMode(cs.sp.state[cs.sf.restart_mode]) == RestartMode.multiple:
         if cs.sp.args.step is None:
-            last_timestep: int = find_last(cs.sp.cwd / cs.folders.restarts, cs.sp.state[cs.sf.restart_files])
-            if last_timestep < 0: raise RuntimeError(f"Cannot find any restart files in folder {(cs.sp.cwd / cs.folders.restarts).as_posix()}")
+            last_timestep: int = find_last(folder, cs.sp.state[cs.sf.restart_files])
+            if last_timestep < 0: raise RuntimeError(f"Cannot find any restart files in folder {folder.as_posix()}")
             cs.sp.logger.info("Cleaning restarts folder")
-            restart_cleanup(last_timestep)
+            restart_cleanup(last_timestep, folder)
         else:
             last_timestep = cs.sp.args.step
-        restart_file: Path = cs.sp.cwd / cs.folders.restarts / (cs.sp.state[cs.sf.restart_files] + f".{last_timestep}")
-        if not restart_file.exists(): raise RuntimeError("Specified step restart file not found")
+        restart_file: Path = folder / restart_name(f".{last_timestep}")
+        if not restart_base(restart_file).exists(): raise RuntimeError("Specified step restart file not found")
     elif RestartMode(cs.sp.state[cs.sf.restart_mode]) == RestartMode.one:
-        restart_file = cs.sp.cwd / cs.folders.restarts / cs.sp.state[cs.sf.restart_files]
-        last_timestep = retrieve_last_step_from_restart(restart_file)
+        restart_file = folder / restart_name("")
+        if (rec := recorded_checkpoint(folder)) is not None:
+            cs.sp.logger.info(f"Using recorded checkpoint at step {rec[0]}")
+            last_timestep = rec[0]
+        else:
+            last_timestep = retrieve_last_step_from_restart(restart_file)
     elif RestartMode(cs.sp.state[cs.sf.restart_mode]) == RestartMode.two:
-        restart_file1: Path = cs.sp.cwd / cs.folders.restarts / (cs.sp.state[cs.sf.restart_files] + '.a')
-        restart_file2: Path = cs.sp.cwd / cs.folders.restarts / (cs.sp.state[cs.sf.restart_files] + '.b')
+        restart_file1: Path = folder / restart_name(".a")
+        restart_file2: Path = folder / restart_name(".b")
+        if (rec := recorded_checkpoint(folder)) is not None:
+            other = restart_base(restart_file2 if rec[1] == restart_file1 else restart_file1)
+            # periodic restart written after the checkpoint, e.g. by a later segment
+            if other.exists() and other.stat().st_mtime_ns > restart_base(rec[1]).stat().st_mtime_ns: rec = None
+        if rec is not None:
+            cs.sp.logger.info(f"Using recorded checkpoint at step {rec[0]}")
+            last_timestep, restart_file = rec
+            remove_restart(restart_file2 if rec[1] == restart_file1 else restart_file1)
+            return (last_timestep, restart_file)
         last_timestep1 = retrieve_last_step_from_restart(restart_file1)
         last_timestep2 = retrieve_last_step_from_restart(restart_file2)
         if last_timestep1 > last_timestep2:
             last_timestep = last_timestep1
             restart_file = restart_file1
-            restart_file2.unlink()
+            remove_restart(restart_file2)
         else:
             last_timestep = last_timestep2
             restart_file = restart_file2
-            restart_file1.unlink()
+            remove_restart(restart_file1)
     else: raise RuntimeError("Software bug")
 
     return (last_timestep, restart_file)
 
 
 @logs
-def retrieve_current_label(last_timestep: int) -> str:
-    rlabels: Dict[str, Any] = cs.sp.state[cs.sf.run_labels]
-    for label in rlabels.keys():
-        if last_timestep < rlabels[label][cs.sf.begin_step]:
-            continue
-
-        if rlabels[label][cs.sf.end_step] is not None:
-            if last_timestep < rlabels[label][cs.sf.end_step] - 1: return label
-            else: continue
-        else:
-            cs.sp.logger.debug(f"End step of label '{label}' is undefined")
-            nts = (cs.sp.cwd / cs.folders.signals / f"{label}.signal")
-            if not nts.exists():
-                cs.sp.logger.debug("Signal file for label does not exists, assuming label was not continued")
-                return label
-            else:
-                cs.sp.logger.debug("Found signal file for label, assuming label was continued")
-                with nts.open('r') as fp: rrt = fp.readline().split("#")[0].strip()
-
-                if re.match(r"\d+", rrt):
-                    lls = int(rrt)
-                    if lls < int(cs.sp.state[cs.sf.restart_every]):
-                        cs.sp.logger.debug(f"Signal step is less than 1000 and is {lls} — so small, continue with current label")
-                        nts.unlink()
-                        return label
-                    cs.sp.state[cs.sf.run_labels][label][cs.sf.end_step] = lls
-                    flg = False
-                    for ml_label in rlabels.keys():
-                        if not flg:
-                            flg = ml_label == label
-                        else:
-                            cs.sp.state[cs.sf.run_labels][ml_label][cs.sf.begin_step] += lls
-                            if cs.sp.state[cs.sf.run_labels][ml_label][cs.sf.end_step] is not None:
-                                cs.sp.state[cs.sf.run_labels][ml_label][cs.sf.end_step] += lls
-                else:
-                    cs.sp.logger.error("Signal file does not contain readable timestep")
-                    return label
+def retrieve_replicas_last_timestep() -> Tuple[int, Path]:
+    """Every replica has its own restart folder. Replicas run in lockstep, so the segment is restarted from the newest step common to all of them"""
+    nrep = replicas()
+    basename = cs.sp.state[cs.sf.restart_files]
+    if RestartMode(cs.sp.state[cs.sf.restart_mode]) == RestartMode.multiple and cs.sp.args.step is None:
+        steps = [set(available_steps(replica_folder(k), basename)) for k in range(nrep)]
+        cs.sp.state[cs.sf.replica_steps] = [max(st) if len(st) > 0 else -1 for st in steps]
+        common = set.intersection(*steps)
+        if len(common) == 0: raise RuntimeError(f"Replicas have no common restart step, last steps: {cs.sp.state[cs.sf.replica_steps]}")
+        last_timestep = max(common)
+        cs.sp.logger.info("Cleaning replicas restarts folders")
+        for k in range(nrep): restart_cleanup(last_timestep, replica_folder(k))
+        restart_file = replica_folder(0) / restart_name(f".{last_timestep}")
+    else:
+        # one or two restart files keep no common step to go back to, all worlds have to read the same one
+        found = [last_timestep_in(replica_folder(k)) for k in range(nrep)]
+        cs.sp.state[cs.sf.replica_steps] = [step for step, _ in found]
+        if len({(step, file.name) for step, file in found}) != 1:
+            raise RuntimeError(f"Replicas diverged, last steps: {cs.sp.state[cs.sf.replica_steps]}, restart files: {[file.name for _, file in found]}")
+        last_timestep, restart_file = found[0]
+    cs.sp.logger.debug(f"Replicas last steps: {cs.sp.state[cs.sf.replica_steps]}")
+    return (last_timestep, cs.sp.cwd / replica_path() / restart_file.name)
+
+
+@logs
+def retrieve_last_timestep() -> Tuple[int, Path]:
+    if replicas() > 1: return retrieve_replicas_last_timestep()
+    return last_timestep_in(cs.sp.cwd / cs.folders.restarts)
+
+
+@logs
+def retrieve_current_label(last_timestep: int, campaign: Union[Campaign, None] = None) -> str:
+    if campaign is None: campaign = Campaign.from_state(cs.sp.state)
+    while (label := campaign.resolve(last_timestep)) is not None:
+        if label.end_step is not None: return label.name
+
+        cs.sp.logger.debug(f"End step of label '{label.name}' is undefined")
+        try:
+            lls = read_signal(cs.sp.cwd, label.name)
+        except ValueError as e:
+            cs.sp.logger.error(str(e))
+            return label.name
+        if lls is None:
+            cs.sp.logger.debug("Signal file for label does not exists, assuming label was not continued")
+            return label.name
+        cs.sp.logger.debug("Found signal file for label, assuming label was continued")
+        if lls < int(cs.sp.state[cs.sf.restart_every]):
+            cs.sp.logger.debug(f"Signal step is less than {cs.sp.state[cs.sf.restart_every]} and is {lls} — so small, continue with current label")
+            (cs.sp.cwd / cs.folders.signals / f"{label.name}.signal").unlink()
+            return label.name
+        campaign.close(label.name, lls)
+        campaign.to_state(cs.sp.state)
 
     raise RuntimeError("Inconsistent state or software bug.")
 
@@ -162,12 +211,11 @@ def set_last_timestep(last_timestep: int, current_label: str):
 
 
 @logs
-def restart() -> RC:
+def prepare() -> Union[Tuple[str, int, Path], None]:
+    """Decides where to continue from and generates input file. Returns None if end was reached"""
     cstate = states(cs.sp.state[cs.sf.state])
     if cstate != states.started and cstate != states.restarted and cstate != states.fully_initialized:
         raise RuntimeError("Folder isn't in appropriate state")
-    lockfile = cs.sp.cwd / f"{cs.sp.state[cs.sf.tag]}.lock"
-    if lockfile.exists(): raise Exception(f"Lockfile exists: {lockfile.as_posix()}")
 
     if cstate == states.fully_initialized:
         current_label = "START"
@@ -184,34 +232,129 @@ def restart() -> RC:
             rest_cnt = int(cs.sp.state[cs.sf.restart])
             cs.sp.state[cs.sf.restart] = rest_cnt + 1
 
-        current_label = retrieve_current_label(last_timestep)
+        campaign = Campaign.from_state(cs.sp.state)
+        current_label = retrieve_current_label(last_timestep, campaign)
         cs.sp.logger.info(f"Current label: '{current_label}'")
+        campaign.record_restart(last_timestep, current_label, time.time())
+        campaign.to_state(cs.sp.state)
 
         set_last_timestep(last_timestep, current_label)
 
-        sldk = [cs.sp.state[cs.sf.run_labels][lbl][cs.sf.end_step] for lbl in cs.sp.state[cs.sf.run_labels]]
-        if None not in sldk:
-            if last_timestep >= max(sldk) - int(cs.sp.state[cs.sf.restart_every]):
+        if (end_step := campaign.end_step) is not None:
+            if last_timestep >= end_step - int(cs.sp.state[cs.sf.restart_every]):
                 cs.sp.state[cs.sf.state] = states.comleted
                 cs.sp.logger.info("End was reached, exiting...")
-                return RC.END_REACHED
+                return None
 
     cs.sp.logger.info("Generating restart file")
     num = int(cs.sp.state[cs.sf.run_labels][current_label][cs.sf.runs])
     in_file = parsers.generator(num, current_label, restart_file)
+    if (hf := halt_file(current_label)).exists():
+        cs.sp.logger.info(f"Removing stale halt file: {hf.as_posix()}")
+        hf.unlink()
+
+    return (current_label, num, in_file)
+
+
+def register(current_label: str, num: int, in_file: Path, sb_jobid: int, **extra) -> Segment:
+    """Records submitted segment, keyed by its label, run number and the step it starts from"""
+    campaign = Campaign.from_state(cs.sp.state)
+    extra.setdefault(cs.sf.from_step, campaign.events[-1].step if len(campaign.events) > 0 else 0)
+    segment = campaign.label(current_label).append(Segment(num, sb_jobid, str(in_file.parts[-1]), current_label + str(num), cs.sp.state[cs.sf.run_counter], None, extra))
+    campaign.to_state(cs.sp.state)
+    return segment
+
+
+def decided(label: str, step: int, state: Dict[str, Any]) -> Union[Segment, None]:
+    """Submitted segment of the label starting from the step: the decision made again, e.g. by a repeated call
+
+    The job calling this is finishing, as in submitted().
+    """
+    segs = [seg for seg in Campaign.from_state(state).label(label).segments
+            if seg.jobid is not None and seg.extra.get(cs.sf.from_step) == step and cs.sf.exit_code not in seg.extra
+            and str(seg.jobid) != os.environ.get("SLURM_JOB_ID")]
+    return segs[-1] if len(segs) > 0 else None
+
+
+def restore(snapshot: Dict[str, Any]) -> None:
+    """Takes back what prepare() changed in the state"""
+    cs.sp.state.clear()
+    cs.sp.state.update(snapshot)
+
+
+def last_segment(state: Dict[str, Any]) -> Union[Segment, None]:
+    last: Union[Segment, None] = None
+    for label in Campaign.from_state(state).labels:
+        for seg in label.segments:
+            if seg.run_no is not None and (last is None or seg.run_no > (last.run_no or -1)): last = seg
+    return last
+
+
+def submitted(state: Dict[str, Any]) -> Union[Segment, None]:
+    """Last segment if its job is still queued or running, so deciding again would submit it twice
+
+    The job calling this itself (e.g. packed segments chaining the next allocation) is finishing.
+    Segment waiting in the submission queue counts as submitted while its intent exists.
+    """
+    last = last_segment(state)
+    if last is None or cs.sf.exit_code in last.extra: return None
+    if last.jobid is None: return last if cs.sf.queued in last.extra and intent_file(state[cs.sf.tag]).exists() else None
+    if str(last.jobid) == os.environ.get("SLURM_JOB_ID"): return None
+    return last if job_active(last.jobid) else None
+
+
+def queue_settings() -> bool:
+    """Queue mode and priority given on the command line are kept for the restarts that follow"""
+    args = cs.sp.args
+    if getattr(args, 'priority', None) is not None: cs.sp.state[cs.sf.priority] = args.priority
+    if getattr(args, 'queue', False): cs.sp.state[cs.sf.submit_queue] = True
+    if getattr(args, 'direct', False): cs.sp.state.pop(cs.sf.submit_queue, None)
+    return bool(cs.sp.state.get(cs.sf.submit_queue, False))
+
+
+@logs
+def restart() -> RC:
+    queue = queue_settings()
+    if (seg := submitted(cs.sp.state)) is not None:
+        if seg.jobid is None:
+            label = next(lb.name for lb in Campaign.from_state(cs.sp.state).labels if seg in lb.segments)
+            enqueue(seg, label, not cs.sp.args.no_auto)
+            cs.sp.logger.info(f"Segment {seg.dump_file} from step {seg.extra.get(cs.sf.from_step)} is already queued for submission, not submitting again")
+        else: cs.sp.logger.info(f"Segment {seg.dump_file} from step {seg.extra.get(cs.sf.from_step)} is already submitted as job {seg.jobid}, not submitting again")
+        return RC.OK
+    series.refresh()
+    snapshot = copy.deepcopy(cs.sp.state)
+    prepared = prepare()
+    if prepared is None: return RC.END_REACHED
+    current_label, num, in_file = prepared
+    events = Campaign.from_state(cs.sp.state).events
+    step = events[-1].step if len(events) > 0 else 0
+    # decision is keyed by label and checkpoint step, the same one already submitted is not submitted again
+    if (twin := decided(current_label, step, snapshot)) is not None:
+        try: active = job_active(twin.jobid, strict=True)  # type: ignore
+        except RuntimeError:
+            restore(snapshot)
+            raise
+        if active:
+            restore(snapshot)
+            cs.sp.logger.info(f"Segment {twin.dump_file} of label '{current_label}' from step {step} is already submitted as job {twin.jobid}, not submitting again")
+            return RC.OK
 
     if not cs.sp.args.test:
         cs.sp.logger.info("Submitting task")
         cs.sp.state[cs.sf.run_counter] += 1
-        sb_jobid = submit_run(in_file, cs.sp.state[cs.sf.run_counter])
-
-        cs.sp.state[cs.sf.run_labels][current_label][f"{num}"] = {
-            cs.sf.jobid: sb_jobid,
-            cs.sf.in_file: str(in_file.parts[-1]),
-            cs.sf.dump_file: current_label + str(num),
-            cs.sf.run_no: cs.sp.state[cs.sf.run_counter]
-        }
-        cs.sp.state[cs.sf.run_labels][current_label][cs.sf.runs] += 1
+        sb_jobid = None
+        if not queue:
+            try: sb_jobid = submit_run(in_file, cs.sp.state[cs.sf.run_counter], current_label)
+            except Exception as e:
+                if not rejected(e): raise
+                cs.sp.logger.warning(f"Submission was rejected, enqueueing it for the dispatcher: {e}")
+        if sb_jobid is None:
+            seg = register(current_label, num, in_file, None, **{cs.sf.queued: time.time()})
+            file = enqueue(seg, current_label, not cs.sp.args.no_auto)
+            cs.sp.logger.info(f"Segment {seg.dump_file} is queued for submission: {file.as_posix()}")
+            return RC.OK
+        register(current_label, num, in_file, sb_jobid)
 
         if not cs.sp.args.no_auto:
             cs.sp.logger.info("Staring polling")
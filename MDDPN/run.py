@@ -6,22 +6,31 @@
 # This software is released under the MIT License.
 # https://opensource.org/licenses/MIT
 
-# Last modified: 03-05-2024 18:55:16
+# Last modified: 19-10-2026 14:32:14
 
 import os
+import re
+import json
 import time
 import shutil
-from typing import Dict, Union, Callable, List
+import subprocess
+from typing import Dict, Any, Union, Callable, List, Tuple
 from pathlib import Path
 
 from MPMU import confdict
 import pysbatch_ng
 
+from . import monitor
+from . import insitu
 from . import constants as cs
-from .utils import logs
+from . import regexs as rs
+from .model import Campaign, Segment
+from .stage import make_scratch
+from .utils import logs, replicas, intent_file, atomic_write
 
 
 ignored_folders = [cs.folders.dumps, cs.folders.special_restarts, cs.folders.post_process]
+live_states = "PD,CF,R,S"  # squeue states of jobs that are still going to run LAMMPS
 
 
 def gen_ignore(cwd: Path) -> Callable[[str, List[str]], List[str]]:
@@ -33,6 +42,82 @@ def gen_ignore(cwd: Path) -> Callable[[str, List[str]], List[str]]:
     return ign
 
 
+def partition(sconf: Dict) -> str:
+    """LAMMPS multi-partition switch running all replicas in a single allocation"""
+    nrep = replicas()
+    if nrep < 2: return ""
+    ntasks = int(sconf[pysbatch_ng.cs.fields.nnodes]) * int(sconf[pysbatch_ng.cs.fields.ntpn])
+    if ntasks % nrep != 0: raise RuntimeError(f"Number of tasks {ntasks} is not divisible by number of replicas {nrep}")
+    return f"-partition {nrep}x{ntasks // nrep} "
+
+
+def main_command(infile: Path, label: str, logdir: str, launcher: Union[str, None] = None) -> Tuple[str, str]:
+    """Executable and its arguments for the main run, wrapped by monitor if it is enabled"""
+    lmp_args = partition(cs.sp.sconf_main) + f"-v test 1 -nonbuf -echo both -log '{logdir}/log.lammps' -in " + infile.as_posix()
+    if not monitor.enabled(): return cs.execs.lammps, lmp_args
+    # with partitions thermo output goes to per-world logs, monitor follows the first one
+    mlog = f"{logdir}/log.lammps" + (".0" if replicas() > 1 else "")
+    mlaunch = f"--launcher '{launcher}' " if launcher else ""
+    return cs.execs.MDDPN, f"--no_screen monitor --label {label} --log '{mlog}' {mlaunch}-- {cs.execs.lammps} " + lmp_args
+
+
+def job_active(jobid: int, strict: bool = False) -> bool:
+    """Job is pending or running. A completing job is done for the campaign, its poller may be restarting it
+
+    Strict check raises if squeue can not tell, instead of assuming the job is not active.
+    """
+    try:
+        res = subprocess.run(["squeue", "-h", "-o", "%i", "-t", live_states, "-j", str(jobid)], capture_output=True, text=True)
+    except FileNotFoundError:
+        if strict: raise RuntimeError(f"squeue is not available, can not tell if job {jobid} is active")
+        cs.sp.logger.warning("squeue is not available, assuming job is not active")
+        return False
+    if res.returncode != 0 and strict and re.search(rs.squeue_unknown_job, res.stderr) is None:
+        raise RuntimeError(f"squeue failed, can not tell if job {jobid} is active: {res.stderr.strip()}")
+    return res.returncode == 0 and len(res.stdout.strip()) > 0
+
+
+def rejected(e: Exception) -> bool:
+    """sbatch refused the job for now (QOS limits, busy controller), submitting it later may succeed"""
+    return re.search(rs.sbatch_rejected, str(e)) is not None
+
+
+def enqueue(segment: Segment, label: str, polling: bool) -> Path:
+    """Writes submission intent of the segment for the dispatcher, backoff and job of an earlier intent of the same segment are kept"""
+    file = intent_file(cs.sp.state[cs.sf.tag])
+    campaign = Campaign.from_state(cs.sp.state)
+    step = campaign.events[-1].step if len(campaign.events) > 0 else 0
+    intent: Dict[str, Any] = {'attempts': 0, 'next_try': 0., 'error': None, 'jobid': None}
+    if file.exists():
+        with file.open('r') as fp: old = json.load(fp)
+        if old.get('label') == label and old.get('num') == segment.num: intent.update({k: old[k] for k in intent if k in old})
+    intent.update({
+        'folder': cs.sp.cwd.as_posix(),
+        'tag': cs.sp.state[cs.sf.tag],
+        'label': label,
+        'num': segment.num,
+        'priority': cs.sp.state.get(cs.sf.priority, 0),
+        'progress': step / campaign.end_step if campaign.end_step else None,
+        'partition': cs.sp.sconf_main.get(pysbatch_ng.cs.fields.partition),
+        'polling': polling,
+        'enqueued': segment.extra.get(cs.sf.queued, time.time()),
+    })
+    with atomic_write(file) as fp:
+        json.dump(intent, fp, indent=4)
+    return file
+
+
+def test_vars(new_cwd: Path) -> str:
+    """Variables monitor passes to the main run, the test run is launched without monitor"""
+    res = ""
+    if monitor.scratch_prefix():
+        res += f"-var {cs.params.scratch_var} {make_scratch(new_cwd / cs.folders.scratch, replicas()).as_posix()} "
+    if len(insitu.settings().get(cs.cf.dumps, [])) > 0:
+        # no analyzers to read FIFOs, streamed dumps are written to plain files
+        res += f"-var {cs.params.fifo_var} {(new_cwd / cs.folders.dumps).as_posix()} "
+    return res
+
+
 @logs
 def test_run(in_file: Path) -> bool:
     new_cwd = cs.sp.cwd / ".." / (cs.folders.tmp_dir_basename + f"{round(time.time())}")
@@ -44,7 +129,7 @@ def test_run(in_file: Path) -> bool:
         (new_cwd / el).mkdir(exist_ok=True)
 
     cs.sp.sconf_test[pysbatch_ng.cs.fields.executable] = cs.execs.lammps
-    cs.sp.sconf_test[pysbatch_ng.cs.fields.args] = ("-v test 0 -echo both -log '{jd}/log.lammps' -in " + new_in_file.as_posix())
+    cs.sp.sconf_test[pysbatch_ng.cs.fields.args] = (partition(cs.sp.sconf_test) + test_vars(new_cwd) + "-v test 0 -echo both -log '{jd}/log.lammps' -in " + new_in_file.as_posix())
     os.chdir(new_cwd)
     cs.sp.logger.info("Submitting test run and waiting it to complete")
     jobid = pysbatch_ng.sbatch.run(new_cwd, cs.sp.logger.getChild("submitter"), confdict(cs.sp.sconf_test))
@@ -89,7 +174,7 @@ def run_polling(jobid: int, tag: int, cmd: Union[str, None] = None) -> None:
 
 
 @logs
-def submit_run(infile: Path, number: int) -> int:
+def submit_run(infile: Path, number: int, label: str) -> int:
     """_summary_
 
     Args:
@@ -97,6 +182,7 @@ def submit_run(infile: Path, number: int) -> int:
         infile (Path): _description_
         logger (logging.Logger): _description_
         number (int): Number of task. At this stage there is no jobid yet, so it used instead. Defaults to None.
+        label (str): Label the run belongs to. Used by monitor to write signal file.
 
     Raises:
         RuntimeError: Thrown if test run was unsuccesful
@@ -106,9 +192,21 @@ def submit_run(infile: Path, number: int) -> int:
     """
     if cs.sp.run_tests:
         if not test_run(infile): raise RuntimeError("Test run was unsuccessfull")
-    cs.sp.sconf_main[pysbatch_ng.cs.fields.executable] = cs.execs.lammps
-    cs.sp.sconf_main[pysbatch_ng.cs.fields.args] = "-v test 1 -nonbuf -echo both -log '{jd}/log.lammps' -in " + infile.as_posix()
-    return pysbatch_ng.sbatch.run(cs.sp.cwd, cs.sp.logger.getChild("submitter"), confdict(cs.sp.sconf_main), number)
+    executable, args = main_command(infile, label, "{jd}")
+    if (sig := monitor.sbatch_signal()) is None:
+        cs.sp.sconf_main[pysbatch_ng.cs.fields.executable] = executable
+        cs.sp.sconf_main[pysbatch_ng.cs.fields.args] = args
+        return pysbatch_ng.sbatch.run(cs.sp.cwd, cs.sp.logger.getChild("submitter"), confdict(cs.sp.sconf_main), number)
+    # the signal goes to the batch shell only, the shell is replaced by the monitor so the monitor gets it
+    cs.sp.sconf_main[pysbatch_ng.cs.fields.executable] = "exec"
+    cs.sp.sconf_main[pysbatch_ng.cs.fields.args] = f"{executable} {args}"
+    old = os.environ.get("SBATCH_SIGNAL")
+    os.environ["SBATCH_SIGNAL"] = sig  # same as --signal on the sbatch command line
+    try:
+        return pysbatch_ng.sbatch.run(cs.sp.cwd, cs.sp.logger.getChild("submitter"), confdict(cs.sp.sconf_main), number)
+    finally:
+        if old is None: del os.environ["SBATCH_SIGNAL"]
+        else: os.environ["SBATCH_SIGNAL"] = old
 
 
 # def run(cwd: Path, state: Dict, args: argparse.Namespace, logger: logging.Logger) -> Dict:
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:32:14
+
+import re
+import json
+from pathlib import Path
+from typing import Dict, Any, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # type: ignore
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None  # type: ignore
+
+from . import constants as cs
+from .model import Campaign
+from .thermo import ThermoReader
+from .archive import files, open_text
+from .utils import logs, atomic_write
+
+
+Rows = Dict[int, Dict[str, float]]  # step -> thermo values
+
+
+def segment_logs(folder: Path, campaign: Campaign) -> List[Tuple[str, str, Path, float]]:
+    """Label, segment name, LAMMPS log and its mtime of every segment, in the order they were run
+
+    Logs are found as compact finds them: in slurm/ entries named after the segment or containing
+    its job id. With replicas the log of the first one is used.
+    """
+    logfiles: Dict[str, List[Tuple[Path, float]]] = {}
+    for log, mtime in files(folder, cs.folders.slurm, "log.lammps*"):
+        if log.name not in ("log.lammps", "log.lammps.0"): continue
+        top = log.relative_to(folder / cs.folders.slurm).parts[0]
+        logfiles.setdefault(top, []).append((log, mtime))
+    segments = sorted(((label.name, seg) for label in campaign.labels for seg in label.segments if seg.run_no is not None), key=lambda p: p[1].run_no)  # type: ignore
+    res: List[Tuple[str, str, Path, float]] = []
+    for name, seg in segments:
+        tokens = {f"{name}{seg.num}"} | ({str(seg.jobid)} if seg.jobid is not None else set())
+        found = [f for top, fs in logfiles.items() if top in tokens or set(re.findall(r"\d+", top)) & tokens for f in fs]
+        if len(found) > 0:
+            log, mtime = max(found, key=lambda f: f[1])
+            res.append((name, f"{name}{seg.num}", log, mtime))
+    return res
+
+
+def read_rows(log: Path) -> Tuple[Rows, List[str]]:
+    """Thermo rows of one log by step, later rows of the same step win (end of one run and start of the next)"""
+    rows: Rows = {}
+    columns: List[str] = []
+    with open_text(log) as fp:
+        for row in ThermoReader(log).feed(fp):
+            if "Step" not in row: continue
+            for column in row:
+                if column not in columns: columns.append(column)
+            rows[int(row["Step"])] = row
+    return rows, columns
+
+
+def store_file(folder: Path, label: str, fmt: str) -> Path:
+    return folder / cs.folders.thermo / f"{label}.{fmt}"
+
+
+def load(folder: Path, label: str) -> Dict[str, Any]:
+    """Columns of the label as numpy arrays, Step first"""
+    if np is None: raise RuntimeError("numpy is required to read thermo series, install MDDPN[series]")
+    pfile = store_file(folder, label, "parquet")
+    if pfile.exists() and pa is not None:
+        table = pq.read_table(pfile)
+        return {name: table.column(name).to_numpy() for name in table.column_names}
+    with np.load(store_file(folder, label, "npz")) as data:
+        return {str(name): data[str(name)] for name in data["columns"]}
+
+
+def save(folder: Path, label: str, rows: Rows, columns: List[str], fmt: str) -> None:
+    steps = sorted(rows)
+    columns = ["Step"] + [c for c in columns if c != "Step"]
+    arrays = {"Step": np.array(steps, dtype=np.int64)}
+    for column in columns[1:]:
+        arrays[column] = np.array([rows[s].get(column, np.nan) for s in steps], dtype=np.float64)
+    with atomic_write(store_file(folder, label, fmt), 'wb') as fp:
+        if fmt == "parquet": pq.write_table(pa.table({c: arrays[c] for c in columns}), fp)
+        else: np.savez(fp, columns=np.array(columns), **arrays)
+
+
+def update(folder: Path, campaign: Campaign, fmt: str, rebuild: bool) -> Dict[str, int]:
+    """Parses logs of new or grown segments and rewrites series of the labels they touched
+
+    A segment restarted from step S replaces everything from S on: the segments after a lost
+    one recomputed that part of the trajectory. Rows belong to the label their step falls into.
+    """
+    ifile = folder / cs.folders.thermo / cs.files.thermo_index
+    done: Dict[str, Any] = {}
+    if ifile.exists() and not rebuild:
+        with ifile.open('r') as fp: done = json.load(fp)
+    if done.get("format", fmt) != fmt: done = {}
+    seen: Dict[str, List[Any]] = done.get("segments", {})
+
+    segments = segment_logs(folder, campaign)
+    first = next((i for i, (_, seg, log, mtime) in enumerate(segments) if seen.get(seg) != [log.relative_to(folder).as_posix(), mtime]), None)
+    if first is None: return {}
+
+    touched: Dict[str, Tuple[Rows, List[str]]] = {}
+
+    def label_rows(label: str) -> Tuple[Rows, List[str]]:
+        if label not in touched:
+            touched[label] = ({}, [])
+            if len(seen) > 0 and store_file(folder, label, fmt).exists():
+                data = load(folder, label)
+                columns = list(data)
+                steps = data["Step"]
+                touched[label] = ({int(s): {c: float(data[c][i]) for c in columns} for i, s in enumerate(steps)}, columns)
+        return touched[label]
+
+    for label, seg, log, mtime in segments[first:]:
+        rows, columns = read_rows(log)
+        seen[seg] = [log.relative_to(folder).as_posix(), mtime]
+        if len(rows) == 0: continue
+        start = min(rows)
+        for name in [lb.name for lb in campaign.labels if lb.end_step is None or lb.end_step > start]:
+            if store_file(folder, name, fmt).exists() or name in touched:
+                stored, _ = label_rows(name)
+                for step in [s for s in stored if s >= start]: del stored[step]
+        for step, row in rows.items():
+            owner = campaign.resolve(step)
+            stored, known = label_rows(owner.name if owner is not None else label)
+            stored[step] = row
+            for column in columns:
+                if column not in known: known.append(column)
+
+    (folder / cs.folders.thermo).mkdir(exist_ok=True)
+    for name, (rows, columns) in touched.items(): save(folder, name, rows, columns, fmt)
+    with atomic_write(ifile) as fp:
+        json.dump({"format": fmt, "segments": seen}, fp, indent=4)
+    return {name: len(rows) for name, (rows, _) in touched.items()}
+
+
+def refresh() -> None:
+    """Keeps existing series up to date as segments complete, called by restart"""
+    ifile = cs.sp.cwd / cs.folders.thermo / cs.files.thermo_index
+    if np is None or not ifile.exists(): return
+    try:
+        with ifile.open('r') as fp: fmt = json.load(fp).get("format", "npz")
+        update(cs.sp.cwd, Campaign.from_state(cs.sp.state), fmt, False)
+    except Exception as e:
+        cs.sp.logger.warning(f"Failed to update thermo series: {e}")
+
+
+@logs
+def thermo_series() -> int:
+    if np is None: raise RuntimeError("numpy is required to write thermo series, install MDDPN[series]")
+    fmt = cs.sp.args.format or ("parquet" if pa is not None else "npz")
+    if fmt == "parquet" and pa is None: raise RuntimeError("pyarrow is required to write parquet, install MDDPN[parquet]")
+    campaign = Campaign.from_state(cs.sp.state)
+    for name, n in update(cs.sp.cwd, campaign, fmt, cs.sp.args.rebuild).items():
+        cs.sp.logger.info(f"Label '{name}': {n} steps written to {store_file(cs.sp.cwd, name, fmt).as_posix()}")
+    return 0
+
+
+if __name__ == "__main__":
+    pass
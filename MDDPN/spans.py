@@ -0,0 +1,171 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:32:14
+
+import os
+import time
+import pstats
+import cProfile
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Union, Generator
+
+from . import utils
+from . import constants as cs
+
+
+class Span:
+    """Calls of one function from the same call path, merged"""
+    __slots__ = ('name', 'calls', 'wall', 'cpu', 'children')
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.calls = 0
+        self.wall = 0.
+        self.cpu = 0.
+        self.children: Dict[str, "Span"] = {}
+
+    def child(self, name: str) -> "Span":
+        if name not in self.children: self.children[name] = Span(name)
+        return self.children[name]
+
+    @property
+    def self_wall(self) -> float:
+        return max(self.wall - sum(c.wall for c in self.children.values()), 0.)
+
+
+class Profiler:
+    """Span tree of functions decorated with @logs, wall and CPU time of every call path
+
+    Spans opened in other threads start from the root. CPU time is thread time, so the time
+    a call waits for a job, a lock or the file system shows up as wall time only.
+    """
+    def __init__(self, name: str, with_cprofile: bool) -> None:
+        self.root = Span(name)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.started = (time.perf_counter(), time.thread_time())
+        self.cprofile = cProfile.Profile() if with_cprofile else None
+        if self.cprofile is not None: self.cprofile.enable()
+
+    def stack(self) -> List[Span]:
+        if not hasattr(self.local, 'stack'): self.local.stack = [self.root]
+        return self.local.stack
+
+    @contextmanager
+    def span(self, name: str) -> Generator[None, None, None]:
+        stack = self.stack()
+        with self.lock: node = stack[-1].child(name)
+        stack.append(node)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try: yield
+        finally:
+            stack.pop()
+            with self.lock:
+                node.calls += 1
+                node.wall += time.perf_counter() - wall
+                node.cpu += time.thread_time() - cpu
+
+    def stop(self) -> None:
+        if self.cprofile is not None: self.cprofile.disable()
+        self.root.calls = 1
+        self.root.wall = time.perf_counter() - self.started[0]
+        self.root.cpu = time.thread_time() - self.started[1]
+
+    def folded(self) -> List[str]:
+        """Collapsed stacks with self time in microseconds, input of flamegraph.pl and speedscope"""
+        lines: List[str] = []
+
+        def walk(node: Span, path: str) -> None:
+            path = f"{path};{node.name}" if path else node.name
+            if (us := round(node.self_wall * 1e6)) > 0: lines.append(f"{path} {us}")
+            for child in node.children.values(): walk(child, path)
+
+        walk(self.root, "")
+        return lines
+
+    def table(self) -> str:
+        """Call tree and per function totals, nested calls of the same function are counted once"""
+        rows = [["span", "calls", "wall s", "self s", "cpu s", "% wall"]]
+        total = self.root.wall or 1.
+
+        def walk(node: Span, depth: int) -> None:
+            rows.append(["  " * depth + node.name, str(node.calls), f"{node.wall:.3f}", f"{node.self_wall:.3f}", f"{node.cpu:.3f}", f"{node.wall / total * 100:.1f}"])
+            for child in sorted(node.children.values(), key=lambda c: -c.wall): walk(child, depth + 1)
+
+        walk(self.root, 0)
+        totals: Dict[str, Tuple[int, float, float]] = {}
+
+        def collect(node: Span, active: Tuple[str, ...]) -> None:
+            calls, wall, own = totals.get(node.name, (0, 0., 0.))
+            totals[node.name] = (calls + node.calls, wall + (node.wall if node.name not in active else 0.), own + node.self_wall)
+            for child in node.children.values(): collect(child, active + (node.name,))
+
+        for child in self.root.children.values(): collect(child, ())
+        lines = [utils.render_table(rows)]
+        rows = [["function", "calls", "wall s", "self s"]]
+        for name, (calls, wall, own) in sorted(totals.items(), key=lambda t: -t[1][1]):
+            rows.append([name, str(calls), f"{wall:.3f}", f"{own:.3f}"])
+        lines += ["", utils.render_table(rows)]
+        return "\n".join(lines) + "\n"
+
+    def write(self, base: Path) -> None:
+        with (base.parent / (base.name + ".folded")).open('w') as fp:
+            fp.write("\n".join(self.folded()) + "\n")
+        with (base.parent / (base.name + ".txt")).open('w') as fp:
+            fp.write(self.table())
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(base.parent / (base.name + ".pstats"))
+            with (base.parent / (base.name + ".cprofile.txt")).open('w') as fp:
+                pstats.Stats(self.cprofile, stream=fp).sort_stats("cumulative").print_stats(60)
+
+
+profiler: Union[Profiler, None] = None
+
+
+def mode() -> Union[str, None]:
+    """None, 'spans' or 'cprofile', from --profile/--cprofile or the environment variable"""
+    env = os.environ.get(cs.params.profile_env, "").strip().lower()
+    if getattr(cs.sp.args, 'cprofile', False) or env == "cprofile": return "cprofile"
+    if getattr(cs.sp.args, 'profile', False) or env not in ("", "0", "no", "false"): return "spans"
+    return None
+
+
+def start(name: str) -> None:
+    global profiler
+    if (m := mode()) is None: return
+    profiler = Profiler(name, m == "cprofile")
+
+
+@contextmanager
+def span(name: str) -> Generator[None, None, None]:
+    if profiler is None:
+        yield
+        return
+    with profiler.span(name): yield
+
+
+def finish() -> None:
+    """Writes the tree next to the pass log of this invocation"""
+    global profiler
+    if profiler is None: return
+    prof, profiler = profiler, None
+    prof.stop()
+    if cs.sp.pass_log is not None: base = cs.sp.pass_log.parent / (cs.sp.pass_log.name[:-len(cs.files.pass_log_suffix)] + ".profile")
+    else: base = cs.sp.cwd / cs.folders.log / f"profile.{os.getpid()}"
+    try:
+        base.parent.mkdir(parents=True, exist_ok=True)
+        prof.write(base)
+    except OSError as e:
+        cs.sp.logger.warning(f"Failed to write profile: {e}")
+
+
+if __name__ == "__main__":
+    pass
@@ -6,7 +6,7 @@
 # This software is released under the MIT License.
 # https://opensource.org/licenses/MIT
 
-# Last modified: 03-05-2024 03:34:04
+# Last modified: 19-10-2026 14:12:28
 
 import sys
 import logging
@@ -14,10 +14,23 @@ import argparse
 from pathlib import Path
 
 from .init import init
+from .fork import fork
 from .ender import ender
+from .status import status
+from .metrics import metrics
+from .accounting import accounting
+from .watchdog import watchdog
+from .dispatch import dispatch
+from .archive import compact
+from .series import thermo_series
+from .history import checkpoints, extract_checkpoint
+from .pack import pack, packrun
+from .plan import plan
+from .tune import tune
+from .monitor import monitor
 from .restart import restart
-from . import config, constants as cs
-from .utils import load_state, setup_logger, logs, RC
+from . import config, spans, constants as cs
+from .utils import load_state, read_state, setup_logger, logs, RC
 
 
 @logs
@@ -30,6 +43,18 @@ def endd():
 
 
 def choose() -> int:
+    if cs.sp.args.command == "status":
+        cs.sp.logger = setup_logger("MDDPN", logging.WARNING, to_file=False)
+        return status()
+    if cs.sp.args.command == "watchdog":
+        cs.sp.logger = setup_logger("MDDPN", logging.INFO, to_file=False)
+        return watchdog()
+    if cs.sp.args.command == "dispatch":
+        cs.sp.logger = setup_logger("MDDPN", logging.INFO, to_file=False)
+        return dispatch()
+    if cs.sp.args.command == "metrics":
+        cs.sp.logger = setup_logger("MDDPN", logging.INFO if cs.sp.args.every > 0 else logging.WARNING, to_file=False)
+        return metrics()
     cs.sp.logger = setup_logger("MDDPN", logging.DEBUG)  # if args.debug else logging.INFO)
     cs.sp.logger.info(f"Root folder: {cs.sp.cwd.as_posix()}")
     cs.sp.logger.info(f"Envolved args: {cs.sp.args}")
@@ -43,11 +68,35 @@ def choose() -> int:
             else: return 1
         elif cs.sp.args.command == "init":
             cs.sp.logger.info("'init' command received")
-            if config.configure(config.loadconf()): return init()
+            if config.cached_configure(): return init()
             else: return 1
+        elif cs.sp.args.command == "plan":
+            cs.sp.logger.info("'plan' command received")
+            if config.cached_configure(): return plan()
+            else: return 1
+        elif cs.sp.args.command == "fork":
+            cs.sp.logger.info("'fork' command received")
+            conffile = None
+            if not cs.sp.args.conf and not config.conffile_lookup().exists():
+                conffile = Path(read_state(Path(cs.sp.args.parent).resolve())[cs.sf.conffile_path]).resolve()
+                cs.sp.logger.info(f"Using parent's conffile: {conffile.as_posix()}")
+            if config.cached_configure(conffile): return fork()
+            else: return 1
+        elif cs.sp.args.command == "monitor":
+            cs.sp.logger.info("'monitor' command received")
+            cs.sp.state = state = read_state(cs.sp.cwd)
+            if not config.cached_configure(Path(state[cs.sf.conffile_path]).resolve(), state[cs.sf.conffile_format]):
+                return 1
+            return monitor()
+        elif cs.sp.args.command == "pack":
+            cs.sp.logger.info("'pack' command received")
+            return pack()
+        elif cs.sp.args.command == "packrun":
+            cs.sp.logger.info("'packrun' command received")
+            return packrun()
         else:
             with load_state() as _:
-                if not config.configure(config.loadconf(Path(cs.sp.state[cs.sf.conffile_path]).resolve(), cs.sp.state[cs.sf.conffile_format])):
+                if not config.cached_configure(Path(cs.sp.state[cs.sf.conffile_path]).resolve(), cs.sp.state[cs.sf.conffile_format]):
                     return 1
 
                 if cs.sp.args.command == "run" or cs.sp.args.command == "restart":
@@ -57,6 +106,24 @@ def choose() -> int:
                         cs.sp.logger.info("End was reached, trying to start post processing")
                         return endd()
                     else: return int(lrc)
+                elif cs.sp.args.command == "tune":
+                    cs.sp.logger.info("'tune' command received")
+                    return tune()
+                elif cs.sp.args.command == "accounting":
+                    cs.sp.logger.info("'accounting' command received")
+                    return accounting()
+                elif cs.sp.args.command == "thermo":
+                    cs.sp.logger.info("'thermo' command received")
+                    return thermo_series()
+                elif cs.sp.args.command == "checkpoints":
+                    cs.sp.logger.info("'checkpoints' command received")
+                    return checkpoints()
+                elif cs.sp.args.command == "extract":
+                    cs.sp.logger.info("'extract' command received")
+                    return extract_checkpoint()
+                elif cs.sp.args.command == "compact":
+                    cs.sp.logger.info("'compact' command received")
+                    return compact()
                 elif cs.sp.args.command == "end":
                     cs.sp.logger.info("'end' command received")
                     return endd()
@@ -75,6 +142,9 @@ def main() -> int:
     parser.add_argument("-c", "--conf", action="store", type=str, help=f"Specify conffile. Defaults to './{cs.files.config_json}'")
     parser.add_argument("--toml", action="store_true", help="Change conffile format to toml")
     parser.add_argument("--no_screen", action="store_true", help="Do not print log to console")
+    parser.add_argument("--no_conf_cache", action="store_true", help="Revalidate configuration even if its fingerprint has not changed")
+    parser.add_argument("--profile", action="store_true", help=f"Write call tree with wall and CPU times next to the pass log, also enabled by {cs.params.profile_env}=1")
+    parser.add_argument("--cprofile", action="store_true", help=f"Profile with cProfile too, also enabled by {cs.params.profile_env}=cprofile")
 
     sub_parsers = parser.add_subparsers(help="sub-command help", dest="command")
 
@@ -82,30 +152,143 @@ def main() -> int:
     parser_init.add_argument("-p", "--params", action="store", type=str, help="Obtain simulation parameters from command-line")
     parser_init.add_argument("-rm", "--restart_mode", choices=["one", "two", "multiple"], help="Specify two-filed restarts instead of restart.*",)
     parser_init.add_argument("-fn", "--fname", action="store", type=str, help="Specify file to get parameters from")
-    parser_init.add_argument("--pfc", "--params_from_conf", action="store_true", help="Get params from configuration file")
+    parser_init.add_argument("--pfc", "--params_from_conf", action="store_true", dest="params_from_conf", help="Get params from configuration file")
+    parser_init.add_argument("-r", "--replicas", action="store", type=int, default=1, help="Number of independent replicas run together in one allocation using LAMMPS partitions")
+
+    parser_plan = sub_parsers.add_parser("plan", help="Offline replay of the restart cycle: predicted segments, submissions, node-hours, storage and lost work")
+    parser_plan.add_argument("-p", "--params", action="store", type=str, help="Obtain simulation parameters from command-line")
+    parser_plan.add_argument("-fn", "--fname", action="store", type=str, help="Specify file to get parameters from")
+    parser_plan.add_argument("--pfc", "--params_from_conf", action="store_true", dest="params_from_conf", help="Get params from configuration file")
+    parser_plan.add_argument("-rm", "--restart_mode", choices=["one", "two", "multiple"], help="Restart mode, as for init")
+    parser_plan.add_argument("--tps", action="store", type=float, default=None, help="Throughput, timesteps per second")
+    parser_plan.add_argument("--log", action="store", type=str, default=None, help="LAMMPS log to take measured throughput from")
+    parser_plan.add_argument("-t", "--walltime", action="store", type=str, required=True, help="Job walltime, slurm format")
+    parser_plan.add_argument("--startup", action="store", type=float, default=60, help="Seconds spent by a job before the first step")
+    parser_plan.add_argument("--queue_wait", action="store", type=float, default=0, help="Assumed queue wait per segment, seconds")
+    parser_plan.add_argument("--open", action="append", metavar="LABEL=STEPS", help="Assumed length of open-ended label, may be repeated")
+    parser_plan.add_argument("--frame_mb", action="store", type=float, default=None, help="Size of one dump frame, MB")
+    parser_plan.add_argument("--restart_mb", action="store", type=float, default=None, help="Size of one restart file, MB")
+    parser_plan.add_argument("--no_auto", action="store_true", help="Plan without polling jobs")
+    parser_plan.add_argument("--max_segments", action="store", type=int, default=100000, help="Give up after this number of segments")
+    parser_plan.add_argument("--json", action="store_true", help="Print prediction as json")
+    parser_plan.set_defaults(replicas=1, step=None)
+
+    parser_fork = sub_parsers.add_parser("fork", help="Initialize directory as a branch of existing campaign at given step, reusing its restart file")
+    parser_fork.add_argument("--from", action="store", type=str, required=True, dest="parent", help="Parent campaign directory")
+    parser_fork.add_argument("-s", "--step", action="store", type=int, default=None, help="Step to branch at. Defaults to the newest restart of the parent")
+    parser_fork.add_argument("-p", "--params", action="store", type=str, default=None, help="Variables overriding parent's ones, as json")
+    parser_fork.add_argument("--no_start", action="store_true", help="Only initialize, do not submit the first segment")
+    parser_fork.add_argument("--test", action="store_true", help="Whether actually run LAMMPS or not. Test purposes only")
+    parser_fork.add_argument("--no_auto", action="store_true", help="Don't run polling sbatch and don't auto restart")
+    parser_fork.add_argument("--queue", action="store_true", help="Enqueue segments for 'MDDPN dispatch' instead of submitting them, kept for following restarts")
+    parser_fork.add_argument("--direct", action="store_true", help="Submit segments directly again, rejected submissions are still enqueued")
+    parser_fork.add_argument("--priority", action="store", type=int, default=None, help="Priority of the campaign in the submission queue, kept for following restarts")
 
     parser_run = sub_parsers.add_parser("run", help="Run LAMMPS simulation")
     parser_run.add_argument("--test", action="store_true", help="Whether actually run LAMMPS or not. Test purposes only")
     parser_run.add_argument("--no_auto", action="store_true", help="Don't run polling sbatch and don't auto restart")
+    parser_run.add_argument("--queue", action="store_true", help="Enqueue segments for 'MDDPN dispatch' instead of submitting them, kept for following restarts")
+    parser_run.add_argument("--direct", action="store_true", help="Submit segments directly again, rejected submissions are still enqueued")
+    parser_run.add_argument("--priority", action="store", type=int, default=None, help="Priority of the campaign in the submission queue, kept for following restarts")
 
     parser_restart = sub_parsers.add_parser("restart", help="Generate restart file and run it")
     parser_restart.add_argument("--test", action="store_true", help="Whether actually run LAMMPS or not. Test purposes only")
     parser_restart.add_argument("-s", "--step", action="store", type=int, help="From which step do the restart")
     parser_restart.add_argument("--no_auto", action="store_true", help="Don't run polling sbatch and don't auto restart")
+    parser_restart.add_argument("--queue", action="store_true", help="Enqueue segments for 'MDDPN dispatch' instead of submitting them, kept for following restarts")
+    parser_restart.add_argument("--direct", action="store_true", help="Submit segments directly again, rejected submissions are still enqueued")
+    parser_restart.add_argument("--priority", action="store", type=int, default=None, help="Priority of the campaign in the submission queue, kept for following restarts")
 
     parser_end = sub_parsers.add_parser("end", help="Post-processing")
     parser_end.add_argument("--ongoing", action="store_true", help="Do post processing while simulation is in progress")
     parser_end.add_argument("--anyway", action="store_true", help="Proceed anyway despite of errors in state file")
     parser_end.add_argument("--params", action="store", type=str, default=None, help="Post-processing parameters")
 
+    parser_tune = sub_parsers.add_parser("tune", help="Measure throughput of short timed segments at several shapes and pick nodes and tasks for main runs")
+    parser_tune.add_argument("--shapes", action="store", type=str, default=None, help="Comma separated NNODESxNTPN list, defaults to shapes around current one")
+    parser_tune.add_argument("--seconds", action="store", type=int, default=120, help="Duration of every timed segment")
+    parser_tune.add_argument("--objective", choices=["efficiency", "time"], default="efficiency", help="Best throughput per node-hour or best time-to-solution")
+    parser_tune.add_argument("--label", action="store", type=str, default=None, help="Label to measure, defaults to the label of the last segment")
+    parser_tune.add_argument("--write", action="store_true", help="Write the best shape to the main sbatch profile of the conffile")
+    parser_tune.add_argument("--no_cache", action="store_true", help="Do not reuse measurements for the same system size")
+
+    parser_accounting = sub_parsers.add_parser("accounting", help="Store slurm accounting of all segments and report efficiency of the campaign")
+    parser_accounting.add_argument("--sacct", action="store", type=str, default=None, help="Read recorded 'sacct -P -n' output instead of calling sacct")
+    parser_accounting.add_argument("--json", action="store_true", help="Print efficiency metrics as json")
+
+    parser_thermo = sub_parsers.add_parser("thermo", help="Stitch thermo output of all segments into one columnar file per label, kept up to date by restarts")
+    parser_thermo.add_argument("--format", choices=["npz", "parquet"], default=None, help="Defaults to parquet if pyarrow is installed")
+    parser_thermo.add_argument("--rebuild", action="store_true", help="Parse all logs again")
+
+    sub_parsers.add_parser("checkpoints", help="List restarts kept in the history")
+
+    parser_extract = sub_parsers.add_parser("extract", help="Restore restart files of a step kept in the history")
+    parser_extract.add_argument("-s", "--step", action="store", type=int, required=True, help="Step of the checkpoint")
+    parser_extract.add_argument("--to", action="store", type=str, default=None, help=f"Destination folder. Defaults to '{cs.folders.restarts}', so 'restart --step' can continue from it")
+
+    parser_compact = sub_parsers.add_parser("compact", help="Pack inputs, slurm logs, pass logs and data files of completed labels into one zip per label")
+    parser_compact.add_argument("--list", action="store_true", help="List archived files")
+    parser_compact.add_argument("--cat", action="store", type=str, default=None, help="Print a file by its path relative to the campaign folder, archived or not")
+
     parser_gen_conf = sub_parsers.add_parser("genconf", help="Generate config file (all possible options with default values)")
     parser_check_conf = sub_parsers.add_parser("checkconf", help="Check config file")
 
+    parser_monitor = sub_parsers.add_parser("monitor", help="Run LAMMPS and stop open-ended label when stopping condition is met. Used inside a job")
+    parser_monitor.add_argument("--label", action="store", type=str, required=True, help="Label of the running segment")
+    parser_monitor.add_argument("--log", action="store", type=str, required=True, help="LAMMPS log file to follow")
+    parser_monitor.add_argument("--launcher", action="store", type=str, default=None, help="Override launcher from configuration (e.g. for packed job steps)")
+    parser_monitor.add_argument("cmd", nargs=argparse.REMAINDER, help="LAMMPS command line, after '--'")
+
+    parser_status = sub_parsers.add_parser("status", help="Read-only progress summary of all initialized directories under given roots")
+    parser_status.add_argument("roots", nargs="*", help="Directories to scan. Defaults to current directory")
+    parser_status.add_argument("-d", "--depth", action="store", type=int, default=8, help="Maximum depth of directory tree scanning")
+    parser_status.add_argument("-w", "--workers", action="store", type=int, default=16, help="Number of scanning threads")
+    parser_status.add_argument("--json", action="store_true", help="Print summaries as json")
+    parser_status.add_argument("--no_cache", action="store_true", help="Do not use cached summaries")
+
+    parser_metrics = sub_parsers.add_parser("metrics", help="Write campaign metrics as .prom files for node-exporter textfile collector")
+    parser_metrics.add_argument("roots", nargs="*", help="Directories to scan. Defaults to current directory")
+    parser_metrics.add_argument("-o", "--output", action="store", type=str, required=True, help="Textfile collector directory, one file per campaign is written")
+    parser_metrics.add_argument("--every", action="store", type=float, default=0, help="Export every given number of seconds instead of once")
+    parser_metrics.add_argument("-d", "--depth", action="store", type=int, default=8, help="Maximum depth of directory tree scanning")
+    parser_metrics.add_argument("-w", "--workers", action="store", type=int, default=16, help="Number of scanning threads")
+    parser_metrics.add_argument("--no_cache", action="store_true", help="Do not use cached summaries")
+
+    parser_watchdog = sub_parsers.add_parser("watchdog", help="Cancel running segments that stopped making progress and restart them")
+    parser_watchdog.add_argument("roots", nargs="*", help="Directories to scan. Defaults to current directory")
+    parser_watchdog.add_argument("--window", action="store", type=float, default=3600, help="Seconds without new log output, thermo step or restart file after which the segment is stalled")
+    parser_watchdog.add_argument("--every", action="store", type=float, default=0, help="Check every given number of seconds instead of once, thermo steps are followed too")
+    parser_watchdog.add_argument("--grace", action="store", type=float, default=120, help="Seconds to wait for the cancelled job to leave the queue before restarting")
+    parser_watchdog.add_argument("--dry", action="store_true", help="Only report stalled segments")
+    parser_watchdog.add_argument("-d", "--depth", action="store", type=int, default=8, help="Maximum depth of directory tree scanning")
+    parser_watchdog.add_argument("-w", "--workers", action="store", type=int, default=16, help="Number of scanning threads")
+
+    parser_dispatch = sub_parsers.add_parser("dispatch", help="Submit queued segments of all campaigns within job caps, retrying rejected ones with backoff")
+    parser_dispatch.add_argument("--max_jobs", action="store", type=int, default=None, help="Cap on queued and running jobs of the user")
+    parser_dispatch.add_argument("--partition_cap", action="append", default=[], metavar="PARTITION=N", help="Cap on jobs of the user in the partition, can be repeated")
+    parser_dispatch.add_argument("--every", action="store", type=float, default=0, help="Dispatch every given number of seconds instead of once")
+    parser_dispatch.add_argument("--list", action="store_true", help="Print the queue and exit")
+    parser_dispatch.add_argument("--dry", action="store_true", help="Only report what would be submitted")
+
+    parser_pack = sub_parsers.add_parser("pack", help="Submit pending segments of several directories packed into shared allocations")
+    parser_pack.add_argument("folders", nargs="+", help="Initialized directories")
+    parser_pack.add_argument("--cores", action="store", type=int, required=True, help="Tasks per node of packed allocations")
+    parser_pack.add_argument("--nodes", action="store", type=int, default=1, help="Nodes per packed allocation")
+    parser_pack.add_argument("--launcher", action="store", type=str, default="srun --exact --cpu-bind=cores -c 1", help="Job step launcher, steps get disjoint CPU sets")
+    parser_pack.add_argument("--chain", action="store_true", help="Pack next segments when all steps of the allocation exit")
+    parser_pack.add_argument("--test", action="store_true", help="Only print packing plan")
+    parser_pack.set_defaults(step=None)
+
+    parser_packrun = sub_parsers.add_parser("packrun", help="Run packed segments as job steps. Used inside a job")
+    parser_packrun.add_argument("manifest", help="Manifest written by 'pack'")
+
     args = parser.parse_args()
     cs.sp.args = args
     cwd = Path.cwd()
     cs.sp.cwd = cwd
-    return choose()
+    spans.start(f"MDDPN:{args.command}")
+    try: return choose()
+    finally: spans.finish()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:22:42
+
+import os
+import re
+import time
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, Tuple, Union
+
+from . import regexs as rs
+from . import constants as cs
+from .utils import RestartMode, restart_suffix
+
+
+CHUNK = 4 * 1024 * 1024
+
+
+class Stager(threading.Thread):
+    """Copies dumps and restarts from node-local scratch to the campaign folder
+
+    Dumps are only appended by LAMMPS, so they are copied incrementally. Restart files are
+    rewritten as a whole, they are copied once they did not change between two scans, under
+    temporary name, and renamed to the real name only if the source did not change while copying.
+    So the campaign folder never contains partially written restart file under its real name.
+    """
+    def __init__(self, scratch: Path, target: Path, every: float, bandwidth: Union[float, None]) -> None:
+        super().__init__(daemon=True)
+        self.scratch = scratch
+        self.target = target
+        self.every = every
+        self.rate = bandwidth * 1024 * 1024 if bandwidth else None
+        self.stop = threading.Event()
+        self.offsets: Dict[Path, int] = {}
+        self.seen: Dict[Path, Tuple[int, int]] = {}
+        self.staged: Dict[Path, Tuple[int, int]] = {}
+        self.copied = 0
+        state = cs.sp.state
+        # restarts of one and two file modes are rewritten in place, numbered ones are written once
+        self.numbered = None
+        if cs.sf.restart_files in state and RestartMode(state[cs.sf.restart_mode]) == RestartMode.multiple:
+            self.numbered = re.compile(rs.restart_numbered(state[cs.sf.restart_files], restart_suffix(state)))
+
+    def throttle(self, size: int, started: float) -> None:
+        if self.rate is None: return
+        delay = size / self.rate - (time.time() - started)
+        if delay > 0: time.sleep(delay)
+
+    def append(self, src: Path, dst: Path) -> None:
+        offset = self.offsets.get(src, 0)
+        if src.stat().st_size <= offset: return
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        with src.open('rb') as fsrc, dst.open('ab') as fdst:
+            fdst.truncate(offset)
+            fsrc.seek(offset)
+            while len(chunk := fsrc.read(CHUNK)) > 0:
+                started = time.time()
+                fdst.write(chunk)
+                self.copied += len(chunk)
+                offset += len(chunk)
+                self.throttle(len(chunk), started)
+        self.offsets[src] = offset
+
+    def replace(self, src: Path, dst: Path, final: bool) -> None:
+        st = src.stat()
+        sig = (st.st_size, st.st_mtime_ns)
+        if self.staged.get(src) == sig: return
+        if not final and self.seen.get(src) != sig:
+            self.seen[src] = sig
+            return
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dst.parent / f".{dst.name}.staging"
+        with src.open('rb') as fsrc, tmp.open('wb') as fdst:
+            while len(chunk := fsrc.read(CHUNK)) > 0:
+                started = time.time()
+                fdst.write(chunk)
+                self.copied += len(chunk)
+                self.throttle(len(chunk), started)
+            fdst.flush()
+            os.fsync(fdst.fileno())
+        st = src.stat()
+        if (st.st_size, st.st_mtime_ns) != sig:
+            # LAMMPS started to rewrite it, next scan will try again
+            tmp.unlink()
+            return
+        os.replace(tmp, dst)
+        self.staged[src] = sig
+        cs.sp.logger.debug(f"Staged {dst.as_posix()}")
+        if self.numbered is not None and self.numbered.match(src.name):
+            src.unlink()
+            del self.staged[src]
+
+    def scan(self, final: bool = False) -> None:
+        for src in sorted(self.scratch.rglob('*')):
+            if not src.is_file(): continue
+            rel = src.relative_to(self.scratch)
+            try:
+                if rel.parts[0] == cs.folders.restarts: self.replace(src, self.target / rel, final)
+                else: self.append(src, self.target / rel)
+            except FileNotFoundError:
+                continue
+
+    def run(self) -> None:
+        while not self.stop.wait(self.every):
+            try: self.scan()
+            except OSError as e: cs.sp.logger.warning(f"Stage-out failed, will retry: {e}")
+
+    def finish(self) -> None:
+        """Waits for the copy in progress and stages out everything left"""
+        self.stop.set()
+        self.join()
+        self.scan(final=True)
+        cs.sp.logger.info(f"Stage-out complete, {self.copied / 1024 / 1024:.1f} MB copied")
+
+
+def scratch_folder(tag: int) -> Path:
+    root = os.path.expandvars(str(cs.sp.monitor[cs.cf.staging].get(cs.cf.scratch) or "$TMPDIR"))
+    if '$' in root: root = "/tmp"
+    return Path(root) / f"{cs.folders.tmp_dir_basename}.{tag}.{os.environ.get('SLURM_JOB_ID', os.getpid())}"
+
+
+def prepare_scratch(tag: int, nrep: int) -> Path:
+    return make_scratch(scratch_folder(tag), nrep)
+
+
+def make_scratch(scratch: Path, nrep: int) -> Path:
+    """Folders LAMMPS writes to under the scratch prefix"""
+    for folder in (cs.folders.dumps, cs.folders.restarts):
+        (scratch / folder).mkdir(parents=True, exist_ok=True)
+    for k in range(nrep if nrep > 1 else 0):
+        (scratch / cs.folders.restarts / f"r{k}").mkdir(exist_ok=True)
+    return scratch
+
+
+def remove_scratch(scratch: Path) -> None:
+    shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    pass
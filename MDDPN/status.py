@@ -0,0 +1,207 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:32:14
+
+import os
+import re
+import json
+import time
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Any, List, Tuple, Union, Set, Callable
+
+from . import constants as cs
+from .model import Campaign, Segment
+from .utils import RestartMode, states, logs, read_state, read_signal, cache_dir, restart_suffix, atomic_write, render_table
+
+
+skipped_folders = {cs.folders.restarts, cs.folders.dumps, cs.folders.in_file, cs.folders.slurm, cs.folders.special_restarts, cs.folders.log, cs.folders.signals, cs.folders.post_process, cs.folders.archive, cs.folders.thermo, cs.folders.history, cs.folders.insitu}
+stamped = [cs.files.state, cs.folders.restarts, cs.folders.slurm, cs.folders.dumps, cs.folders.signals]
+
+
+def stamps(folder: Path) -> Dict[str, int]:
+    res: Dict[str, int] = {}
+    for name in stamped:
+        try: res[name] = os.stat(folder / name).st_mtime_ns
+        except FileNotFoundError: res[name] = -1
+    return res
+
+
+def last_restart_step(folder: Path, basename: str, suffix: str = "") -> int:
+    last = -1
+    regex = re.compile(r"^" + basename + r"\.(\d+)" + re.escape(suffix.replace('%', 'base')) + "$")
+    try:
+        with os.scandir(folder) as it:
+            for entry in it:
+                if (m := regex.match(entry.name)):
+                    last = max(last, int(m.group(1)))
+    except FileNotFoundError:
+        pass
+    return last
+
+
+def peek_label(folder: Path, state: Dict[str, Any], campaign: Campaign, step: int) -> Union[str, None]:
+    """Same resolution as restart.retrieve_current_label, but signal files are only read"""
+    while (label := campaign.resolve(step)) is not None:
+        if label.end_step is not None: return label.name
+        try: lls = read_signal(folder, label.name)
+        except ValueError: return label.name
+        if lls is None or lls < int(state[cs.sf.restart_every]): return label.name
+        campaign.close(label.name, lls)
+    return None
+
+
+def summarize(folder: Path) -> Dict[str, Any]:
+    state = read_state(folder)
+    campaign = Campaign.load(state)
+
+    steps: List[int] = []
+    last_run: Union[Segment, None] = None
+    submitted, completed = 0, 0
+    for label in campaign.labels:
+        for seg in label.segments:
+            if seg.jobid is not None: submitted += 1
+            if seg.last_step is not None or seg.extra.get(cs.sf.exit_code) == 0: completed += 1
+            if seg.last_step is not None: steps.append(seg.last_step)
+            if seg.run_no is not None and (last_run is None or seg.run_no > (last_run.run_no or -1)): last_run = seg
+    if cs.sf.restart_files in state and RestartMode(state[cs.sf.restart_mode]) == RestartMode.multiple:
+        steps.append(last_restart_step(folder / cs.folders.restarts, state[cs.sf.restart_files], restart_suffix(state)))
+    last_step = max(steps) if len(steps) > 0 and max(steps) >= 0 else None
+
+    end_step = campaign.end_step
+
+    cstate = states(state[cs.sf.state])
+    active = cstate in (states.started, states.restarted)
+    activity = max(stamps(folder).values())
+
+    return {
+        'path': folder.as_posix(),
+        cs.sf.tag: state[cs.sf.tag],
+        cs.sf.state: cstate.value,
+        'label': peek_label(folder, state, campaign, last_step) if last_step is not None else ("START" if active else None),
+        cs.sf.last_step: last_step,
+        cs.sf.end_step: end_step,
+        cs.sf.restart: state.get(cs.sf.restart, 0),
+        cs.sf.jobid: last_run.jobid if active and last_run is not None else None,
+        'submitted': submitted,
+        'completed': completed,
+        'activity': activity / 1e9 if activity > 0 else None
+    }
+
+
+class Index:
+    def __init__(self, file: Path) -> None:
+        self.file = file
+        self.lock = threading.Lock()
+        self.entries: Dict[str, Any] = {}
+        self.dirty = False
+        if file.exists():
+            try:
+                with file.open('r') as fp: self.entries = json.load(fp)
+            except ValueError:
+                cs.sp.logger.warning(f"Status cache {file.as_posix()} is corrupted, ignoring it")
+
+    def get(self, folder: Path) -> Dict[str, Any]:
+        key = folder.as_posix()
+        st = stamps(folder)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and entry['stamps'] == st:
+            return entry['summary']
+        summary = summarize(folder)
+        with self.lock:
+            self.entries[key] = {'stamps': st, 'summary': summary}
+            self.dirty = True
+        return summary
+
+    def save(self) -> None:
+        if not self.dirty: return
+        with atomic_write(self.file) as fp:
+            json.dump(self.entries, fp)
+
+
+def scan_folder(folder: Path, depth: int) -> Tuple[List[Path], List[Tuple[Path, int]]]:
+    campaigns: List[Path] = []
+    subfolders: List[Tuple[Path, int]] = []
+    if (folder / cs.files.state).is_file():
+        return [folder], []
+    if depth == 0: return campaigns, subfolders
+    try:
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.name.startswith('.') or entry.name in skipped_folders: continue
+                if entry.is_dir(follow_symlinks=False):
+                    subfolders.append((Path(entry.path), depth - 1))
+    except PermissionError:
+        cs.sp.logger.warning(f"Permission denied: {folder.as_posix()}")
+    return campaigns, subfolders
+
+
+def scan(roots: List[Path], depth: int, workers: int, index: Union[Index, None], visit: Union[Callable[[Path, Dict[str, Any]], Dict[str, Any]], None] = None) -> List[Dict[str, Any]]:
+    """Summaries of all campaigns under the roots, visit is called with every summary in the scanning thread"""
+    summaries: List[Dict[str, Any]] = []
+    seen: Set[Path] = set()
+
+    def campaign(folder: Path) -> Dict[str, Any]:
+        try:
+            summary = index.get(folder) if index is not None else summarize(folder)
+            return visit(folder, summary) if visit is not None else summary
+        except Exception as e:
+            return {'path': folder.as_posix(), cs.sf.state: f"unreadable: {e}"}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending: List[Future] = [executor.submit(scan_folder, root, depth) for root in roots]
+        found: List[Future] = []
+        while len(pending) > 0:
+            future = pending.pop()
+            campaigns, subfolders = future.result()
+            for folder in campaigns:
+                if folder not in seen:
+                    seen.add(folder)
+                    found.append(executor.submit(campaign, folder))
+            for folder, d in subfolders:
+                pending.append(executor.submit(scan_folder, folder, d))
+        for future in found:
+            summaries.append(future.result())
+
+    return sorted(summaries, key=lambda s: s['path'])
+
+
+def fmt_time(ts: Union[float, None]) -> str:
+    if ts is None: return "-"
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(ts))
+
+
+def table(summaries: List[Dict[str, Any]]) -> str:
+    header = ["path", "state", "label", "step/end", "restarts", "jobid", "last activity"]
+    rows = [header]
+    for s in summaries:
+        step = "-" if s.get(cs.sf.last_step) is None else str(s[cs.sf.last_step])
+        end = "?" if s.get(cs.sf.end_step) is None else str(s[cs.sf.end_step])
+        rows.append([
+            s['path'], str(s[cs.sf.state]), str(s.get('label') or "-"), f"{step}/{end}",
+            str(s.get(cs.sf.restart, "-")), str(s.get(cs.sf.jobid) or "-"), fmt_time(s.get('activity'))
+        ])
+    return render_table(rows)
+
+
+@logs
+def status() -> int:
+    roots = [Path(root).resolve() for root in cs.sp.args.roots] if cs.sp.args.roots else [cs.sp.cwd]
+    index = None if cs.sp.args.no_cache else Index(cache_dir() / cs.files.status_cache)
+    summaries = scan(roots, cs.sp.args.depth, cs.sp.args.workers, index)
+    if index is not None: index.save()
+    if cs.sp.args.json: print(json.dumps(summaries, indent=4))
+    else: print(table(summaries))
+    return 0
+
+
+if __name__ == "__main__":
+    pass
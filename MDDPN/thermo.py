@@ -0,0 +1,101 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:05:52
+
+import re
+from pathlib import Path
+from typing import Dict, List, Tuple, Union, Iterable
+
+from .archive import open_text
+
+
+class ThermoReader:
+    """Incremental reader of thermo output from LAMMPS log file
+
+    Thermo header is the first non-empty line after 'Per MPI rank memory allocation' line,
+    block ends with 'Loop time of' line. Only complete lines are consumed, so the file can be
+    read while LAMMPS is writing it.
+    """
+    def __init__(self, logfile: Path) -> None:
+        self.logfile = logfile
+        self.offset: int = 0
+        self.buffer: bytes = b''
+        self.columns: Union[List[str], None] = None
+        self.expect_header: bool = False
+
+    def feed(self, lines: Iterable[str]) -> List[Dict[str, float]]:
+        rows: List[Dict[str, float]] = []
+        for line in lines:
+            if line.startswith("Per MPI rank memory allocation"):
+                self.expect_header = True
+                self.columns = None
+                continue
+            tokens = line.split()
+            if len(tokens) == 0: continue
+            if self.expect_header:
+                self.columns = tokens
+                self.expect_header = False
+                continue
+            if line.startswith("Loop time of"):
+                self.columns = None
+                continue
+            if self.columns is None or len(tokens) != len(self.columns): continue
+            try: values = [float(token) for token in tokens]
+            except ValueError: continue
+            rows.append(dict(zip(self.columns, values)))
+        return rows
+
+    def poll(self) -> List[Dict[str, float]]:
+        if not self.logfile.exists(): return []
+        with self.logfile.open('rb') as fp:
+            fp.seek(self.offset)
+            chunk = fp.read()
+            self.offset = fp.tell()
+        self.buffer += chunk
+        *lines, self.buffer = self.buffer.split(b'\n')
+        return self.feed(line.decode(errors='replace') for line in lines)
+
+
+def read_log(logfile: Path) -> List[Dict[str, float]]:
+    with logfile.open('r', errors='replace') as fp:
+        return ThermoReader(logfile).feed(fp)
+
+
+def newest_log(folder: Path) -> Union[Path, None]:
+    """LAMMPS log written last under the folder (slurm logs of the campaign)"""
+    newest: Union[Tuple[int, Path], None] = None
+    for log in folder.rglob("log.lammps*"):
+        try: mtime = log.stat().st_mtime_ns
+        except FileNotFoundError: continue
+        if newest is None or mtime > newest[0]: newest = (mtime, log)
+    return newest[1] if newest is not None else None
+
+
+def performance(logfile: Path) -> List[float]:
+    """Timesteps per second of every run reported in LAMMPS log file"""
+    res: List[float] = []
+    with open_text(logfile) as fp:
+        for line in fp:
+            if line.startswith("Performance:") and (m := re.search(r"([\d.eE+-]+) timesteps/s", line)):
+                res.append(float(m.group(1)))
+    return res
+
+
+def natoms(logfile: Path) -> Union[int, None]:
+    """Number of atoms from the last 'Loop time' line"""
+    res = None
+    with open_text(logfile) as fp:
+        for line in fp:
+            if line.startswith("Loop time of") and (m := re.search(r"with (\d+) atoms", line)):
+                res = int(m.group(1))
+    return res
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:32:14
+
+import os
+import re
+import json
+import time
+import shutil
+from pathlib import Path
+from typing import Dict, Any, List, Tuple, Union
+
+import toml
+from MPMU import confdict
+import pysbatch_ng
+
+from . import parsers
+from . import constants as cs
+from .run import partition
+from .model import Campaign
+from .restart import find_last
+from .archive import files
+from .thermo import performance, natoms
+from .utils import RestartMode, logs, replicas, replica_folder, replica_path, cache_dir, restart_name, restart_base, atomic_write, render_table
+
+
+Shape = Tuple[int, int]
+
+neutralized = re.compile(r"^\s*(dump|dump_modify|undump|write_restart|write_data|write_dump)\s")
+
+
+def parse_shapes(spec: str) -> List[Shape]:
+    shapes: List[Shape] = []
+    for item in spec.split(','):
+        n, p = item.strip().split('x')
+        shapes.append((int(n), int(p)))
+    return shapes
+
+
+def default_shapes() -> List[Shape]:
+    n = int(cs.sp.sconf_main[pysbatch_ng.cs.fields.nnodes])
+    p = int(cs.sp.sconf_main[pysbatch_ng.cs.fields.ntpn])
+    shapes = {(n, p), (n * 2, p), (max(n // 2, 1), p), (n, max(p // 2, 1))}
+    return sorted(shapes, key=lambda s: s[0] * s[1])
+
+
+def shape_key(shape: Shape) -> str:
+    return f"{shape[0]}x{shape[1]}"
+
+
+def current_restart() -> Path:
+    """Restart file the next segment would start from, found without touching the restarts folder"""
+    basename = cs.sp.state[cs.sf.restart_files]
+    folder = replica_folder(0) if replicas() > 1 else cs.sp.cwd / cs.folders.restarts
+    mode = RestartMode(cs.sp.state[cs.sf.restart_mode])
+    if mode == RestartMode.multiple:
+        step = find_last(folder, basename)
+        if step < 0: raise RuntimeError(f"Cannot find any restart files in folder {folder.as_posix()}")
+        name = restart_name(f".{step}")
+    elif mode == RestartMode.one:
+        name = restart_name("")
+    else:
+        pair = [folder / restart_name(s) for s in ('.a', '.b') if restart_base(folder / restart_name(s)).exists()]
+        if len(pair) == 0: raise RuntimeError(f"Cannot find any restart files in folder {folder.as_posix()}")
+        name = max(pair, key=lambda f: restart_base(f).stat().st_mtime).name
+    if not restart_base(folder / name).exists(): raise RuntimeError(f"Restart file {(folder / name).as_posix()} not found")
+    return cs.sp.cwd / replica_path() / name
+
+
+def current_label() -> str:
+    last: Union[Tuple[int, str], None] = None
+    for label in Campaign.from_state(cs.sp.state).labels:
+        for seg in label.segments:
+            if seg.run_no is not None and (last is None or seg.run_no > last[0]): last = (seg.run_no, label.name)
+    if last is None: raise RuntimeError("No segments were run yet, nothing to tune from")
+    return last[1]
+
+
+def neutralize(in_file: Path, seconds: int) -> None:
+    """Timed segment: no dumps, restarts or data files, runs are stopped by LAMMPS timer"""
+    with in_file.open('r') as fp:
+        lines = fp.readlines()
+    out = [f"timer timeout {seconds}\n"]
+    for line in lines:
+        if re.match(r"^\s*restart\s", line): line = "restart 0\n"
+        elif neutralized.match(line): line = "# " + line
+        out.append(line)
+    with in_file.open('w') as fp:
+        fp.writelines(out)
+
+
+def known_natoms() -> Union[int, None]:
+    logfiles = sorted(files(cs.sp.cwd, cs.folders.slurm, "log.lammps*"), key=lambda f: f[1], reverse=True)
+    for log, _ in logfiles:
+        if (n := natoms(log)) is not None: return n
+    return None
+
+
+def cache_key(n: int) -> str:
+    """Systems of close size share measurements: atoms are rounded to 3 significant digits"""
+    return f"{cs.execs.lammps}|{float(f'{n:.3g}'):.0f}"
+
+
+@logs
+def measure(shapes: List[Shape], label: str, restart_file: Path, seconds: int) -> Tuple[Dict[str, float], Union[int, None]]:
+    root = (cs.sp.cwd / ".." / (cs.folders.tmp_dir_basename + f"tune{round(time.time())}")).resolve()
+    old_cwd, old_templates = cs.sp.cwd, cs.folders.in_templates
+    templates = (cs.sp.cwd / cs.folders.in_templates).resolve()
+    num = int(cs.sp.state[cs.sf.run_labels][label][cs.sf.runs])
+    jobs: List[Tuple[Shape, Path, int]] = []
+    points: Dict[str, float] = {}
+    size: Union[int, None] = None
+    try:
+        try:
+            cs.folders.in_templates = templates.as_posix()
+            for shape in shapes:
+                sdir = root / shape_key(shape)
+                for folder in (cs.folders.in_file, cs.folders.dumps, cs.folders.restarts, cs.folders.special_restarts, cs.folders.signals, cs.folders.slurm):
+                    (sdir / folder).mkdir(parents=True)
+                for k in range(replicas() if replicas() > 1 else 0):
+                    (sdir / cs.folders.restarts / f"r{k}").mkdir()
+                cs.sp.cwd = sdir
+                in_file = parsers.generator(num, label, restart_file)
+                neutralize(in_file, seconds)
+
+                sconf = dict(cs.sp.sconf_test)
+                sconf[pysbatch_ng.cs.fields.nnodes] = shape[0]
+                sconf[pysbatch_ng.cs.fields.ntpn] = shape[1]
+                sconf[pysbatch_ng.cs.fields.executable] = cs.execs.lammps
+                sconf[pysbatch_ng.cs.fields.args] = partition(sconf) + "-v test 1 -nonbuf -echo both -log '{jd}/log.lammps' -in " + in_file.as_posix()
+                os.chdir(sdir)
+                jobid = pysbatch_ng.sbatch.run(sdir, cs.sp.logger.getChild("submitter"), confdict(sconf))
+                cs.sp.logger.info(f"Shape {shape_key(shape)}: submitted job {jobid}")
+                jobs.append((shape, sdir, jobid))
+        finally:
+            os.chdir(old_cwd)
+            cs.sp.cwd, cs.folders.in_templates = old_cwd, old_templates
+
+        for shape, sdir, jobid in jobs:
+            if not pysbatch_ng.polling.loop(jobid, 20, cs.sp.logger.getChild("poll"), 60 * 60):
+                cs.sp.logger.error(f"Shape {shape_key(shape)}: job {jobid} failed")
+                continue
+            logfiles = sorted(sdir.rglob("log.lammps*"))
+            if len(logfiles) == 0:
+                cs.sp.logger.error(f"Shape {shape_key(shape)}: LAMMPS log not found")
+                continue
+            measured = [tps for tps in performance(logfiles[0]) if tps > 0]
+            if len(measured) == 0:
+                cs.sp.logger.error(f"Shape {shape_key(shape)}: no performance data in {logfiles[0].as_posix()}")
+                continue
+            points[shape_key(shape)] = measured[-1]
+            size = size or natoms(logfiles[0])
+            cs.sp.logger.info(f"Shape {shape_key(shape)}: {measured[-1]} timesteps/s")
+    finally:
+        # submitted jobs may still be running when polling failed, their folders go anyway
+        shutil.rmtree(root, ignore_errors=True)
+    return points, size
+
+
+def solve(a: List[List[float]], b: List[float]) -> List[float]:
+    """Gaussian elimination with partial pivoting"""
+    n = len(b)
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for c in range(n):
+        p = max(range(c, n), key=lambda r: abs(m[r][c]))
+        m[c], m[p] = m[p], m[c]
+        if m[c][c] == 0: raise ValueError("Singular system")
+        for r in range(c + 1, n):
+            f = m[r][c] / m[c][c]
+            for k in range(c, n + 1): m[r][k] -= f * m[c][k]
+    x = [0.] * n
+    for r in reversed(range(n)):
+        x[r] = (m[r][n] - sum(m[r][k] * x[k] for k in range(r + 1, n))) / m[r][r]
+    return x
+
+
+def fit(points: Dict[str, float]) -> Union[List[float], None]:
+    """Least squares of time per step t(n) = a + b/n + c*n over total tasks n: serial part, parallel part, communication"""
+    xs = [n * p for n, p in (parse_shapes(k)[0] for k in points)]
+    ys = [1 / tps for tps in points.values()]
+    if len(xs) < 2: return None
+    basis = [lambda n: 1., lambda n: 1. / n] + ([lambda n: float(n)] if len(xs) >= 3 else [])
+    ata = [[sum(f(x) * g(x) for x in xs) for g in basis] for f in basis]
+    aty = [sum(f(x) * y for x, y in zip(xs, ys)) for f in basis]
+    try: coef = solve(ata, aty)
+    except ValueError: return None
+    return coef + [0.] * (3 - len(coef))
+
+
+def predict(coef: Union[List[float], None], shape: Shape, measured: Union[float, None]) -> Union[float, None]:
+    if coef is None: return measured
+    n = shape[0] * shape[1]
+    t = coef[0] + coef[1] / n + coef[2] * n
+    return 1 / t if t > 0 else measured
+
+
+@logs
+def write_back(shape: Shape) -> None:
+    conffile = cs.sp.conffile_path
+    with conffile.open('r') as fp:
+        conf = toml.load(fp) if cs.sp.conffile_format == 'toml' else json.load(fp)
+    main = conf[cs.cf.sect_MDDPN][cs.cf.sect_sbatch][cs.cf.sect_sbatch_main]
+    main[pysbatch_ng.cs.fields.nnodes] = shape[0]
+    main[pysbatch_ng.cs.fields.ntpn] = shape[1]
+    with conffile.open('w') as fp:
+        if cs.sp.conffile_format == 'toml': toml.dump(conf, fp)
+        else: json.dump(conf, fp, indent=4)
+    cs.sp.logger.info(f"Main runs shape set to {shape_key(shape)} in {conffile.as_posix()}")
+
+
+@logs
+def tune() -> int:
+    args = cs.sp.args
+    shapes = parse_shapes(args.shapes) if args.shapes else default_shapes()
+    if replicas() > 1:
+        shapes = [s for s in shapes if (s[0] * s[1]) % replicas() == 0]
+    cache_file = cache_dir() / cs.files.tune_cache
+    cache: Dict[str, Any] = {}
+    if cache_file.exists():
+        with cache_file.open('r') as fp: cache = json.load(fp)
+
+    points: Dict[str, float] = {}
+    size = known_natoms()
+    if size is not None and not args.no_cache:
+        cached = cache.get(cache_key(size), {})
+        points = {shape_key(s): cached[shape_key(s)] for s in shapes if shape_key(s) in cached}
+        if len(points) > 0: cs.sp.logger.info(f"Using cached measurements for {size} atoms: {', '.join(points)}")
+
+    if len(missing := [s for s in shapes if shape_key(s) not in points]) > 0:
+        measured, msize = measure(missing, args.label or current_label(), current_restart(), args.seconds)
+        points.update(measured)
+        if (size := msize or size) is not None:
+            cache.setdefault(cache_key(size), {}).update(measured)
+            with atomic_write(cache_file) as fp: json.dump(cache, fp, indent=4)
+    if len(points) == 0: raise RuntimeError("No shape was measured successfully")
+
+    coef = fit(points)
+    rows = [["shape", "tasks", "measured", "fitted", "per node"]]
+    best: Union[Tuple[float, Shape], None] = None
+    for shape in shapes:
+        tps = predict(coef, shape, points.get(shape_key(shape)))
+        if tps is None: continue
+        score = tps if args.objective == "time" else tps / shape[0]
+        if best is None or score > best[0]: best = (score, shape)
+        m = points.get(shape_key(shape))
+        rows.append([shape_key(shape), str(shape[0] * shape[1]), "-" if m is None else f"{m:.2f}", f"{tps:.2f}", f"{tps / shape[0]:.2f}"])
+    print(render_table(rows))
+    if best is None: return 1
+    print(f"Best shape for objective '{args.objective}': {shape_key(best[1])}")
+    if args.write: write_back(best[1])
+    return 0
+
+
+if __name__ == "__main__":
+    pass
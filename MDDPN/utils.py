@@ -6,16 +6,23 @@
 # This software is released under the MIT License.
 # https://opensource.org/licenses/MIT
 
-# Last modified: 03-05-2024 20:31:51
+# Last modified: 19-10-2026 14:32:37
 
+import os
+import re
 import sys
 import json
+import time
+import fcntl
+import socket
 import logging
 import functools
 from enum import Enum
-from contextlib import contextmanager
-from typing import Generator, Dict, Any, Callable, Union
+from pathlib import Path
+from contextlib import contextmanager, ExitStack
+from typing import Generator, Dict, Any, Callable, Union, List, Tuple, IO
 
+from . import spans
 from . import constants as cs
 
 
@@ -24,9 +31,11 @@ def logs(func: Callable) -> Callable:
     def wrapper(*args, **kwargs) -> Callable:
         old_logger = cs.sp.logger
         cs.sp.logger = old_logger.getChild(func.__name__)
-        result = func(*args, **kwargs)
-        cs.sp.logger = old_logger
-        return result
+        try:
+            with spans.span(func.__name__):
+                return func(*args, **kwargs)
+        finally:
+            cs.sp.logger = old_logger
     return wrapper
 
 
@@ -69,44 +78,118 @@ class AP:
         self.ppargs = ppargs
 
 
+class Busy(RuntimeError):
+    """Campaign lock is held by another process"""
+
+
+held: Dict[str, List[int]] = {}  # lock file -> [descriptor, depth], POSIX locks are per process and released by any close
+
+
+def lock_holder(lockfile: Path) -> Tuple[str, int, float]:
+    """Host, pid and time recorded by the lock holder"""
+    try:
+        with lockfile.open('r') as fp: host, pid, since = fp.read().split()
+        return host, int(pid), float(since)
+    except (OSError, ValueError):
+        return "", 0, time.time()
+
+
+def stale(lockfile: Path) -> bool:
+    """Holder is a dead process of this host or did not release the lock for too long (e.g. node of NFS client crashed)"""
+    host, pid, since = lock_holder(lockfile)
+    if time.time() - since > cs.params.lock_stale: return True
+    if host != socket.gethostname() or pid <= 0: return False
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return True
+    except PermissionError: pass
+    return False
+
+
 @contextmanager
-def load_state() -> Generator[Dict[str, Any], Dict[str, Any], None]:
-    stf = cs.sp.cwd / cs.files.state
-    if not stf.exists(): raise FileNotFoundError(f"State file '{stf.as_posix()}' not found")
-    with stf.open('r') as f:
-        state: Dict[str, Any] = json.load(f)
-        cs.sp.state = state
-    try: yield state
+def locked(lockfile: Path, timeout: Union[float, None] = None) -> Generator[None, None, None]:
+    """Advisory fcntl lock of the campaign, reentrant within the process
+
+    The kernel releases the lock of a killed process. The holder is recorded in the file, so a lock
+    that outlived its holder anyway (lost NFS client) is broken: the file is unlinked and recreated,
+    the old one is no longer what the path points to.
+    """
+    key = lockfile.as_posix()
+    if key in held:
+        held[key][1] += 1
+        try: yield
+        finally: held[key][1] -= 1
+        return
+    timeout = cs.params.lock_timeout if timeout is None else timeout
+    deadline = time.time() + timeout
+    delay = 0.1
+    while True:
+        fd = os.open(lockfile, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            if stale(lockfile):
+                host, pid, _ = lock_holder(lockfile)
+                cs.sp.logger.warning(f"Breaking stale lock {lockfile.as_posix()} of pid {pid} on '{host}'")
+                try: lockfile.unlink()
+                except FileNotFoundError: pass
+                continue
+            if time.time() >= deadline:
+                host, pid, since = lock_holder(lockfile)
+                raise Busy(f"Campaign is locked by pid {pid} on '{host}' since {time.ctime(since)}: {lockfile.as_posix()}")
+            time.sleep(delay)
+            delay = min(delay * 2, 10.)
+            continue
+        try: same = os.fstat(fd).st_ino == os.stat(lockfile).st_ino
+        except FileNotFoundError: same = False
+        if same: break
+        # lock was broken while we were waiting for it
+        os.close(fd)
+    os.ftruncate(fd, 0)
+    os.write(fd, f"{socket.gethostname()} {os.getpid()} {time.time()}\n".encode())
+    held[key] = [fd, 1]
+    try: yield
     finally:
-        with stf.open('w') as f:
-            json.dump(cs.sp.state, f, indent=4)
+        del held[key]
+        os.close(fd)
 
 
-def setup_logger(name: str, level: int = logging.DEBUG) -> logging.Logger:
-    folder = cs.sp.cwd / cs.folders.log
-    folder.mkdir(exist_ok=True, parents=True)
-    logfile = folder / cs.files.logfile
-    folder = folder / cs.folders.pass_log
-    folder.mkdir(exist_ok=True, parents=True)
+def renew(lockfile: Path) -> None:
+    """Holder that keeps the lock for long records a new time, so it is not taken for stale"""
+    fd = held[lockfile.as_posix()][0]
+    os.ftruncate(fd, 0)
+    os.pwrite(fd, f"{socket.gethostname()} {os.getpid()} {time.time()}\n".encode(), 0)
 
-    dir_list = list(folder.iterdir())
-    if len(dir_list) == 0:
-        last = 0
-    else:
-        last = max([int(file.relative_to(folder).as_posix()[len(cs.files.pass_log_prefix):-len(cs.files.pass_log_suffix)]) for file in dir_list])
-    logfile_pass = folder / (cs.files.pass_log_prefix + str(last + 1) + cs.files.pass_log_suffix)
 
+def lock_file(folder: Path, tag: Union[int, None] = None) -> Path:
+    """Lock of the campaign, the tag is read from its state unless given (state is not written yet)"""
+    return folder / f"{read_state(folder)[cs.sf.tag] if tag is None else tag}.lock"
+
+
+@contextmanager
+def load_state(timeout: Union[float, None] = None, write: bool = True) -> Generator[Dict[str, Any], Dict[str, Any], None]:
+    """State of the campaign in working directory, locked until it is written back (if it is)"""
+    stf = cs.sp.cwd / cs.files.state
+    if not stf.exists(): raise FileNotFoundError(f"State file '{stf.as_posix()}' not found")
+    with ExitStack() as held_lock:
+        with spans.span("lock"): held_lock.enter_context(locked(lock_file(cs.sp.cwd), timeout))
+        with spans.span("read_state"), stf.open('r') as f:
+            state: Dict[str, Any] = json.load(f)
+            cs.sp.state = state
+        try: yield state
+        finally:
+            if write:
+                with spans.span("write_state"), stf.open('w') as f:
+                    json.dump(cs.sp.state, f, indent=4)
+
+
+def setup_logger(name: str, level: int = logging.DEBUG, to_file: bool = True) -> logging.Logger:
     logger = logging.getLogger(name)
     logger.handlers.clear()
     logger.setLevel(level)
 
-    handler = logging.FileHandler(logfile)
-    handler.setFormatter(cs.sp.formatter)
-    logger.addHandler(handler)
-
-    handler_pass = logging.FileHandler(logfile_pass)
-    handler_pass.setFormatter(cs.sp.formatter)
-    logger.addHandler(handler_pass)
+    if to_file:
+        add_file_handlers(logger)
 
     if not cs.sp.args.no_screen:
         soutHandler = logging.StreamHandler(stream=sys.stdout)
@@ -121,12 +204,126 @@ def setup_logger(name: str, level: int = logging.DEBUG) -> logging.Logger:
     return logger
 
 
-def gsr(label: str, obj, cnt: int):
-    if isinstance(obj, dict):
-        if label == list(obj.keys())[0]:
-            return obj[label]*cnt
+def add_file_handlers(logger: logging.Logger) -> None:
+    folder = cs.sp.cwd / cs.folders.log
+    folder.mkdir(exist_ok=True, parents=True)
+    logfile = folder / cs.files.logfile
+    folder = folder / cs.folders.pass_log
+    folder.mkdir(exist_ok=True, parents=True)
+
+    regex = re.compile(r"^" + re.escape(cs.files.pass_log_prefix) + r"(\d+)" + re.escape(cs.files.pass_log_suffix) + "$")
+    names = [file.name for file in folder.iterdir()]
+    # compacted pass logs are gone from the folder, numbering continues after them
+    if (archived := cs.sp.cwd / cs.folders.archive / cs.files.archive_index).exists():
+        prefix = f"{cs.folders.log}/{cs.folders.pass_log}/"
+        with archived.open('r') as fp: names += [rel[len(prefix):] for rel in json.load(fp) if rel.startswith(prefix)]
+    numbers = [int(m.group(1)) for name in names if (m := regex.match(name))]  # profiles are written next to pass logs
+    last = max(numbers) if len(numbers) > 0 else 0
+    logfile_pass = folder / (cs.files.pass_log_prefix + str(last + 1) + cs.files.pass_log_suffix)
+    cs.sp.pass_log = logfile_pass
+
+    handler = logging.FileHandler(logfile)
+    handler.setFormatter(cs.sp.formatter)
+    logger.addHandler(handler)
+
+    handler_pass = logging.FileHandler(logfile_pass)
+    handler_pass.setFormatter(cs.sp.formatter)
+    logger.addHandler(handler_pass)
+
+
+def read_state(folder: Path) -> Dict[str, Any]:
+    stf = folder / cs.files.state
+    if not stf.exists(): raise FileNotFoundError(f"State file '{stf.as_posix()}' not found")
+    with stf.open('r') as f:
+        return json.load(f)
+
+
+def read_signal(folder: Path, label: str) -> Union[int, None]:
+    nts = folder / cs.folders.signals / f"{label}.signal"
+    if not nts.exists(): return None
+    with nts.open('r') as fp: rrt = fp.readline().split("#")[0].strip()
+    if not re.match(r"\d+", rrt): raise ValueError(f"Signal file {nts.as_posix()} does not contain readable timestep")
+    return int(rrt)
+
+
+def replicas() -> int:
+    return int(cs.sp.state.get(cs.sf.replicas, 1))
+
+
+def replica_folder(replica: int) -> Path:
+    return cs.sp.cwd / cs.folders.restarts / f"r{replica}"
+
+
+def replica_path() -> str:
+    """Restarts folder relative to campaign folder, as it should be written to LAMMPS input file"""
+    if replicas() > 1: return f"{cs.folders.restarts}/r${{{cs.params.replica_var}}}"
+    return cs.folders.restarts
+
+
+def restart_suffix(state: Union[Dict[str, Any], None] = None) -> str:
+    """Part of restart file name after the step (or '.a', '.b'): '', '.mpiio' or per-processor '.%'"""
+    return (state if state is not None else cs.sp.state).get(cs.sf.restart_suffix, "")
+
+
+def parallel_suffix(filename: str) -> str:
+    return next((sfx for sfx in ('.mpiio', '.%') if filename.endswith(sfx)), "")
+
+
+def restart_name(tail: str, state: Union[Dict[str, Any], None] = None) -> str:
+    """Restart file name as it is given to LAMMPS, tail is '.STEP', '.*', '.a', '.b' or ''"""
+    state = state if state is not None else cs.sp.state
+    return f"{state[cs.sf.restart_files]}{tail}{restart_suffix(state)}"
+
+
+def restart_base(file: Path) -> Path:
+    """File that exists for every written restart, for per-processor restarts it is the '.base' one"""
+    return file.with_name(file.name.replace('%', 'base'))
+
+
+def restart_parts(file: Path) -> List[Path]:
+    """All files of one restart: per-processor restarts are written as the base file and a file per processor (or per group of them)"""
+    if '%' not in file.name: return [file] if file.exists() else []
+    prefix, postfix = file.name.split('%')
+    regex = re.compile(re.escape(prefix) + r"(base|\d+)" + re.escape(postfix) + "$")
+    if not file.parent.exists(): return []
+    return sorted(f for f in file.parent.iterdir() if regex.match(f.name))
+
+
+def remove_restart(file: Path) -> None:
+    for part in restart_parts(file): part.unlink()
+
+
+def cache_dir() -> Path:
+    folder = Path(os.environ.get("XDG_CACHE_HOME", "~/.cache")).expanduser() / cs.folders.cache
+    folder.mkdir(exist_ok=True, parents=True)
+    return folder
+
+
+def intent_file(tag: int) -> Path:
+    """Submission intent of the campaign, waiting for the dispatcher"""
+    folder = cache_dir() / cs.folders.queue
+    folder.mkdir(exist_ok=True)
+    return folder / f"{tag}.json"
+
+
+@contextmanager
+def atomic_write(file: Path, mode: str = 'w') -> Generator[IO, None, None]:
+    """File opened for writing under a temporary name, renamed over the target only when the block succeeds
+
+    Readers see either the old file or the complete new one, never a partial write.
+    """
+    tmp = file.parent / f".{file.name}.{os.getpid()}.tmp"
+    try:
+        with tmp.open(mode) as fp: yield fp
+        os.replace(tmp, file)
+    finally:
+        tmp.unlink(missing_ok=True)
+
 
-    return obj
+def render_table(rows: List[List[str]]) -> str:
+    """Columns padded to the widest cell, the first row is the header"""
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join("  ".join(cell.ljust(w) for cell, w in zip(row, widths)).rstrip() for row in rows)
 
 
 if __name__ == "__main__":
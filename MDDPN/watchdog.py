@@ -0,0 +1,141 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2023 Perevoshchikov Egor
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+
+# Last modified: 19-10-2026 14:04:05
+
+import time
+import shlex
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, Any, List, Tuple, Union
+
+from . import constants as cs
+from .pack import campaign
+from .metrics import usage
+from .model import Campaign
+from .status import Index, scan
+from .thermo import ThermoReader, newest_log
+from .utils import logs, cache_dir
+
+
+class Progress:
+    """Progress signals of one running segment: log growth, thermo step and new restarts
+
+    Thermo step is followed only by a long-running watchdog, a single check relies on modification times.
+    """
+    def __init__(self, log: Path) -> None:
+        self.reader = ThermoReader(log)
+        self.step: Union[int, None] = None
+        self.since = 0.
+        self.checked = 0.
+
+    def advance(self) -> float:
+        """Time of the last step change seen"""
+        self.checked = time.time()
+        try: mtime = self.reader.logfile.stat().st_mtime
+        except FileNotFoundError: return self.since
+        rows = [row for row in self.reader.poll() if "Step" in row]
+        if len(rows) > 0 and int(rows[-1]["Step"]) != self.step:
+            self.step = int(rows[-1]["Step"])
+            # the first poll reads the whole log, the step was reached not later than the log was written
+            self.since = mtime if self.since == 0. else time.time()
+        return self.since
+
+
+followed: Dict[str, Progress] = {}
+
+
+def jobs(jobids: List[str]) -> Dict[str, Tuple[str, str, Union[float, None]]]:
+    """State, node list and start time of queued jobs, one squeue call"""
+    if len(jobids) == 0: return {}
+    res = subprocess.run(["squeue", "-h", "-o", "%i|%T|%N|%S", "-j", ",".join(jobids)], capture_output=True, text=True)
+    found: Dict[str, Tuple[str, str, Union[float, None]]] = {}
+    for line in res.stdout.splitlines():
+        if len(parts := line.strip().split('|')) != 4: continue
+        try: start: Union[float, None] = datetime.fromisoformat(parts[3]).timestamp()
+        except ValueError: start = None
+        found[parts[0]] = (parts[1], parts[2], start)
+    return found
+
+
+def last_progress(folder: Path, started: float) -> Tuple[float, Union[int, None]]:
+    """Latest of: job start, log write (or thermo step change when followed), restart write"""
+    times = [started, usage(folder / cs.folders.restarts)[1]]
+    step = None
+    if (log := newest_log(folder / cs.folders.slurm)) is not None:
+        try:
+            if log.stat().st_mtime >= started:
+                progress = followed.get(log.as_posix())
+                if progress is None and cs.sp.args.every > 0: progress = followed[log.as_posix()] = Progress(log)
+                if progress is not None:
+                    times.append(progress.advance())
+                    step = progress.step
+                else: times.append(log.stat().st_mtime)
+        except FileNotFoundError:
+            pass
+    return max(times), step
+
+
+@logs
+def recycle(folder: Path, jobid: str, nodes: str, since: float, step: Union[int, None]) -> None:
+    """Records the incident, cancels the job and starts normal restart"""
+    with campaign(folder, 60) as state:
+        camp = Campaign.from_state(state)
+        segment = next((f"{label.name}{seg.num}" for label in camp.labels for seg in label.segments if str(seg.jobid) == jobid), None)
+        state.setdefault(cs.sf.incidents, []).append({
+            cs.sf.event_time: time.time(), cs.sf.jobid: int(jobid), "segment": segment, "nodes": nodes,
+            "reason": f"no progress since {time.ctime(since)}", cs.sf.last_step: step,
+        })
+    cs.sp.logger.warning(f"{folder.as_posix()}: job {jobid} ({segment}) on {nodes} made no progress since {time.ctime(since)}, cancelling")
+    subprocess.run(["scancel", jobid])
+    deadline = time.time() + cs.sp.args.grace
+    while time.time() < deadline and jobid in jobs([jobid]): time.sleep(5)
+    # restart is idempotent: if the poller of the job restarts the campaign first, this one does nothing
+    subprocess.Popen(shlex.split(f"{cs.execs.MDDPN} --no_screen restart"), cwd=folder, start_new_session=True,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def check(summaries: List[Dict[str, Any]]) -> int:
+    started_check = time.time()
+    active = {str(s[cs.sf.jobid]): s for s in summaries if s.get(cs.sf.jobid) is not None}
+    queued = jobs(list(active))
+    stalled = 0
+    for jobid, (jstate, nodes, started) in queued.items():
+        if jstate != "RUNNING" or started is None: continue
+        folder = Path(active[jobid]['path'])
+        since, step = last_progress(folder, started)
+        if time.time() - since < cs.sp.args.window: continue
+        stalled += 1
+        if cs.sp.args.dry:
+            print(f"{folder.as_posix()}: job {jobid} on {nodes} made no progress since {time.ctime(since)}")
+            continue
+        try: recycle(folder, jobid, nodes, since, step)
+        except Exception as e:
+            cs.sp.logger.error(f"Failed to recycle job {jobid} of {folder.as_posix()}")
+            cs.sp.logger.exception(e)
+    for log in [log for log, progress in followed.items() if progress.checked < started_check]: del followed[log]  # segment ended
+    return stalled
+
+
+@logs
+def watchdog() -> int:
+    args = cs.sp.args
+    roots = [Path(root).resolve() for root in args.roots] if args.roots else [cs.sp.cwd]
+    index = Index(cache_dir() / cs.files.status_cache)
+    while True:
+        summaries = scan(roots, args.depth, args.workers, index)
+        index.save()
+        stalled = check(summaries)
+        cs.sp.logger.info(f"Checked {len(summaries)} campaigns, {stalled} stalled")
+        if args.every <= 0: return 0
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    pass
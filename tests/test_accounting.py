@@ -0,0 +1,75 @@
+from pathlib import Path
+
+import pytest
+
+from MDDPN.accounting import parse_sacct, duration, memory
+
+
+@pytest.fixture
+def jobs():
+    return parse_sacct((Path(__file__).parent / "fixtures" / "sacct.txt").read_text())
+
+
+def test_jobs_and_steps(jobs):
+    assert sorted(jobs) == ["4242", "4243", "4244", "4245", "4246", "4247"]
+
+
+def test_timeout(jobs):
+    job = jobs["4242"]
+    assert job["state"] == "TIMEOUT"
+    assert job["exit_code"] == "0:0"
+    assert job["queue_wait"] == 30 * 60
+    assert job["elapsed"] == 2 * 3600 + 1
+    assert job["total_cpu"] == (7 * 24 + 10) * 3600
+    assert job["max_rss"] == int(1.5 * 1024 ** 3)  # the largest of the steps
+    assert (job["nodes"], job["nnodes"], job["cpus"]) == ("node[01-02]", 2, 96)
+
+
+def test_cancelled_by_user(jobs):
+    job = jobs["4243"]
+    assert job["state"] == "CANCELLED"
+    assert job["queue_wait"] == 34 * 60 + 12
+    assert job["elapsed"] == 15 * 60 + 28
+    assert job["total_cpu"] == pytest.approx(12 * 3600 + 20 * 60 + 6.4)
+    assert job["max_rss"] == 812340 * 1024
+
+
+def test_cancelled_pending(jobs):
+    job = jobs["4244"]
+    assert job["state"] == "CANCELLED"
+    assert job["start"] == "Unknown"
+    assert job["queue_wait"] is None
+    assert job["elapsed"] == 0
+    assert job["total_cpu"] == 0
+    assert job["max_rss"] is None
+
+
+def test_failed(jobs):
+    job = jobs["4245"]
+    assert (job["state"], job["exit_code"]) == ("FAILED", "1:0")
+    assert job["total_cpu"] == pytest.approx(1.104)
+    assert job["max_rss"] == 2048 * 1024
+
+
+def test_running_and_pending(jobs):
+    assert jobs["4246"]["state"] == "RUNNING"
+    assert jobs["4246"]["end"] == "Unknown"
+    assert jobs["4246"]["elapsed"] == ((24 + 2) * 60 + 3) * 60 + 4
+    assert jobs["4247"]["state"] == "PENDING"
+    assert jobs["4247"]["queue_wait"] is None
+    assert (jobs["4247"]["nnodes"], jobs["4247"]["cpus"]) == (0, 0)
+
+
+@pytest.mark.parametrize("text, seconds", [("", 0.), ("INVALID", 0.), ("00:05", 5.), ("01:02:03", 3723.), ("2-00:00:01", 172801.), ("00:01.512", 1.512)])
+def test_duration(text, seconds):
+    assert duration(text) == pytest.approx(seconds)
+
+
+@pytest.mark.parametrize("text, size", [("", None), ("0", 0), ("892K", 892 * 1024), ("1.5G", int(1.5 * 1024 ** 3))])
+def test_memory(text, size):
+    assert memory(text) == size
+
+
+def test_unexpected_columns():
+    with pytest.raises(ValueError):
+        parse_sacct("4242|COMPLETED|0:0\n")
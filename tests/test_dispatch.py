@@ -0,0 +1,131 @@
+import os
+import json
+import argparse
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from MDDPN import constants as cs
+from MDDPN import dispatch
+from MDDPN.run import enqueue
+from MDDPN.model import Campaign
+from MDDPN.restart import submitted
+from MDDPN.utils import intent_file, read_state
+
+
+SBATCH = """#!/bin/sh
+echo "$@" >> "{log}"
+echo "Submitted batch job $((1000 + $(wc -l < "{log}")))"
+"""
+
+SQUEUE = """#!/bin/sh
+exit 0
+"""
+
+
+class Crash(BaseException):
+    """Dispatcher killed, nothing after the point it is raised at runs"""
+
+
+def sbatch(in_file, number, label):
+    """What pysbatch_ng does for the dispatcher: sbatch from PATH and the job id it prints"""
+    res = subprocess.run(["sbatch", in_file.as_posix()], capture_output=True, text=True, check=True)
+    return int(res.stdout.split()[-1])
+
+
+@pytest.fixture
+def folder(tmp_path, monkeypatch):
+    bin = tmp_path / "bin"
+    bin.mkdir()
+    log = tmp_path / "sbatch.log"
+    for name, text in (("sbatch", SBATCH.format(log=log)), ("squeue", SQUEUE)):
+        (bin / name).write_text(text)
+        (bin / name).chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin}:{os.environ['PATH']}")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(dispatch, "submit_run", sbatch)
+    monkeypatch.setattr(dispatch.config, "cached_configure", lambda *args: True)
+    monkeypatch.setattr(cs.sp, "args", argparse.Namespace(dry=False, no_auto=True))
+    monkeypatch.setattr(cs.sp, "sconf_main", {})
+
+    folder = tmp_path / "campaign"
+    folder.mkdir()
+    state = {
+        cs.sf.tag: 7,
+        cs.sf.state: "started",
+        cs.sf.run_counter: 1,
+        cs.sf.conffile_path: "conf.json",
+        cs.sf.conffile_format: "json",
+        cs.sf.run_labels: {"main": {cs.sf.begin_step: 0, cs.sf.end_step: 1000, cs.sf.runs: 1,
+                                    "0": {cs.sf.in_file: "main0.lmp", cs.sf.dump_file: "main0", cs.sf.run_no: 1, cs.sf.queued: 1.}}},
+    }
+    with (folder / cs.files.state).open('w') as fp: json.dump(state, fp)
+    monkeypatch.setattr(cs.sp, "cwd", folder)
+    monkeypatch.setattr(cs.sp, "state", state)
+    return folder
+
+
+def segment(folder):
+    return Campaign.from_state(read_state(folder)).label("main").segments[0]
+
+
+def submissions(folder):
+    log = folder.parent / "sbatch.log"
+    return log.read_text().splitlines() if log.exists() else []
+
+
+def test_round_trip(folder):
+    enqueue(segment(folder), "main", False)
+    assert submitted(read_state(folder)) is not None  # restart does not submit a queued segment again
+
+    assert dispatch.dispatch_once(None, {}) == (1, 0)
+    assert len(submissions(folder)) == 1
+    assert segment(folder).jobid == 1001
+    assert cs.sf.queued not in segment(folder).extra
+    assert not intent_file(7).exists()
+    assert dispatch.dispatch_once(None, {}) == (0, 0)
+
+
+def test_crash_after_submission(folder, monkeypatch):
+    enqueue(segment(folder), "main", False)
+
+    def crash(self, state):
+        raise Crash()
+
+    with monkeypatch.context() as m:
+        m.setattr(Campaign, "to_state", crash)
+        with pytest.raises(Crash):
+            dispatch.dispatch_once(None, {})
+    assert len(submissions(folder)) == 1
+    assert segment(folder).jobid is None
+    assert submitted(read_state(folder)) is not None
+
+    # restart running meanwhile keeps the job in the intent
+    enqueue(segment(folder), "main", False)
+    assert dispatch.dispatch_once(None, {}) == (1, 0)
+    assert len(submissions(folder)) == 1
+    assert segment(folder).jobid == 1001
+    assert not intent_file(7).exists()
+
+
+def test_crash_before_intent_removed(folder, monkeypatch):
+    enqueue(segment(folder), "main", False)
+
+    unlink = Path.unlink
+
+    def crash(self, *args, **kwargs):
+        if self == intent_file(7): raise Crash()
+        unlink(self, *args, **kwargs)
+
+    with monkeypatch.context() as m:
+        m.setattr(Path, "unlink", crash)
+        with pytest.raises(Crash):
+            dispatch.dispatch_once(None, {})
+    assert segment(folder).jobid == 1001
+    assert intent_file(7).exists()
+
+    # the outdated intent is dropped without a submission
+    assert dispatch.dispatch_once(None, {}) == (0, 1)
+    assert len(submissions(folder)) == 1
+    assert not intent_file(7).exists()
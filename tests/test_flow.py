@@ -0,0 +1,96 @@
+import pytest
+
+from MDDPN import constants as cs
+from MDDPN import includes
+from MDDPN.flow import Interpreter, Dynamic
+
+
+def steps(text, variables=None, fixed=None, start=0):
+    interpreter = Interpreter(variables or {}, fixed or {})
+    interpreter.step = start
+    return interpreter.block(text.splitlines(keepends=True))
+
+
+def test_formulas():
+    interpreter = Interpreter({"N": 4}, {})
+    assert interpreter.evaluate("2^3 + 10 % 4 - -1") == 11
+    assert interpreter.evaluate("sqrt(v_N) * PI / PI") == 2
+    assert interpreter.evaluate("N > 2 && !(N == 3) || 0") == 1
+    assert interpreter.evaluate("1 < N <= 4") == 1
+    assert interpreter.evaluate("ternary(N > 5, 10, 20)") == 20
+
+
+@pytest.mark.parametrize("expr", ["__import__('os')", "(1).__class__", "[1, 2]", "'a' * 3", "lambda: 1", "pe / 2", "c_msd[4]"])
+def test_formulas_not_evaluated(expr):
+    with pytest.raises(Dynamic):
+        Interpreter({}, {}).evaluate(expr)
+
+
+def test_loop():
+    text = """variable a loop 3
+label loop
+run 100
+next a
+jump SELF loop
+run 50
+"""
+    assert steps(text) == 350
+
+
+def test_nested_loops():
+    text = """variable i loop 2
+label outer
+variable j loop 3
+label inner
+run $(10 * v_i)
+next j
+jump SELF inner
+variable j delete
+next i
+jump SELF outer
+"""
+    assert steps(text) == 3 * 10 + 3 * 20
+
+
+def test_index_and_if():
+    text = """variable T index 300 400
+variable nsteps equal 1000
+label again
+if "${T} > 350" then "run ${nsteps}" else "run 10"
+next T
+jump SELF again
+"""
+    assert steps(text) == 1010
+
+
+def test_string_comparison():
+    text = """variable style string fene
+if "${style} == fene" then "run 7" elif "${style} == harmonic" "run 8" else "run 9"
+"""
+    assert steps(text) == 7
+
+
+def test_run_upto():
+    assert steps("run 500\nrun 2000 upto\nrun 100\n", start=1000) == 500 + 500 + 100
+
+
+def test_dynamic_label():
+    assert steps("variable t equal temp\nif \"${t} > 10\" then \"run 100\"\n") is None
+    assert steps("run 10 upto\n", start=None) is None
+
+
+def test_fixed_variables():
+    text = "variable n equal 100\nrun ${n}\n"
+    assert steps(text, variables={"n": 250}, fixed={"n": 250}) == 250
+    assert steps(text) == 100
+
+
+def test_includes(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(cs.sp, "cwd", tmp_path)
+    templates = tmp_path / cs.folders.in_templates
+    (templates / "parts").mkdir(parents=True)
+    (templates / "parts" / "equil.lmp").write_text("variable k loop 2\nlabel eq\nrun 100\nnext k\njump SELF eq\n")
+    (templates / "main.lmp").write_text("include parts/equil.lmp\nrun 250 &\n  upto\nrun 1\n")
+    lines = [line for _, line in includes.expand(templates / "main.lmp")]
+    assert steps("".join(lines), start=0) == 200 + 50 + 1